@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Measure the startup and health probe latency with a long history of migrations.
+
+Run it with ``poetry run python devel/benchmarks/migrations.py``.
+"""
+
+import logging
+import os
+import tempfile
+import time
+import timeit
+
+import alembic.command
+from alembic.config import Config as AlembicConfig
+from alembic.script import ScriptDirectory
+
+from sqlalchemy_helpers.manager import DatabaseManager
+
+
+REVISIONS = 500
+NUMBER = 20
+
+REVISION_TEMPLATE = '''"""Revision {revision}"""
+
+revision = "{revision}"
+down_revision = {down_revision!r}
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    pass
+
+
+def downgrade():
+    pass
+'''
+
+
+def make_revisions(alembic_location):
+    versions = os.path.join(alembic_location, "versions")
+    down_revision = None
+    for index in range(REVISIONS):
+        revision = f"rev{index:05d}"
+        with open(os.path.join(versions, f"{revision}.py"), "w") as revision_file:
+            revision_file.write(
+                REVISION_TEMPLATE.format(revision=revision, down_revision=down_revision)
+            )
+        down_revision = revision
+    # Recent modification times are not cached, see ScriptCache.
+    mtime = time.time() - 60
+    os.utime(versions, (mtime, mtime))
+
+
+def report(name, statement, namespace):
+    duration = min(timeit.repeat(statement, globals=namespace, number=NUMBER, repeat=5))
+    print(f"{name:<40} {duration / NUMBER * 1e3:8.3f} ms/call")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        alembic_location = os.path.join(tmpdir, "alembic")
+        alembic_cfg = AlembicConfig(os.path.join(alembic_location, "alembic.ini"))
+        alembic.command.init(alembic_cfg, alembic_location)
+        make_revisions(alembic_location)
+        alembic_cfg.set_main_option("script_location", alembic_location)
+        manager = DatabaseManager(f"sqlite:///{tmpdir}/bench.sqlite", alembic_location)
+        manager.sync()
+        # Alembic's env.py configures the logging of each migration context.
+        logging.disable(logging.INFO)
+        namespace = {
+            "ScriptDirectory": ScriptDirectory,
+            "alembic_cfg": alembic_cfg,
+            "manager": manager,
+        }
+
+        print(f"{REVISIONS} revisions")
+        report(
+            "ScriptDirectory.get_current_head()",
+            "ScriptDirectory.from_config(alembic_cfg).get_current_head()",
+            namespace,
+        )
+        report(
+            "startup: get_latest_revision() (cold)",
+            "manager._script_cache.clear(); manager.get_latest_revision()",
+            namespace,
+        )
+        report("probe: get_latest_revision()", "manager.get_latest_revision()", namespace)
+        report("probe: get_status()", "manager.get_status()", namespace)
+
+
+if __name__ == "__main__":
+    main()
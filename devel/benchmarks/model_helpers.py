@@ -0,0 +1,55 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Measure the per-call overhead of the ``Model.get_*`` helpers.
+
+Run it with ``poetry run python devel/benchmarks/model_helpers.py``.
+"""
+
+import tempfile
+import timeit
+
+import sqlalchemy as sa
+
+from sqlalchemy_helpers.manager import Base, DatabaseManager, session_and_model_property
+
+
+NUMBER = 200_000
+
+
+class BenchUser(Base):
+    __tablename__ = "bench_users"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.Unicode(254), nullable=False)
+
+
+def noop(pk, *, session, model):
+    return pk
+
+
+def report(name, statement, namespace):
+    duration = min(timeit.repeat(statement, globals=namespace, number=NUMBER, repeat=5))
+    print(f"{name:<30} {duration / NUMBER * 1e9:8.0f} ns/call")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as alembic_location:
+        manager = DatabaseManager("sqlite://", alembic_location)
+    Base.metadata.create_all(bind=manager.engine)
+    session = manager.Session()
+    # Keep a reference, the identity map only holds weak references.
+    user = BenchUser(id=1, name="dummy")
+    session.add(user)
+    session.flush()
+    BenchUser.noop = session_and_model_property(manager.Session, noop)
+    namespace = {"BenchUser": BenchUser, "noop": noop, "session": session, "user": user}
+
+    report("direct call", "noop(1, session=session, model=BenchUser)", namespace)
+    report("Model.noop()", "BenchUser.noop(1)", namespace)
+    report("Model.get_by_pk() (in session)", "BenchUser.get_by_pk(1)", namespace)
+
+
+if __name__ == "__main__":
+    main()
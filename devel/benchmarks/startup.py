@@ -0,0 +1,93 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""Measure the import time of the library and the startup time of a Flask app.
+
+Each measurement runs in a fresh interpreter, so that nothing is already imported.
+
+Run it with ``poetry run python devel/benchmarks/startup.py``.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+
+REPEAT = 10
+
+MODELS = """
+from sqlalchemy import Column, Integer, Unicode
+
+from sqlalchemy_helpers import Base
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(254), index=True, unique=True, nullable=False)
+"""
+
+INIT_APP_SETUP = """
+from flask import Flask
+from sqlalchemy_helpers.flask_ext import DatabaseExtension
+
+app = Flask(__name__)
+app.config.update(
+    SQLALCHEMY_DATABASE_URI="sqlite:///{tmpdir}/bench.sqlite",
+    DB_ALEMBIC_LOCATION="{tmpdir}/alembic",
+    DB_MODELS_LOCATION="bench_models",
+    DB_LAZY={lazy},
+)
+"""
+
+TIMED = """
+import time
+
+{setup}
+start = time.perf_counter()
+{statement}
+print(time.perf_counter() - start)
+"""
+
+
+def run(setup, statement, env):
+    durations = []
+    for _i in range(REPEAT):
+        output = subprocess.run(  # noqa: S603
+            [sys.executable, "-c", TIMED.format(setup=setup, statement=statement)],
+            check=True,
+            capture_output=True,
+            text=True,
+            env=env,
+        ).stdout
+        durations.append(float(output))
+    return min(durations)
+
+
+def report(name, setup, statement, env):
+    print(f"{name:<40} {run(setup, statement, env) * 1e3:8.3f} ms")
+
+
+def main():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        with open(os.path.join(tmpdir, "bench_models.py"), "w") as models_file:
+            models_file.write(MODELS)
+        env = {
+            **os.environ,
+            "PYTHONPATH": os.pathsep.join([tmpdir, os.environ.get("PYTHONPATH", "")]),
+        }
+        report("import sqlalchemy_helpers", "", "import sqlalchemy_helpers", env)
+        for lazy in (False, True):
+            report(
+                f"init_app() with DB_LAZY={lazy}",
+                INIT_APP_SETUP.format(tmpdir=tmpdir, lazy=lazy),
+                "DatabaseExtension(app)",
+                env,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+Add a share_engine argument to share the engines between the database managers of the same database, and add a dispose() method
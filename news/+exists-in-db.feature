@@ -0,0 +1 @@
+Check the existence of tables and columns without reflecting the whole database, and add exists_in_db_many()
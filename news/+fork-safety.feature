@@ -0,0 +1 @@
+Replace the connection pools in the child processes of a fork
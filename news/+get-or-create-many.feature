@@ -0,0 +1 @@
+Add a `get_or_create_many()` function to get or create many instances in a single query and flush
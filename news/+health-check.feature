@@ -0,0 +1 @@
+Add a cached health check of the database with a Flask view and a FastAPI router
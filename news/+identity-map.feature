@@ -0,0 +1 @@
+Look up instances in the identity map when the query helpers filter on the primary key
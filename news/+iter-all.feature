@@ -0,0 +1 @@
+Add an `iter_all()` function to iterate over large tables in chunks with keyset pagination
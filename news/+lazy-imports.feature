@@ -0,0 +1 @@
+Import the package's exports and Alembic on first use, to make ``import sqlalchemy_helpers`` faster
@@ -0,0 +1 @@
+Add a ``lazy`` option to create the engines and import the models on first use
@@ -0,0 +1 @@
+Connection pool and statement metrics with a pluggable sink
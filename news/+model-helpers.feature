@@ -0,0 +1 @@
+Cache the model helpers bound to each model instead of building them on every attribute access
@@ -0,0 +1 @@
+Add MultiDatabaseManager to check and migrate many databases concurrently
@@ -0,0 +1 @@
+N+1 query detector for Flask requests and FastAPI sessions
@@ -0,0 +1 @@
+Keyset pagination with opaque cursors for Flask and FastAPI list views
@@ -0,0 +1 @@
+Replica health checks with replication lag detection and latency-weighted routing
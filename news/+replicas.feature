@@ -0,0 +1 @@
+Read replicas support with round-robin or least-connections routing and read-your-writes
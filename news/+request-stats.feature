@@ -0,0 +1 @@
+Per-request database statistics, Server-Timing header and statement budget in the Flask extension
@@ -0,0 +1 @@
+Add an optional cross-session cache for `get_by_pk()`, configurable per model
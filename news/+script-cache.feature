@@ -0,0 +1 @@
+Cache the Alembic script directory and head revision until the migrations change
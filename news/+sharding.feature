@@ -0,0 +1 @@
+Horizontal sharding of models across several databases, with parallel fan-out queries
@@ -0,0 +1 @@
+Slow query log with statement fingerprints and origin tagging
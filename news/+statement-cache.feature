@@ -0,0 +1 @@
+Cache the statements built by the query helpers
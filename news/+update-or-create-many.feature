@@ -0,0 +1 @@
+Add an `update_or_create_many()` function that inserts or updates rows in chunks with multi-row upsert statements
@@ -0,0 +1 @@
+Add an `upsert` mode to `update_or_create()` that uses a single `INSERT ... ON CONFLICT DO UPDATE` statement
@@ -0,0 +1 @@
+Add ``AsyncDatabaseManager.warm_up()`` and a FastAPI lifespan to open the pooled connections on startup
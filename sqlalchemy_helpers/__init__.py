@@ -10,31 +10,85 @@ Attributes:
     __version__ (str): this package's version.
 """
 
-from .manager import (
-    Base,
-    DatabaseManager,
-    DatabaseStatus,
-    exists_in_db,
-    get_base,
-    get_or_create,
-    is_sqlite,
-    SyncResult,
-    update_or_create,
-)
-
-
-# Set the version
-try:
-    import importlib.metadata
-
-    __version__ = importlib.metadata.version("sqlalchemy_helpers")
-except ImportError:
+import importlib
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:  # pragma: no cover
+    from .manager import (
+        Base,
+        clear_inspection_cache,
+        DatabaseManager,
+        DatabaseStatus,
+        exists_in_db,
+        exists_in_db_many,
+        get_base,
+        get_or_create,
+        get_or_create_many,
+        is_sqlite,
+        iter_all,
+        SyncResult,
+        update_or_create,
+        update_or_create_many,
+        UpsertResult,
+    )
+    from .pagination import InvalidCursor, Page, paginate
+
+
+# The exports are imported on first access (PEP 562), so that importing this package stays cheap
+# for the processes that only use some of it.
+_EXPORTS = {
+    "Base": "manager",
+    "clear_inspection_cache": "manager",
+    "DatabaseManager": "manager",
+    "DatabaseStatus": "manager",
+    "exists_in_db": "manager",
+    "exists_in_db_many": "manager",
+    "get_base": "manager",
+    "get_or_create": "manager",
+    "get_or_create_many": "manager",
+    "is_sqlite": "manager",
+    "iter_all": "manager",
+    "SyncResult": "manager",
+    "update_or_create": "manager",
+    "update_or_create_many": "manager",
+    "UpsertResult": "manager",
+    "InvalidCursor": "pagination",
+    "Page": "pagination",
+    "paginate": "pagination",
+}
+
+__all__ = [*_EXPORTS, "__version__"]
+
+
+def __getattr__(name):
+    if name == "__version__":
+        value = _get_version()
+    elif name in _EXPORTS:
+        module = importlib.import_module(f".{_EXPORTS[name]}", __name__)
+        value = getattr(module, name)
+    else:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted({*globals(), *__all__})
+
+
+def _get_version():
     try:
-        import pkg_resources
+        import importlib.metadata
 
-        try:
-            __version__ = pkg_resources.get_distribution("sqlalchemy_helpers").version
-        except pkg_resources.DistributionNotFound:
-            __version__ = None
+        return importlib.metadata.version("sqlalchemy_helpers")
     except ImportError:
-        __version__ = None
+        try:
+            import pkg_resources
+
+            try:
+                return pkg_resources.get_distribution("sqlalchemy_helpers").version
+            except pkg_resources.DistributionNotFound:
+                return None
+        except ImportError:
+            return None
@@ -11,20 +11,60 @@ Attributes:
     Base (object): SQLAlchemy's base class for models.
 """
 
+import asyncio
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import suppress
+from dataclasses import dataclass, field
 from functools import wraps
 from typing import Union
 
-from alembic import command
-from alembic.migration import MigrationContext
 from sqlalchemy import exc as sa_exc
-from sqlalchemy import select
+from sqlalchemy import func, select, text
+from sqlalchemy import inspect as sa_inspect
 from sqlalchemy.engine import make_url, URL
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 
-from .manager import Base, DatabaseManager, model_property, SyncResult
+from .cache import identity_in_session, result_cache
+from .engines import engine_registry, protect_from_fork
+from .health import get_pool_status
+from .manager import (
+    _compare_revisions,
+    _exists_in_db,
+    _exists_in_db_many,
+    _get_inspector,
+    _iter_all_query,
+    _key_criterion,
+    _key_of,
+    _keyset_after,
+    _LazySessionmaker,
+    _match_or_build,
+    _normalize_key,
+    _one_or_raise,
+    _primary_key_from_attrs,
+    _record_identity_map_lookup,
+    _upsert_chunks,
+    _upsert_keys,
+    _upsert_many_statement,
+    _upsert_result,
+    _upsert_returning,
+    _upsert_returns_created,
+    _upsert_returns_row,
+    _upsert_statement,
+    Base,
+    DatabaseManager,
+    model_property,
+    statement_cache,
+    SyncResult,
+    UpsertResult,
+)
+from .multi import _future_result, _make_manager, _timed, MultiDatabaseManager
+from .pagination import _make_page, _page_statement, _total_from_result, _total_statement
+from .querylog import query_origin, tag_origin
+from .replicas import _check_replica
 
 
 _log = logging.getLogger(__name__)
@@ -51,6 +91,46 @@ def _async_from_sync_url(url: Union[URL, str]) -> URL:
     return sync_url.set(drivername=f"{dialect}+{driver}")
 
 
+def _run_async_action(manager_class, uri, alembic_location, engine_args, base_model, action, args):
+    """Run an asynchronous manager's method on a database, in a worker process."""
+
+    async def run():
+        with _timed(action, uri) as database_result:
+            manager = _make_manager(
+                manager_class, uri, alembic_location, engine_args, base_model, action
+            )
+            try:
+                database_result.result = await getattr(manager, action)(*args)
+            finally:
+                await manager.dispose()
+        return database_result
+
+    return asyncio.run(run())
+
+
+@dataclass
+class WarmUpResult:
+    """The result of :meth:`AsyncDatabaseManager.warm_up`."""
+
+    connections: int
+    """The number of connections that were opened and validated."""
+    duration: float
+    """The time it took for the connection pools to be ready, in seconds."""
+    errors: list = field(default_factory=list)
+    """The errors that prevented some connections from being opened or validated."""
+
+
+def _warm_up_size(engine, connections):
+    """Get the number of connections to open in an engine's pool."""
+    pool_status = get_pool_status(engine)
+    if pool_status is None:
+        return connections or 1
+    if connections is None:
+        return pool_status.size
+    # The connections above the pool size would be closed when returned to the pool
+    return min(connections, pool_status.size)
+
+
 class AsyncDatabaseManager(DatabaseManager):
     """Helper for a SQLAlchemy and Alembic-powered database, asynchronous version.
 
@@ -58,23 +138,83 @@ class AsyncDatabaseManager(DatabaseManager):
         uri (str): the database URI
         alembic_location (str): a path to the alembic directory
         engine_args (dict): additional arguments passed to ``create_async_engine``
+        replica_uris (list): the URIs of the replica databases that read queries are sent to
+        replica_strategy (str): how to choose a replica, see
+            :class:`sqlalchemy_helpers.replicas.ReplicaRouter`
+        read_your_writes (float): the number of seconds after a commit during which read queries
+            are sent to the primary database
+        max_replica_lag (float): the replication lag in seconds above which a replica is taken out
+            of rotation, see :meth:`check_replicas`
+        shards (dict): the URIs of the shard databases by shard id, the database at ``uri`` is
+            then used for the models that are not sharded
+        shard_keys (dict): the shard key functions by model class, see
+            :class:`sqlalchemy_helpers.sharding.ShardMap`
+        share_engine (bool): whether to share the engines with the other managers of the process
+            that use the same URI and engine arguments, see :meth:`dispose`. Defaults to ``False``
+            because the connections of an async engine can only be used in the event loop that
+            opened them.
+        lazy (bool): whether to wait until they are used to create the engines and to parse the
+            Alembic configuration, which makes the startup faster
 
     Attributes:
         alembic_cfg (alembic.config.Config): the Alembic configuration object
         engine (sqlalchemy.engine.Engine): the SQLAlchemy Engine instance
+        shard_engines (dict): the SQLAlchemy Engine instances of the shards by shard id
         Session (sqlalchemy.orm.scoped_session): the SQLAlchemy scoped session factory
+        n_plus_one_detector (sqlalchemy_helpers.nplusone.NPlusOneDetector or None): the N+1
+            query detector, if enabled with :meth:`detect_n_plus_one`
     """
 
-    def __init__(self, uri, alembic_location, *, engine_args=None, base_model=None):
-        super().__init__(uri, alembic_location, engine_args=engine_args)
-        self.Session = sessionmaker(
-            class_=AsyncSession, expire_on_commit=False, bind=self.engine, future=True
+    def __init__(
+        self,
+        uri,
+        alembic_location,
+        *,
+        engine_args=None,
+        base_model=None,
+        replica_uris=None,
+        replica_strategy="round-robin",
+        read_your_writes=2.0,
+        max_replica_lag=30.0,
+        shards=None,
+        shard_keys=None,
+        share_engine=False,
+        lazy=False,
+    ):
+        super().__init__(
+            uri,
+            alembic_location,
+            engine_args=engine_args,
+            replica_uris=replica_uris,
+            replica_strategy=replica_strategy,
+            read_your_writes=read_your_writes,
+            max_replica_lag=max_replica_lag,
+            shards=shards,
+            shard_keys=shard_keys,
+            share_engine=share_engine,
+            lazy=lazy,
         )
+        self.Session = _LazySessionmaker(self) if lazy else self._sessionmaker
         self._base_model = base_model or Base
         self._base_model.get_by_pk = model_property(get_by_pk)
         self._base_model.get_one = model_property(get_one)
         self._base_model.get_or_create = model_property(get_or_create)
+        self._base_model.get_or_create_many = model_property(get_or_create_many)
         self._base_model.update_or_create = model_property(update_or_create)
+        self._base_model.update_or_create_many = model_property(update_or_create_many)
+        self._base_model.iter_all = model_property(iter_all)
+
+    def _make_sessionmaker(self):
+        session_args = self._session_args()
+        if "class_" in session_args:
+            session_args["sync_session_class"] = session_args.pop("class_")
+        return sessionmaker(
+            class_=AsyncSession,
+            expire_on_commit=False,
+            bind=self.engine,
+            future=True,
+            **session_args,
+        )
 
     def _make_engine(self, uri, engine_args):
         """Create the SQLAlchemy engine.
@@ -86,23 +226,148 @@ class AsyncDatabaseManager(DatabaseManager):
         Returns:
             sqlalchemy.ext.asyncio.AsyncEngine: the SQLAlchemy engine
         """
-        engine_args = engine_args or {}
-        engine_args["url"] = _async_from_sync_url(uri)
-        return create_async_engine(**engine_args)
+        engine_args = {**(engine_args or {}), "url": _async_from_sync_url(uri)}
+        if self._share_engine:
+            engine = engine_registry.acquire(create_async_engine, engine_args)
+        else:
+            engine = create_async_engine(**engine_args)
+        protect_from_fork(engine)
+        return engine
+
+    async def dispose(self):
+        """Stop using the database.
+
+        See :meth:`sqlalchemy_helpers.manager.DatabaseManager.dispose`.
+        """
+        if self._disposed:
+            return
+        self._disposed = True
+        if "engine" not in self.__dict__:
+            # A lazy manager that was never used
+            return
+        self._remove_listeners()
+        await self.stop_replica_checks()
+        if self._shard_executor is not None:
+            self._shard_executor.shutdown()
+        for engine in self._all_engines():
+            if engine_registry.release(engine):
+                await engine.dispose()
+
+    async def warm_up(self, connections=None, *, statements=()):
+        """Open and validate connections, so that the first requests don't have to.
+
+        The connections are opened concurrently in the pools of the engines, including those of
+        the replicas and shards, and then returned to the pools. The hot statements are run on each
+        connection, so that their compiled form and, with asyncpg, their prepared statement are
+        cached. They are rolled back, but they should not have side effects.
+
+        Args:
+            connections (int or None): the number of connections to open in each pool, at most the
+                pool size. Defaults to the pool size.
+            statements (list): the hot statements, as SQLAlchemy executables or strings.
+
+        Returns:
+            WarmUpResult: the number of connections and the time it took to open them.
+        """
+        start = time.perf_counter()
+        statements = [text(stmt) if isinstance(stmt, str) else stmt for stmt in statements]
+
+        async def open_connection(engine):
+            connection = await engine.connect().start()
+            try:
+                await connection.execute(text("SELECT 1"))
+                for statement in statements:
+                    await connection.execute(statement)
+            except BaseException:
+                await connection.close()
+                raise
+            return connection
+
+        # Keep the connections open until they are all open, or the pool would reuse them.
+        results = await asyncio.gather(
+            *[
+                open_connection(engine)
+                for engine in self._all_engines()
+                for _i in range(_warm_up_size(engine, connections))
+            ],
+            return_exceptions=True,
+        )
+        result = WarmUpResult(connections=0, duration=0.0)
+        for connection in results:
+            # Cancellations are returned too, they are not Exceptions
+            if isinstance(connection, BaseException):
+                result.errors.append(f"{type(connection).__name__}: {connection}")
+                continue
+            await connection.close()
+            result.connections += 1
+        result.duration = time.perf_counter() - start
+        _log.info("Warmed up %d database connections in %.3fs", result.connections, result.duration)
+        for error in result.errors:
+            _log.warning("Could not warm up a database connection: %s", error)
+        return result
+
+    async def check_replicas(self):
+        """Check the health and the replication lag of the replicas.
+
+        See :meth:`sqlalchemy_helpers.manager.DatabaseManager.check_replicas`.
+
+        Returns:
+            list: the :class:`sqlalchemy_helpers.replicas.ReplicaHealth` of each replica.
+        """
+        for index, engine in enumerate(self.replica_engines):
+            start = time.perf_counter()
+            try:
+                async with engine.connect() as connection:
+                    lag = await connection.run_sync(_check_replica)
+            except Exception as e:
+                self._record_replica_failure(index, e)
+            else:
+                self.replica_router.record_check(index, time.perf_counter() - start, lag)
+        return self.get_replica_status()
+
+    def start_replica_checks(self, interval=10.0):
+        """Check the replicas periodically in a background task of the running event loop.
+
+        Args:
+            interval (float): the number of seconds between two checks.
+        """
+        if self._replica_checks is not None:
+            self._replica_checks.cancel()
+
+        async def run():
+            while True:
+                await self.check_replicas()
+                await asyncio.sleep(interval)
+
+        self._replica_checks = asyncio.get_running_loop().create_task(run())
+
+    async def stop_replica_checks(self):
+        """Stop the periodic checks of the replicas."""
+        if self._replica_checks is None:
+            return
+        task = self._replica_checks
+        self._replica_checks = None
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+
+    def configured_connection(self, f, alembic_cfg=None):
+        alembic_cfg = alembic_cfg or self.alembic_cfg
 
-    def configured_connection(self, f):
         @wraps(f)
         def wrapper(sync_connection):
-            self.alembic_cfg.attributes["connection"] = sync_connection
+            alembic_cfg.attributes["connection"] = sync_connection
             try:
                 return f(sync_connection)
             finally:
-                del self.alembic_cfg.attributes["connection"]
+                del alembic_cfg.attributes["connection"]
 
         return wrapper
 
     async def get_current_revision(self, session):
         """Get the current alembic database revision."""
+        from alembic.migration import MigrationContext
+
         alembic_context = MigrationContext.configure(
             url=self.alembic_cfg.get_main_option("sqlalchemy.url")
         )
@@ -118,38 +383,48 @@ class AsyncDatabaseManager(DatabaseManager):
         return current_versions[0]
 
     async def create(self):
-        """Create the database tables."""
+        """Create the database tables, in the shards too."""
+        for engine, alembic_cfg in self._databases():
+            await self._create(engine, alembic_cfg)
 
-        @self.configured_connection
+    async def _create(self, engine, alembic_cfg):
         def _run_stamp(connection):
+            from alembic import command
+
             self._base_model.metadata.create_all(connection)
-            command.stamp(self.alembic_cfg, "head")
+            command.stamp(alembic_cfg, "head")
 
-        async with self.engine.begin() as conn:
-            await conn.run_sync(_run_stamp)
+        async with engine.begin() as conn:
+            await conn.run_sync(self.configured_connection(_run_stamp, alembic_cfg))
 
     async def upgrade(self, target="head"):
-        """Upgrade the database schema."""
+        """Upgrade the database schema, in the shards too."""
+        for engine, alembic_cfg in self._databases():
+            await self._upgrade(engine, alembic_cfg, target)
 
-        @self.configured_connection
+    async def _upgrade(self, engine, alembic_cfg, target="head"):
         def _run_upgrade(_conn):
-            command.upgrade(self.alembic_cfg, target)
+            from alembic import command
 
-        async with self.engine.begin() as conn:
-            await conn.run_sync(_run_upgrade)
+            command.upgrade(alembic_cfg, target)
+
+        async with engine.begin() as conn:
+            await conn.run_sync(self.configured_connection(_run_upgrade, alembic_cfg))
 
     async def drop(self):
-        """Drop all the database tables."""
+        """Drop all the database tables, in the shards too."""
 
-        @self.configured_connection
         def _run_drop(connection):
+            from alembic.migration import MigrationContext
+
             self._base_model.metadata.drop_all(connection)
             # Also drop the Alembic version table
             alembic_context = MigrationContext.configure(connection)
             alembic_context._version.drop(bind=connection)
 
-        async with self.engine.begin() as conn:
-            await conn.run_sync(_run_drop)
+        for engine, alembic_cfg in self._databases():
+            async with engine.begin() as conn:
+                await conn.run_sync(self.configured_connection(_run_drop, alembic_cfg))
 
     async def get_status(self):
         """Get the status of the database.
@@ -160,47 +435,228 @@ class AsyncDatabaseManager(DatabaseManager):
             current = await self.get_current_revision(session=session)
         return self._compare_to_latest(current)
 
+    async def get_shard_status(self):
+        """Get the status of the shards.
+
+        Returns:
+            dict: the :class:`DatabaseStatus` members by shard id.
+        """
+        return {
+            shard_id: self._compare_to_latest(await self._get_engine_revision(engine))
+            for shard_id, engine in self.shard_engines.items()
+        }
+
+    async def _get_engine_revision(self, engine):
+        def _get_revision(connection):
+            from alembic.migration import MigrationContext
+
+            return MigrationContext.configure(connection).get_current_revision()
+
+        async with engine.connect() as conn:
+            return await conn.run_sync(_get_revision)
+
     async def sync(self):
         """Create or update the database schema.
 
+        The shards are synced too, see :meth:`sync_shards`.
+
         Returns:
-            SyncResult member: see :class:`SyncResult`.
+            SyncResult member: see :class:`SyncResult`, for the database at the manager's URI.
         """
         async with self.Session() as session:
             current_rev = await self.get_current_revision(session)
+        result = await self._sync(self.engine, self.alembic_cfg, current_rev)
+        await self.sync_shards()
+        return result
+
+    async def sync_shards(self):
+        """Create or update the database schema of the shards.
+
+        Returns:
+            dict: the :class:`SyncResult` members by shard id.
+        """
+        return {
+            shard_id: await self._sync(
+                engine, self._shard_alembic_cfgs[shard_id], await self._get_engine_revision(engine)
+            )
+            for shard_id, engine in self.shard_engines.items()
+        }
+
+    async def _sync(self, engine, alembic_cfg, current_rev):
         # If the database is empty, it should be created ; otherwise it should
         # be upgraded.
         if current_rev is None:
-            await self.create()
+            await self._create(engine, alembic_cfg)
             return SyncResult.CREATED
         elif current_rev == self.get_latest_revision():
             return SyncResult.ALREADY_UP_TO_DATE
         else:
-            await self.upgrade()
+            await self._upgrade(engine, alembic_cfg)
             return SyncResult.UPGRADED
 
+    async def fan_out(self, statement, shard_ids=None):
+        """Execute a statement on several shards concurrently.
+
+        See :meth:`sqlalchemy_helpers.manager.DatabaseManager.fan_out`.
+
+        Args:
+            statement (sqlalchemy.sql.Executable): the statement to execute.
+            shard_ids (list or None): the shards to query, defaults to all the shards.
+
+        Returns:
+            sqlalchemy.engine.Result: the results of all the shards.
+
+        Raises:
+            ValueError: if there is no shard to query.
+        """
+        shard_ids = list(self.shard_engines) if shard_ids is None else shard_ids
+        if not shard_ids:
+            raise ValueError("There is no shard to query")
+
+        async def execute(shard_id):
+            async with AsyncSession(self.shard_engines[shard_id], autoflush=False) as session:
+                return (await session.execute(statement)).freeze()
+
+        frozen = await asyncio.gather(*(execute(shard_id) for shard_id in shard_ids))
+        results = [frozen_result() for frozen_result in frozen]
+        return results[0].merge(*results[1:])
+
+
+class AsyncMultiDatabaseManager(MultiDatabaseManager):
+    """Manage the schema of several databases that share the same Alembic migrations, asynchronous
+    version.
+
+    The databases are handled concurrently with ``asyncio.gather()``, at most ``max_workers`` at
+    the same time. See :class:`sqlalchemy_helpers.multi.MultiDatabaseManager`.
+
+    Args:
+        uris (list): the database URIs
+        alembic_location (str): a path to the alembic directory
+        engine_args (dict): additional arguments passed to ``create_async_engine``
+        base_model: the declarative base of the models to create in new databases
+        max_workers (int): the maximum number of databases handled at the same time
+    """
+
+    manager_class = AsyncDatabaseManager
+    _worker = staticmethod(_run_async_action)
+
+    async def get_status(self):
+        """Get the status of the databases.
+
+        Returns:
+            list: a :class:`~sqlalchemy_helpers.multi.DatabaseResult` per database, with a
+            :class:`~sqlalchemy_helpers.manager.DatabaseStatus` member as result.
+        """
+        latest = self.get_latest_revision()
+        semaphore = asyncio.Semaphore(self.max_workers)
+
+        def _get_revision(connection):
+            from alembic.migration import MigrationContext
+
+            return MigrationContext.configure(connection).get_current_revision()
+
+        async def get_status(uri):
+            async with semaphore:
+                with _timed("get the status of", uri) as database_result:
+                    engine_args = dict(self.engine_args or {})
+                    engine_args["url"] = _async_from_sync_url(uri)
+                    engine = create_async_engine(**engine_args)
+                    try:
+                        async with engine.connect() as connection:
+                            current = await connection.run_sync(_get_revision)
+                    finally:
+                        await engine.dispose()
+                    database_result.result = _compare_revisions(current, latest)
+                return database_result
+
+        return list(await asyncio.gather(*(get_status(uri) for uri in self.uris)))
+
+    async def sync(self):
+        """Create or update the schema of the databases.
+
+        Returns:
+            list: a :class:`~sqlalchemy_helpers.multi.DatabaseResult` per database, with a
+            :class:`~sqlalchemy_helpers.manager.SyncResult` member as result.
+        """
+        return await self._run_in_processes("sync")
+
+    async def upgrade(self, target="head"):
+        """Upgrade the schema of the databases.
+
+        Args:
+            target (str): the revision to upgrade to.
+
+        Returns:
+            list: a :class:`~sqlalchemy_helpers.multi.DatabaseResult` per database, with ``None``
+            as result.
+        """
+        return await self._run_in_processes("upgrade", target)
+
+    async def _run_in_processes(self, action, *args):
+        if not self.uris:
+            return []
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_workers)
+        with ProcessPoolExecutor(
+            max_workers=min(self.max_workers, len(self.uris)), mp_context=self._mp_context
+        ) as executor:
+
+            async def run(uri):
+                async with semaphore:
+                    future = loop.run_in_executor(
+                        executor, self._worker, *self._worker_args(uri, action, args)
+                    )
+                    await asyncio.wait([future])
+                    return _future_result(uri, action, future)
+
+            return list(await asyncio.gather(*(run(uri) for uri in self.uris)))
+
 
 # Query helpers
 
 
+@tag_origin("get_by_pk")
 async def get_by_pk(pk, *, session, model):
     """Get a model instance using its primary key.
 
+    If the model is cached in the :data:`~sqlalchemy_helpers.cache.result_cache`, the instance
+    will be looked up in the cache before querying the database.
+
     Example: ``user = get_by_pk(42, session=session, model=User)``
     """
-    return await session.get(model, pk)
-
-
+    if not result_cache.is_cached(model):
+        return await session.get(model, pk)
+    identity, in_session = identity_in_session(session, model, pk)
+    if not in_session:
+        cached = result_cache.load(model, identity)
+        if cached is not None:
+            return await session.merge(cached, load=False)
+    obj = await session.get(model, pk)
+    if obj is not None and not in_session:
+        result_cache.store(obj)
+    return obj
+
+
+@tag_origin("get_one")
 async def get_one(session: AsyncSession, model, **attrs) -> "Base":
     """Get an object from the datbase.
 
+    If the filters are exactly the primary key, the object is looked up in the session's identity
+    map first, and no query is issued if it is already loaded.
+
     :param session: The SQLAlchemy session to use
     :param model: The SQLAlchemy model to query
     :return: the object
     """
-    return (await session.execute(select(model).filter_by(**attrs))).scalar_one()
+    pk = _primary_key_from_attrs(model, attrs)
+    if pk is not None:
+        _record_identity_map_lookup(session, model, pk)
+        return _one_or_raise(await session.get(model, pk))
+    stmt, params = statement_cache.get(model, attrs)
+    return (await session.execute(stmt, params)).scalar_one()
 
 
+@tag_origin("get_or_create")
 async def get_or_create(session, model, **attrs):
     """Function like Django's ``get_or_create()`` method.
 
@@ -223,7 +679,32 @@ async def get_or_create(session, model, **attrs):
     return obj, created
 
 
-async def update_or_create(session, model, defaults=None, create_defaults=None, **attrs):
+@tag_origin("get_or_create_many")
+async def get_or_create_many(session, model, rows, key=None):
+    """Like :func:`get_or_create`, but for many rows at once.
+
+    The existing rows are fetched with a single ``IN`` query and the missing ones are inserted in a
+    single flush. See :func:`sqlalchemy_helpers.manager.get_or_create_many`.
+
+    Example: ``results = await get_or_create_many(session, User, [{"name": "foo"}])``
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    key = _normalize_key(key, rows)
+    result = await session.execute(select(model).where(_key_criterion(model, key, rows)))
+    existing = {_key_of(obj, key): obj for obj in result.scalars()}
+    results, new_objs = _match_or_build(model, key, rows, existing)
+    if new_objs:
+        session.add_all(new_objs)
+        await session.flush()  # get the ids
+    return results
+
+
+@tag_origin("update_or_create")
+async def update_or_create(
+    session, model, defaults=None, create_defaults=None, upsert=False, **attrs
+):
     """Function like Django's ``update_or_create()`` method.
 
     It will return a tuple, the first argument being the instance and the
@@ -234,9 +715,13 @@ async def update_or_create(session, model, defaults=None, create_defaults=None,
 
         user, created = update_or_create(session, User, name="foo", defaults={"full_name": "Foo"})
 
+    If ``upsert`` is ``True``, a single ``INSERT ... ON CONFLICT DO UPDATE`` statement will be used.
+    See :func:`sqlalchemy_helpers.manager.update_or_create`.
     """
     defaults = defaults or {}
     create_defaults = create_defaults or defaults
+    if upsert:
+        return await _upsert(session, model, attrs, defaults, create_defaults)
     try:
         obj = await get_one(session=session, model=model, **attrs)
         for key, value in defaults.items():
@@ -249,3 +734,143 @@ async def update_or_create(session, model, defaults=None, create_defaults=None,
         session.add(obj)
         await session.flush()  # get an id
         return obj, True
+
+
+async def _upsert(session, model, attrs, defaults, create_defaults):
+    dialect = session.get_bind().dialect
+    stmt = _upsert_statement(dialect, model, {**attrs, **create_defaults}, attrs, update=defaults)
+    result = await session.execute(
+        _upsert_returning(dialect, stmt, model), execution_options={"populate_existing": True}
+    )
+    if _upsert_returns_row(dialect):
+        return _upsert_result(dialect, result)
+    # No RETURNING support, get the row with a separate query.
+    query = select(model).filter_by(**attrs).execution_options(populate_existing=True)
+    return (await session.execute(query)).scalar_one(), None
+
+
+@tag_origin("update_or_create_many")
+async def update_or_create_many(
+    session,
+    model,
+    rows,
+    keys=None,
+    defaults_fields=None,
+    chunk_size=1000,
+    return_objects=False,
+):
+    """Insert or update many rows using one multi-row upsert statement per chunk.
+
+    See :func:`sqlalchemy_helpers.manager.update_or_create_many`.
+
+    Example: ``result = await update_or_create_many(session, User, rows, keys="name")``
+    """
+    dialect = session.get_bind().dialect
+    keys = _upsert_keys(model, keys)
+    result = UpsertResult(objects=[] if return_objects else None)
+    for chunk in _upsert_chunks(rows, keys, chunk_size):
+        stmt = _upsert_many_statement(dialect, model, chunk, keys, defaults_fields, return_objects)
+        if _upsert_returns_created(dialect):
+            chunk_result = await session.execute(
+                stmt, execution_options={"populate_existing": True}
+            )
+            result._add_returned_rows(chunk_result.all())
+            continue
+        criterion = _key_criterion(model, keys, chunk)
+        existing = (
+            await session.execute(select(func.count()).select_from(model).where(criterion))
+        ).scalar_one()
+        chunk_result = await session.execute(stmt, execution_options={"populate_existing": True})
+        objects = None
+        if return_objects and _upsert_returns_row(dialect):
+            objects = chunk_result.scalars().all()
+        elif return_objects:
+            query = select(model).where(criterion).execution_options(populate_existing=True)
+            objects = (await session.execute(query)).scalars().all()
+        result._add(len(chunk) - existing, existing, objects)
+    return result
+
+
+async def iter_all(session, model, *, chunk_size=1000, expunge=True, **filters):
+    """Iterate over all the instances of a model, without loading them all in memory.
+
+    Each chunk is streamed with :meth:`AsyncSession.stream`. See
+    :func:`sqlalchemy_helpers.manager.iter_all`.
+
+    Example::
+
+        async for user in iter_all(session, User, chunk_size=500, active=True):
+            await export(user)
+    """
+    query, pk_columns = _iter_all_query(model, chunk_size, filters)
+    chunk_query = query
+    while True:
+        chunk = []
+        with query_origin("iter_all"):
+            result = await session.stream(chunk_query.execution_options(yield_per=chunk_size))
+        async for obj in result.scalars():
+            chunk.append(obj)
+            yield obj
+        if expunge:
+            for obj in chunk:
+                session.expunge(obj)
+        if len(chunk) < chunk_size:
+            return
+        chunk_query = query.where(_keyset_after(pk_columns, sa_inspect(chunk[-1]).identity))
+
+
+@tag_origin("paginate")
+async def paginate(
+    session, stmt, *, order_by, after=None, limit=20, estimate_total=False, max_count=1000
+):
+    """Get a page of results using keyset pagination.
+
+    See :func:`sqlalchemy_helpers.pagination.paginate`.
+
+    Example::
+
+        page = await paginate(session, select(User), order_by=[User.id], after=cursor)
+    """
+    page_stmt, n_columns = _page_statement(stmt, order_by, after, limit)
+    page = _make_page((await session.execute(page_stmt)).all(), n_columns, limit)
+    if estimate_total:
+        dialect = session.get_bind().dialect
+        result = await session.execute(_total_statement(stmt, dialect, max_count))
+        page.total = _total_from_result(result.scalar(), dialect)
+    return page
+
+
+# Migration helpers
+
+
+async def _run_inspection(bind, function, cache, *args):
+    def inspect(connection):
+        return function(_get_inspector(connection, cache), *args)
+
+    if isinstance(bind, AsyncEngine):
+        async with bind.connect() as connection:
+            return await connection.run_sync(inspect)
+    return await bind.run_sync(inspect)
+
+
+async def exists_in_db(bind, tablename, columnname=None, *, cache=False):
+    """Check whether a table and optionally a column exist in the database.
+
+    See :func:`sqlalchemy_helpers.manager.exists_in_db`. The cache is kept per connection, so it is
+    only reused when ``bind`` is an ``AsyncConnection``.
+
+    Example::
+
+        async with engine.connect() as connection:
+            if await exists_in_db(connection, "users", "email"):
+                ...
+    """
+    return await _run_inspection(bind, _exists_in_db, cache, tablename, columnname)
+
+
+async def exists_in_db_many(bind, names, *, cache=False):
+    """Check whether several tables and columns exist in the database.
+
+    See :func:`sqlalchemy_helpers.manager.exists_in_db_many`.
+    """
+    return await _run_inspection(bind, _exists_in_db_many, cache, names)
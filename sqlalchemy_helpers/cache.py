@@ -0,0 +1,267 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Caching of query results across sessions.
+
+This must remain independent from any web framework.
+
+Attributes:
+    result_cache (ResultCache): the process-wide cache used by ``get_by_pk()``.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from itertools import chain
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.session import make_transient_to_detached
+
+
+@dataclass
+class CacheStats:
+    """Hit and miss counters of a cache."""
+
+    hits: int = 0
+    """The number of lookups that were served from the cache."""
+    misses: int = 0
+    """The number of lookups that were not in the cache."""
+
+    def reset(self):
+        """Reset the counters."""
+        self.hits = 0
+        self.misses = 0
+
+
+class CacheBackend:
+    """The interface of the result cache backends.
+
+    The keys are tuples made of the model's qualified name and the primary key values, and the
+    values are dictionaries of column values. Implementations must be thread-safe.
+    """
+
+    def get(self, key):
+        """Get a value from the cache.
+
+        Args:
+            key (tuple): the key to look for.
+
+        Returns:
+            dict or None: the value, or ``None`` if it is not in the cache or has expired.
+        """
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Store a value in the cache.
+
+        Args:
+            key (tuple): the key to store the value at.
+            value (dict): the value to store.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a value from the cache, if present.
+
+        Args:
+            key (tuple): the key to remove.
+        """
+        raise NotImplementedError
+
+    def clear(self):
+        """Remove all the values from the cache."""
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """An in-memory cache backend with LRU and TTL eviction.
+
+    Args:
+        maxsize (int): the maximum number of values to keep.
+        ttl (float): the number of seconds after which a value expires.
+    """
+
+    def __init__(self, maxsize=1000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._values = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._values)
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expires_at, value = self._values[key]
+            except KeyError:
+                return None
+            if expires_at <= time.monotonic():
+                del self._values[key]
+                return None
+            self._values.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._values[key] = (time.monotonic() + self.ttl, value)
+            self._values.move_to_end(key)
+            if len(self._values) > self.maxsize:
+                self._values.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class ResultCache:
+    """A cache of model instances, shared by all the sessions of the process.
+
+    Models are not cached unless a backend is configured for them with :meth:`configure`. Cached
+    instances are invalidated when a session that modified or deleted them commits or rolls back.
+    Changes made outside of the ORM unit of work (bulk updates, other processes) are not detected,
+    set the backend's TTL accordingly.
+
+    Attributes:
+        stats (CacheStats): the hit and miss counters.
+    """
+
+    def __init__(self):
+        self.stats = CacheStats()
+        self._backends = {}
+
+    def configure(self, model, backend):
+        """Cache the instances of a model.
+
+        Args:
+            model (manager.Base): the model class.
+            backend (CacheBackend or None): the backend to store the instances in, or ``None`` to
+                stop caching this model.
+        """
+        if backend is None:
+            self._backends.pop(model, None)
+        else:
+            self._backends[model] = backend
+
+    def is_cached(self, model):
+        """Whether the instances of a model are cached.
+
+        Args:
+            model (manager.Base): the model class.
+
+        Returns:
+            bool: whether a backend has been configured for this model.
+        """
+        return model in self._backends
+
+    def load(self, model, identity):
+        """Get a detached instance from the cache.
+
+        Args:
+            model (manager.Base): the model class.
+            identity (tuple): the primary key values.
+
+        Returns:
+            manager.Base or None: a detached instance, or ``None`` if it is not in the cache.
+        """
+        values = self._backends[model].get(_cache_key(model, identity))
+        if values is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        obj = sa_inspect(model).class_manager.new_instance()
+        for key, value in values.items():
+            set_committed_value(obj, key, value)
+        make_transient_to_detached(obj)
+        return obj
+
+    def store(self, obj):
+        """Store the loaded column values of an instance in the cache.
+
+        Args:
+            obj (manager.Base): a persistent instance of a cached model.
+        """
+        state = sa_inspect(obj)
+        values = {
+            attr.key: state.dict[attr.key]
+            for attr in state.mapper.column_attrs
+            if attr.key in state.dict
+        }
+        self._backends[type(obj)].set(_cache_key(type(obj), state.identity), values)
+
+    def invalidate(self, model, identity):
+        """Remove an instance from the cache.
+
+        Args:
+            model (manager.Base): the model class.
+            identity (tuple): the primary key values.
+        """
+        self._backends[model].delete(_cache_key(model, identity))
+
+    def clear(self):
+        """Remove all the instances from the cache."""
+        for backend in self._backends.values():
+            backend.clear()
+
+
+result_cache = ResultCache()
+
+
+def identity_in_session(session, model, pk):
+    """Get the primary key identity and whether the instance is already in the session.
+
+    Args:
+        session (sqlalchemy.Session or sqlalchemy.ext.asyncio.AsyncSession): the session.
+        model (manager.Base): the model class.
+        pk: the primary key, as accepted by ``Session.get()``.
+
+    Returns:
+        tuple: the primary key values and a boolean.
+    """
+    mapper = sa_inspect(model)
+    if isinstance(pk, dict):
+        identity = tuple(pk[mapper.get_property_by_column(c).key] for c in mapper.primary_key)
+    elif isinstance(pk, (tuple, list)):
+        identity = tuple(pk)
+    else:
+        identity = (pk,)
+    return identity, mapper.identity_key_from_primary_key(identity) in session.identity_map
+
+
+def _cache_key(model, identity):
+    return (f"{model.__module__}.{model.__qualname__}", *identity)
+
+
+# Invalidation
+
+_INVALIDATIONS_KEY = "_sqlah_cache_invalidations"
+
+
+@sa_event.listens_for(Session, "after_flush")
+def _collect_invalidations(session, flush_context):
+    """Remember the cached instances that have been modified or deleted in the transaction."""
+    if not result_cache._backends:
+        return
+    for obj in chain(session.dirty, session.deleted):
+        if result_cache.is_cached(type(obj)):
+            invalidations = session.info.setdefault(_INVALIDATIONS_KEY, set())
+            invalidations.add((type(obj), sa_inspect(obj).identity))
+
+
+@sa_event.listens_for(Session, "after_commit")
+@sa_event.listens_for(Session, "after_rollback")
+def _invalidate(session):
+    """Remove the instances that have been modified or deleted from the cache."""
+    for model, identity in session.info.pop(_INVALIDATIONS_KEY, ()):
+        if result_cache.is_cached(model):
+            result_cache.invalidate(model, identity)
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Sharing of the engines between the database managers of a process.
+
+Creating an engine creates a connection pool, so the managers of the same database can share their
+engines instead of each opening their own connections.
+
+The connections of a pool can't be used by several processes, so the pools of the engines are
+replaced in the child processes of a fork, as pre-fork servers such as gunicorn do.
+
+This must remain independent from any web framework.
+"""
+
+import os
+import threading
+import weakref
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url, URL
+
+
+def _freeze(value):
+    """Make the engine arguments hashable, raise ``TypeError`` if they can't be."""
+    if isinstance(value, URL):
+        # The query of a URL is not hashable on SQLAlchemy 1.4
+        return value.render_as_string(hide_password=False)
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    hash(value)
+    return value
+
+
+def _is_memory_database(url):
+    """Whether the URL is an in-memory SQLite database, private to each engine."""
+    url = make_url(url)
+    if not url.drivername.startswith("sqlite"):
+        return False
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
+class EngineRegistry:
+    """A registry of engines keyed on their URI and arguments, with reference counting.
+
+    The engines with arguments that can't be hashed and the in-memory SQLite databases are not
+    shared. The registry only holds weak references to the engines, so the engines of the managers
+    that are garbage-collected without being disposed are not kept alive.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._engines = {}
+        self._keys = weakref.WeakKeyDictionary()
+
+    def __len__(self):
+        with self._lock:
+            return sum(1 for entry in self._engines.values() if entry[0]() is not None)
+
+    def acquire(self, factory, engine_args):
+        """Get the engine of a database, creating it if it is not in use yet.
+
+        Args:
+            factory (callable): the function that creates the engine, e.g. ``create_engine``.
+            engine_args (dict): the arguments passed to the factory, including the ``url``.
+
+        Returns:
+            sqlalchemy.engine.Engine: the engine, to be released with :meth:`release`.
+        """
+        if _is_memory_database(engine_args["url"]):
+            return factory(**engine_args)
+        try:
+            key = (factory, _freeze(engine_args))
+        except TypeError:
+            return factory(**engine_args)
+        with self._lock:
+            entry = self._engines.get(key)
+            engine = None if entry is None else entry[0]()
+            if engine is not None:
+                entry[1] += 1
+                return engine
+            self._prune()
+            engine = factory(**engine_args)
+            self._engines[key] = [weakref.ref(engine), 1]
+            self._keys[engine] = key
+            return engine
+
+    def release(self, engine):
+        """Stop using an engine.
+
+        Args:
+            engine (sqlalchemy.engine.Engine): the engine returned by :meth:`acquire`.
+
+        Returns:
+            bool: whether the engine is not used anymore and must be disposed.
+        """
+        with self._lock:
+            key = self._keys.get(engine)
+            if key is None:
+                return True
+            entry = self._engines[key]
+            entry[1] -= 1
+            if entry[1] > 0:
+                return False
+            del self._engines[key]
+            del self._keys[engine]
+            return True
+
+    def _prune(self):
+        """Forget the engines that were garbage-collected without being released."""
+        for key in [key for key, entry in self._engines.items() if entry[0]() is None]:
+            del self._engines[key]
+
+
+engine_registry = EngineRegistry()
+"""EngineRegistry: the engines shared by the database managers of the process."""
+
+
+# Fork safety
+
+_fork_protected = weakref.WeakSet()
+
+
+def protect_from_fork(engine):
+    """Make an engine safe to use in the child processes of a fork.
+
+    The pool of the engine is replaced in the child processes, without closing the connections of
+    the parent process. As a safety net, the connections that were opened in another process are
+    discarded when they are checked out.
+
+    Args:
+        engine (sqlalchemy.engine.Engine or sqlalchemy.ext.asyncio.AsyncEngine): the engine.
+    """
+    engine = getattr(engine, "sync_engine", engine)
+    if engine in _fork_protected:
+        return
+    _fork_protected.add(engine)
+    sa_event.listen(engine, "connect", _record_pid)
+    sa_event.listen(engine, "checkout", _check_pid)
+
+
+def _record_pid(dbapi_connection, connection_record):
+    connection_record.info["pid"] = os.getpid()
+
+
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get("pid", pid) != pid:
+        # The socket of the connection is shared with the process that opened it, closing the
+        # connection here would end that process' session too. Drop it instead, as recommended by
+        # SQLAlchemy, so that the pool opens a new one and leaves the other process' copy alone.
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise sa_exc.DisconnectionError(
+            f"The connection was opened by process {connection_record.info['pid']}, "
+            f"not by the current process {pid}"
+        )
+
+
+def _dispose_after_fork():
+    for engine in list(_fork_protected):
+        try:
+            engine.dispose(close=False)
+        except TypeError:  # pragma: no cover
+            # SQLAlchemy < 1.4.33
+            engine.pool = engine.pool.recreate()
+
+
+if hasattr(os, "register_at_fork"):  # pragma: no branch
+    os.register_at_fork(after_in_child=_dispose_after_fork)
@@ -6,13 +6,18 @@
 FastAPI integration of database management.
 """
 
+from contextlib import asynccontextmanager
 from typing import Iterator
 
 import click
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .aio import AsyncDatabaseManager
+from .aio import AsyncDatabaseManager  # noqa: F401
+from .aio import paginate as _paginate
+from .health import AsyncHealthCheck  # noqa: F401
 from .manager import SyncResult
+from .pagination import InvalidCursor
+from .querylog import _enter_origin, _exit_origin
 
 
 def manager_from_config(db_settings, *args, **kwargs):
@@ -44,7 +49,7 @@ async def syncdb(db_settings):
         click.echo(f"Unexpected sync result: {result}", err=True)
 
 
-async def make_db_session(manager) -> Iterator[AsyncSession]:
+async def make_db_session(manager, request=None) -> Iterator[AsyncSession]:
     """Generate database sessions for FastAPI request handlers.
 
     This lets users declare the session as a dependency in request handler
@@ -56,9 +61,16 @@ async def make_db_session(manager) -> Iterator[AsyncSession]:
             result = await db_session.execute(query)
             ...
 
+    If the ``request`` is passed, the statements are tagged with the route's path in the slow
+    query log. If the manager's N+1 query detector is enabled, the statements executed while the
+    session is open are counted.
+
     :return: A :class:`sqlalchemy.ext.asyncio.AsyncSession` object for the
         current request
     """
+    origin = _enter_origin(_route_path(request)) if request is not None else None
+    detector = manager.n_plus_one_detector
+    n_plus_one_scope = detector._enter_scope() if detector is not None else None
     session = manager.Session()
     try:
         yield session
@@ -68,3 +80,118 @@ async def make_db_session(manager) -> Iterator[AsyncSession]:
         raise
     finally:
         await session.close()
+        if n_plus_one_scope is not None:
+            detector._exit_scope(n_plus_one_scope)
+        _exit_origin(origin)
+
+
+async def paginate(
+    session, stmt, *, order_by, after=None, limit=20, estimate_total=False, max_count=1000
+):
+    """Get a page of results using keyset pagination in a FastAPI request handler.
+
+    See :func:`sqlalchemy_helpers.aio.paginate`. The cursor comes from the client, so an invalid
+    one results in a 400 response instead of a server error.
+
+    Raises:
+        fastapi.HTTPException: if the cursor is invalid.
+    """
+    try:
+        return await _paginate(
+            session,
+            stmt,
+            order_by=order_by,
+            after=after,
+            limit=limit,
+            estimate_total=estimate_total,
+            max_count=max_count,
+        )
+    except InvalidCursor as e:
+        from fastapi import HTTPException
+
+        raise HTTPException(status_code=400, detail=str(e)) from e
+
+
+async def check_health(health_check, response):
+    """Check the health of the database in a FastAPI request handler.
+
+    The response has a 503 status code if the database is not ready, e.g.::
+
+        health_check = AsyncHealthCheck(manager)
+
+        @app.get("/healthz/db")
+        async def db_health(response: Response):
+            return await check_health(health_check, response)
+
+    Args:
+        health_check (sqlalchemy_helpers.health.AsyncHealthCheck): the health check.
+        response (fastapi.Response): the response to set the status code on.
+
+    Returns:
+        dict: the :class:`~sqlalchemy_helpers.health.HealthReport` as a dict.
+    """
+    report = await health_check.check()
+    response.status_code = 200 if report.ready else 503
+    return report.as_dict()
+
+
+def make_health_router(health_check, path="/healthz/db"):
+    """Make a FastAPI router with a health check endpoint, like the Flask extension's view.
+
+    The response has a 503 status code if the database is not ready, e.g.::
+
+        app.include_router(make_health_router(AsyncHealthCheck(manager)))
+
+    Args:
+        health_check (sqlalchemy_helpers.health.AsyncHealthCheck): the health check.
+        path (str): the URL of the endpoint.
+
+    Returns:
+        fastapi.APIRouter: the router, to include in the application.
+    """
+    from fastapi import APIRouter, Response
+
+    router = APIRouter()
+
+    @router.get(path)
+    async def db_health(response: Response):
+        return await check_health(health_check, response)
+
+    return router
+
+
+def make_lifespan(manager, *, connections=None, statements=()):
+    """Make a FastAPI lifespan that warms the database connections up and disposes of them.
+
+    The application starts serving requests once the connections are open, e.g.::
+
+        manager = manager_from_config(get_settings().database)
+        app = FastAPI(lifespan=make_lifespan(manager, statements=[select(User).limit(1)]))
+
+    The :class:`~sqlalchemy_helpers.aio.WarmUpResult`, with the time it took for the database to
+    be ready, is stored in ``app.state.db_warm_up``.
+
+    Args:
+        manager (sqlalchemy_helpers.aio.AsyncDatabaseManager): the database manager.
+        connections (int or None): see :meth:`~sqlalchemy_helpers.aio.AsyncDatabaseManager.warm_up`.
+        statements (list): see :meth:`~sqlalchemy_helpers.aio.AsyncDatabaseManager.warm_up`.
+
+    Returns:
+        callable: the lifespan, to pass to the ``FastAPI`` constructor.
+    """
+
+    @asynccontextmanager
+    async def lifespan(app):
+        app.state.db_warm_up = await manager.warm_up(connections, statements=statements)
+        try:
+            yield
+        finally:
+            await manager.dispose()
+
+    return lifespan
+
+
+def _route_path(request):
+    """Get the path template of the route matched by a FastAPI request."""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or request.url.path
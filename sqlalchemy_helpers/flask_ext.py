@@ -7,13 +7,22 @@ Flask integration of database management.
 """
 
 import os
+from dataclasses import dataclass
+from functools import partial
 
 import click
-from flask import abort, current_app, has_app_context
+from flask import abort, current_app, g, has_app_context, has_request_context, request
 from flask.cli import AppGroup
+from sqlalchemy.orm import Query
+from werkzeug.exceptions import InternalServerError
 from werkzeug.utils import find_modules, import_string
 
+from .health import HealthCheck
 from .manager import DatabaseManager, SyncResult
+from .metrics import MetricsSink
+from .pagination import InvalidCursor
+from .pagination import paginate as _paginate
+from .querylog import _enter_origin, _exit_origin
 
 
 def _get_manager(engine_args=None, app=None):
@@ -22,14 +31,55 @@ def _get_manager(engine_args=None, app=None):
     uri = app.config["SQLALCHEMY_DATABASE_URI"]
     alembic_location = app.config["DB_ALEMBIC_LOCATION"]
     base_model = app.extensions[DatabaseExtension._app_base_model_name]
-    manager = DatabaseManager(uri, alembic_location, engine_args=engine_args, base_model=base_model)
+    lazy = app.config["DB_LAZY"]
+    if lazy:
+        _import_models(app)
+    manager = DatabaseManager(
+        uri, alembic_location, engine_args=engine_args, base_model=base_model, lazy=lazy
+    )
+    # The listeners need the engine, wait until a lazy manager creates it.
+    if app.config["DB_N_PLUS_ONE"]:
+        manager._when_engines_ready(
+            partial(
+                _detect_n_plus_one,
+                threshold=app.config["DB_N_PLUS_ONE_THRESHOLD"],
+                raise_error=app.config["DB_N_PLUS_ONE"] == "raise",
+            )
+        )
+    if app.config["DB_REQUEST_STATS"] or app.config["DB_STATEMENT_BUDGET"] is not None:
+        manager._when_engines_ready(_collect_request_stats)
     return manager
 
 
+def _detect_n_plus_one(manager, threshold, raise_error):
+    detector = manager.detect_n_plus_one(threshold=threshold, raise_error=raise_error)
+    # A lazy manager creates its engine during a request, after the scope would have been opened
+    if has_request_context() and "_sqlah_n_plus_one_scope" not in g:
+        g._sqlah_n_plus_one_scope = (detector, detector._enter_scope())
+
+
+def _collect_request_stats(manager):
+    manager.instrument(_RequestStatsSink(), prefix=_REQUEST_STATS_PREFIX)
+
+
+def _import_models(app):
+    """Import all the modules that might define models, to register them on the metadata."""
+    models_location = app.config["DB_MODELS_LOCATION"]
+    try:
+        for module in find_modules(models_location, include_packages=True, recursive=True):
+            import_string(module)
+    except ValueError:
+        # It's just a module, importing it is enough
+        import_string(models_location)
+
+
 def _syncdb():
     """Run :meth:`DatabaseManager.sync` on the command-line."""
     manager = _get_manager()
-    result = manager.sync()
+    try:
+        result = manager.sync()
+    finally:
+        manager.dispose()
     if result == SyncResult.CREATED:
         click.echo("Database created.")
     elif result == SyncResult.UPGRADED:
@@ -45,10 +95,16 @@ class DatabaseExtension:
     """A Flask extension to configure the database manager according the the app's configuration.
 
     It cleans up database connections at the end of the requests, and creates the CLI endpoint to
-    sync the database schema.
+    sync the database schema. If ``DB_HEALTH_ENDPOINT`` is set, it also adds a health check view at
+    this URL, see :meth:`health`.
+
+    If ``DB_LAZY`` is true, the models are imported when the database manager is first used, and the
+    manager creates its engine on the first session, which also sets up the N+1 query detection and
+    the request statistics.
     """
 
     _app_manager_name = "_sqlah_database_manager"
+    _app_health_check_name = "_sqlah_health_check"
     _app_base_model_name = "_sqlah_base_model"
 
     def __init__(self, app=None, base_model=None):
@@ -71,12 +127,26 @@ class DatabaseExtension:
         if main_module.endswith(".app"):
             main_module = main_module[:-4]
         app.config.setdefault("DB_MODELS_LOCATION", f"{main_module}.models")
+        app.config.setdefault("DB_N_PLUS_ONE", None)
+        app.config.setdefault("DB_N_PLUS_ONE_THRESHOLD", 5)
+        app.config.setdefault("DB_REQUEST_STATS", False)
+        app.config.setdefault("DB_STATEMENT_BUDGET", None)
+        app.config.setdefault("DB_HEALTH_ENDPOINT", None)
+        app.config.setdefault("DB_HEALTH_STATUS_TTL", 30.0)
+        app.config.setdefault("DB_HEALTH_TIMEOUT", 2.0)
+        app.config.setdefault("DB_HEALTH_MAX_SATURATION", 0.9)
+        app.config.setdefault("DB_LAZY", False)
         # Connect hook
         app.before_request(self.before_request)
+        # Statistics hook
+        app.after_request(self.after_request)
         # Disconnect hook
         app.teardown_appcontext(self.teardown)
         # Store the base_model
         app.extensions[self._app_base_model_name] = base_model
+        # Health check
+        if app.config["DB_HEALTH_ENDPOINT"]:
+            app.add_url_rule(app.config["DB_HEALTH_ENDPOINT"], "db_health", self.health)
 
         # CLI
         db_cli = AppGroup("db", help="Database operations.")
@@ -84,16 +154,15 @@ class DatabaseExtension:
         app.cli.add_command(db_cli)
         # Import all modules here that might define models so that
         # they will be registered properly on the metadata.
-        models_location = app.config["DB_MODELS_LOCATION"]
-        try:
-            for module in find_modules(models_location, include_packages=True, recursive=True):
-                import_string(module)
-        except ValueError:
-            # It's just a module, importing it is enough
-            import_string(models_location)
+        if not app.config["DB_LAZY"]:
+            _import_models(app)
 
     def teardown(self, exception):
         """Close the database connection at the end of each requests."""
+        _exit_origin(g.pop("_sqlah_query_origin", None))
+        n_plus_one_scope = g.pop("_sqlah_n_plus_one_scope", None)
+        if n_plus_one_scope is not None:
+            n_plus_one_scope[0]._exit_scope(n_plus_one_scope[1])
         if self._app_manager_name in current_app.extensions:
             current_app.extensions[self._app_manager_name].Session.remove()
 
@@ -102,8 +171,50 @@ class DatabaseExtension:
 
         This is necessary to allow access to the ``Model.get_*`` methods.
         """
-        # Just create the manager
-        self.manager  # noqa: B018
+        # Create the manager
+        detector = self.manager.n_plus_one_detector
+        # Count the statements executed in this request, unless creating the engine already did
+        if detector is not None and "_sqlah_n_plus_one_scope" not in g:
+            g._sqlah_n_plus_one_scope = (detector, detector._enter_scope())
+        # Tag the statements with the endpoint in the slow query log
+        g._sqlah_query_origin = _enter_origin(request.endpoint or request.path)
+        # Collect the request statistics
+        if current_app.config["DB_REQUEST_STATS"]:
+            g.db_stats = RequestStats()
+        budget = current_app.config["DB_STATEMENT_BUDGET"]
+        if budget is not None:
+            g._sqlah_statement_budget = budget
+            g.setdefault("db_stats", RequestStats())
+
+    def after_request(self, response):
+        """Add the ``Server-Timing`` header with the request statistics, if enabled."""
+        if current_app.config["DB_REQUEST_STATS"] and "db_stats" in g:
+            response.headers.add("Server-Timing", g.db_stats.server_timing())
+        return response
+
+    def health(self):
+        """Check the health of the database, in the view at ``DB_HEALTH_ENDPOINT``.
+
+        The response has a 503 status code if the database is not ready.
+
+        Returns:
+            tuple: the :class:`~sqlalchemy_helpers.health.HealthReport` as a dict, and the status
+            code.
+        """
+        report = self.health_check.check()
+        return report.as_dict(), 200 if report.ready else 503
+
+    @property
+    def health_check(self):
+        """HealthCheck: the health check of the database, configured by the ``DB_HEALTH_*`` keys."""
+        if self._app_health_check_name not in current_app.extensions:
+            current_app.extensions[self._app_health_check_name] = HealthCheck(
+                self.manager,
+                status_ttl=current_app.config["DB_HEALTH_STATUS_TTL"],
+                timeout=current_app.config["DB_HEALTH_TIMEOUT"],
+                max_saturation=current_app.config["DB_HEALTH_MAX_SATURATION"],
+            )
+        return current_app.extensions[self._app_health_check_name]
 
     @property
     def session(self):
@@ -123,6 +234,79 @@ class DatabaseExtension:
             return None
 
 
+# Request statistics
+
+_REQUEST_STATS_PREFIX = "_sqlah_request"
+
+
+@dataclass
+class RequestStats:
+    """The database statistics of a request, available as ``flask.g.db_stats``."""
+
+    statements: int = 0
+    """The number of executed SQL statements."""
+    db_time: float = 0.0
+    """The time spent executing the statements, in seconds."""
+    rows: int = 0
+    """The number of rows reported by the driver (``SELECT`` statements are not counted by all
+    drivers)."""
+    pool_wait: float = 0.0
+    """The time spent waiting for a connection from the pool, in seconds."""
+
+    def server_timing(self):
+        """Format the statistics as the value of a ``Server-Timing`` header.
+
+        Returns:
+            str: the header value.
+        """
+        return (
+            f'db;dur={self.db_time * 1000:.3f};desc="{self.statements} statements, '
+            f'{self.rows} rows", db-pool;dur={self.pool_wait * 1000:.3f}'
+        )
+
+
+class StatementBudgetExceeded(InternalServerError):
+    """The request has executed more statements than ``DB_STATEMENT_BUDGET``."""
+
+
+class _RequestStatsSink(MetricsSink):
+    """Send the metrics of the database manager's engine to the current request's statistics."""
+
+    def increment(self, name, value=1):
+        stats = _current_stats()
+        if stats is None:
+            return
+        if name == f"{_REQUEST_STATS_PREFIX}.statements":
+            stats.statements += value
+        elif name == f"{_REQUEST_STATS_PREFIX}.statement_rows":
+            stats.rows += value
+
+    def gauge(self, name, value):
+        pass
+
+    def observe(self, name, value):
+        stats = _current_stats()
+        if stats is None:
+            return
+        if name == f"{_REQUEST_STATS_PREFIX}.statement_time":
+            stats.db_time += value
+            # Checked after the execution: an exception raised before it would skip the
+            # handle_error listeners of the engine
+            budget = g.get("_sqlah_statement_budget")
+            if budget is not None and stats.statements > budget:
+                raise StatementBudgetExceeded(
+                    f"This request has exceeded its budget of {budget} database statements."
+                )
+        elif name == f"{_REQUEST_STATS_PREFIX}.pool.checkout_time":
+            stats.pool_wait += value
+
+
+def _current_stats():
+    if not has_app_context():
+        return None
+    return g.get("db_stats")
+
+
 # View helpers
 
 
@@ -153,6 +337,46 @@ def first_or_404(query, description=None):
     return rv
 
 
+def paginate(
+    query_or_select, *, order_by, after=None, limit=20, estimate_total=False, max_count=1000
+):
+    """Get a page of results using keyset pagination, aborts with 400 if the cursor is invalid.
+
+    Example::
+
+        page = paginate(User.query, order_by=[User.id], after=request.args.get("after"))
+
+    Args:
+        query_or_select (sqlalchemy.orm.Query or sqlalchemy.sql.Select): the query to paginate.
+            Selects are run with the extension's session.
+        order_by (list): the columns to sort the results by, see
+            :func:`sqlalchemy_helpers.pagination.paginate`.
+        after (str, optional): the cursor returned by the previous page.
+        limit (int): the maximum number of results in the page.
+        estimate_total (bool): whether to compute an approximate total number of results.
+        max_count (int): the maximum number of results to count when the planner's estimate is not
+            available.
+
+    Returns:
+        sqlalchemy_helpers.pagination.Page: the page of results.
+    """
+    session = None
+    if not isinstance(query_or_select, Query):
+        session = current_app.extensions[DatabaseExtension._app_manager_name].Session()
+    try:
+        return _paginate(
+            query_or_select,
+            order_by=order_by,
+            after=after,
+            limit=limit,
+            session=session,
+            estimate_total=estimate_total,
+            max_count=max_count,
+        )
+    except InvalidCursor as e:
+        abort(400, description=str(e))
+
+
 # Useful in alembic's env.py
 
 
@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Cheap health checks of the database, for load balancers and orchestrators.
+
+A health check runs a ``SELECT 1`` on a pooled connection with a timeout, and caches the schema
+status between checks because it needs to read the Alembic version table.
+
+This must remain independent from any web framework.
+"""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
+
+from .manager import DatabaseStatus
+
+
+@dataclass
+class PoolStatus:
+    """The occupation of a connection pool."""
+
+    size: int
+    """The number of connections that the pool keeps open."""
+    checked_out: int
+    """The number of connections currently in use."""
+    overflow: int
+    """The number of connections open above ``size``."""
+    max_overflow: int
+    """The maximum number of connections above ``size``, negative if unlimited."""
+
+    @property
+    def saturation(self):
+        """float or None: the ratio of used connections, ``None`` if the pool is unlimited."""
+        if self.max_overflow < 0:
+            return None
+        return self.checked_out / (self.size + self.max_overflow)
+
+
+# The default max_overflow of SQLAlchemy's QueuePool
+_DEFAULT_MAX_OVERFLOW = 10
+
+
+def get_pool_status(engine, max_overflow=_DEFAULT_MAX_OVERFLOW):
+    """Get the occupation of an engine's connection pool.
+
+    Args:
+        engine (sqlalchemy.engine.Engine or sqlalchemy.ext.asyncio.AsyncEngine): the engine.
+        max_overflow (int): the ``max_overflow`` argument that the engine was created with, the
+            pool does not expose it.
+
+    Returns:
+        PoolStatus or None: the occupation of the pool, or ``None`` if the pool does not limit the
+        number of connections.
+    """
+    pool = getattr(engine, "sync_engine", engine).pool
+    if not isinstance(pool, QueuePool):
+        return None
+    return PoolStatus(
+        size=pool.size(),
+        checked_out=pool.checkedout(),
+        overflow=max(pool.overflow(), 0),
+        max_overflow=max_overflow,
+    )
+
+
+@dataclass
+class HealthReport:
+    """The result of a :class:`HealthCheck`."""
+
+    live: bool
+    """Whether the database answered in time."""
+    ready: bool
+    """Whether the database is live, up-to-date and not saturated."""
+    status: Optional[DatabaseStatus] = None
+    """The schema status, possibly cached."""
+    latency: Optional[float] = None
+    """The duration of the ``SELECT 1`` statement, in seconds."""
+    pool: Optional[PoolStatus] = None
+    """The occupation of the connection pool, if it is limited."""
+    error: Optional[str] = None
+    """The reason why the database is not live, if any."""
+
+    def as_dict(self):
+        """Get the report as a dict that can be serialized to JSON.
+
+        Returns:
+            dict: the report.
+        """
+        return {
+            "live": self.live,
+            "ready": self.ready,
+            "status": self.status.name if self.status is not None else None,
+            "latency": self.latency,
+            "pool": (
+                None
+                if self.pool is None
+                else {
+                    "size": self.pool.size,
+                    "checked_out": self.pool.checked_out,
+                    "overflow": self.pool.overflow,
+                    "max_overflow": self.pool.max_overflow,
+                    "saturation": self.pool.saturation,
+                }
+            ),
+            "error": self.error,
+        }
+
+
+class _BaseHealthCheck:
+    """The cached schema status and the report of the synchronous and asynchronous checks."""
+
+    def __init__(self, manager, *, status_ttl=30.0, timeout=2.0, max_saturation=0.9):
+        self.manager = manager
+        self.status_ttl = status_ttl
+        self.timeout = timeout
+        self.max_saturation = max_saturation
+        self._max_overflow = (manager._engine_options["engine_args"] or {}).get(
+            "max_overflow", _DEFAULT_MAX_OVERFLOW
+        )
+        self._status = None
+        self._status_time = None
+
+    def _status_expired(self):
+        return self._status_time is None or time.monotonic() - self._status_time > self.status_ttl
+
+    def _set_status(self, status):
+        self._status = status
+        self._status_time = time.monotonic()
+
+    def clear(self):
+        """Forget the cached schema status."""
+        self._status = None
+        self._status_time = None
+
+    def _report(self, latency=None, error=None):
+        pool = get_pool_status(self.manager.engine, self._max_overflow)
+        live = error is None
+        saturation = pool.saturation if pool is not None else None
+        ready = (
+            live
+            and self._status is DatabaseStatus.UP_TO_DATE
+            and (saturation is None or saturation < self.max_saturation)
+        )
+        return HealthReport(
+            live=live, ready=ready, status=self._status, latency=latency, pool=pool, error=error
+        )
+
+
+class HealthCheck(_BaseHealthCheck):
+    """Check the health of a :class:`~sqlalchemy_helpers.manager.DatabaseManager`'s database.
+
+    The statements are run in a worker thread, so that a database that does not answer is reported
+    after ``timeout`` seconds instead of blocking the caller. While the statements of a previous
+    check are still running, the database is reported as not live without running them again.
+
+    Args:
+        manager (sqlalchemy_helpers.manager.DatabaseManager): the database manager.
+        status_ttl (float): the number of seconds during which the schema status is cached.
+        timeout (float): the number of seconds after which the database is not live.
+        max_saturation (float): the ratio of used connections in the pool above which the database
+            is not ready, so that a load balancer can send the requests elsewhere.
+    """
+
+    def __init__(self, manager, *, status_ttl=30.0, timeout=2.0, max_saturation=0.9):
+        super().__init__(
+            manager, status_ttl=status_ttl, timeout=timeout, max_saturation=max_saturation
+        )
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlah-health")
+        self._lock = threading.Lock()
+        self._future = None
+
+    def _probe(self):
+        start = time.perf_counter()
+        with self.manager.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        latency = time.perf_counter() - start
+        if self._status_expired():
+            self._set_status(self.manager.get_status())
+        return latency
+
+    def check(self):
+        """Check the health of the database.
+
+        Returns:
+            HealthReport: the result of the check.
+        """
+        with self._lock:
+            if self._future is not None and not self._future.done():
+                return self._report(error="The previous health check has not finished yet")
+            future = self._future = self._executor.submit(self._probe)
+        try:
+            latency = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            return self._report(error=f"The database did not answer within {self.timeout}s")
+        except Exception as e:
+            return self._report(error=f"{type(e).__name__}: {e}")
+        return self._report(latency=latency)
+
+
+class AsyncHealthCheck(_BaseHealthCheck):
+    """Check the health of a :class:`~sqlalchemy_helpers.aio.AsyncDatabaseManager`'s database.
+
+    The arguments are the same as :class:`HealthCheck`.
+    """
+
+    async def _probe(self):
+        start = time.perf_counter()
+        async with self.manager.engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+        latency = time.perf_counter() - start
+        if self._status_expired():
+            self._set_status(await self.manager.get_status())
+        return latency
+
+    async def check(self):
+        """Check the health of the database.
+
+        Returns:
+            HealthReport: the result of the check.
+        """
+        try:
+            latency = await asyncio.wait_for(self._probe(), self.timeout)
+        except asyncio.TimeoutError:
+            return self._report(error=f"The database did not answer within {self.timeout}s")
+        except Exception as e:
+            return self._report(error=f"{type(e).__name__}: {e}")
+        return self._report(latency=latency)
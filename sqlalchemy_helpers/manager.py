@@ -7,6 +7,9 @@ Database management.
 
 This must remain independent from any web framework.
 
+Alembic is only imported when a migration feature is used, so that the processes that don't
+migrate the database don't pay for its import.
+
 Attributes:
     Base (object): SQLAlchemy's base class for models.
 """
@@ -14,20 +17,35 @@ Attributes:
 import enum
 import logging
 import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import nullcontext
-from functools import partial
+from contextvars import copy_context
+from dataclasses import dataclass
+from functools import partial, wraps
+from itertools import islice
 from sqlite3 import Connection as SQLite3Connection
+from typing import Optional
 
-from alembic import command
-from alembic.config import Config as AlembicConfig
-from alembic.migration import MigrationContext
-from alembic.script import ScriptDirectory
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import bindparam, Boolean, create_engine, literal_column, select, tuple_
 from sqlalchemy import event as sa_event
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.engine import Engine
-from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+from sqlalchemy.orm import declarative_base, scoped_session, Session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound
 
+from .cache import CacheStats, identity_in_session, result_cache
+from .engines import engine_registry, protect_from_fork
+from .metrics import EngineInstrumentation
+from .nplusone import NPlusOneDetector
+from .querylog import query_origin, SlowQueryLog, tag_origin
+from .replicas import _check_replica, ReplicaRouter, RoutingSession
+from .sharding import ShardMap
+
 
 def get_base(*args, **kwargs):
     """A wrapper for :func:`declarative_base`."""
@@ -47,6 +65,49 @@ Base = get_base()
 
 _log = logging.getLogger(__name__)
 
+_LAZY_ENGINE_ATTRIBUTES = frozenset(
+    {
+        "engine",
+        "replica_engines",
+        "replica_router",
+        "shard_engines",
+        "shard_map",
+        "_shard_executor",
+        "_sessionmaker",
+    }
+)
+_LAZY_ALEMBIC_ATTRIBUTES = frozenset({"alembic_cfg", "_shard_alembic_cfgs", "_script_cache"})
+
+
+class _LazySessionmaker(sessionmaker):
+    """The session factory of a lazy manager, resolved when the first session is created.
+
+    The engines of the manager are created then, and the factory takes the bind and the arguments
+    of the manager's session factory. The arguments passed to :meth:`configure` before that are
+    kept.
+    """
+
+    def __init__(self, manager):
+        super().__init__()
+        self._manager = manager
+        self._configured = {}
+
+    def configure(self, **new_kw):
+        super().configure(**new_kw)
+        if self._manager is not None:
+            self._configured.update(new_kw)
+
+    def __call__(self, **local_kw):
+        manager = self._manager
+        if manager is not None:
+            with manager._setup_lock:
+                if self._manager is not None:
+                    factory = manager._sessionmaker
+                    self.class_ = factory.class_
+                    self.kw = {**factory.kw, **self._configured}
+                    self._manager = None
+        return super().__call__(**local_kw)
+
 
 class DatabaseManager:
     """Helper for a SQLAlchemy and Alembic-powered database
@@ -55,29 +116,199 @@ class DatabaseManager:
         uri (str): the database URI
         alembic_location (str): a path to the alembic directory
         engine_args (dict): additional arguments passed to ``create_engine``
+        replica_uris (list): the URIs of the replica databases that read queries are sent to
+        replica_strategy (str): how to choose a replica, see
+            :class:`sqlalchemy_helpers.replicas.ReplicaRouter`
+        read_your_writes (float): the number of seconds after a commit during which read queries
+            are sent to the primary database
+        max_replica_lag (float): the replication lag in seconds above which a replica is taken out
+            of rotation, see :meth:`check_replicas`
+        shards (dict): the URIs of the shard databases by shard id, the database at ``uri`` is
+            then used for the models that are not sharded
+        shard_keys (dict): the shard key functions by model class, see
+            :class:`sqlalchemy_helpers.sharding.ShardMap`
+        share_engine (bool): whether to share the engines with the other managers of the process
+            that use the same URI and engine arguments, see :meth:`dispose`
+        lazy (bool): whether to wait until they are used to create the engines and to parse the
+            Alembic configuration, which makes the startup faster
 
     Attributes:
         alembic_cfg (alembic.config.Config): the Alembic configuration object
         engine (sqlalchemy.engine.Engine): the SQLAlchemy Engine instance
+        shard_engines (dict): the SQLAlchemy Engine instances of the shards by shard id
+        shard_map (sqlalchemy_helpers.sharding.ShardMap or None): the router of the statements to
+            the shards, if there are shards
+        replica_engines (list): the SQLAlchemy Engine instances of the replicas
+        replica_router (sqlalchemy_helpers.replicas.ReplicaRouter or None): the router of read
+            queries, if there are replicas
         Session (sqlalchemy.orm.scoped_session): the SQLAlchemy scoped session factory
+        n_plus_one_detector (sqlalchemy_helpers.nplusone.NPlusOneDetector or None): the N+1
+            query detector, if enabled with :meth:`detect_n_plus_one`
     """
 
-    def __init__(self, uri, alembic_location, *, engine_args=None, base_model=None):
-        self.engine = self._make_engine(uri, engine_args)
-        self.Session = scoped_session(
-            sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
-        )
+    def __init__(
+        self,
+        uri,
+        alembic_location,
+        *,
+        engine_args=None,
+        base_model=None,
+        replica_uris=None,
+        replica_strategy="round-robin",
+        read_your_writes=2.0,
+        max_replica_lag=30.0,
+        shards=None,
+        shard_keys=None,
+        share_engine=False,
+        lazy=False,
+    ):
+        if replica_uris and shards:
+            raise ValueError("Read replicas and shards can't be used together")
+        self._share_engine = share_engine
+        self._disposed = False
+        self._setup_lock = threading.RLock()
+        self._engine_options = {
+            "uri": uri,
+            "engine_args": engine_args,
+            "replica_uris": replica_uris or [],
+            "replica_strategy": replica_strategy,
+            "read_your_writes": read_your_writes,
+            "max_replica_lag": max_replica_lag,
+            "shards": shards or {},
+            "shard_keys": shard_keys,
+        }
+        self._alembic_location = alembic_location
+        self._replica_checks = None
+        # The instrumentations and slow query logs, removed on dispose
+        self._engine_listeners = []
+        self._engine_callbacks = []
+        self.n_plus_one_detector = None
+        if lazy:
+            self.Session = scoped_session(_LazySessionmaker(self))
+        else:
+            self._setup_engines()
+            self._setup_alembic()
+            self.Session = scoped_session(self._sessionmaker)
         self._base_model = base_model or Base
         self._base_model.get_by_pk = session_and_model_property(self.Session, get_by_pk)
         self._base_model.get_one = session_and_model_property(self.Session, get_one)
         self._base_model.get_or_create = session_and_model_property(self.Session, get_or_create)
+        self._base_model.get_or_create_many = session_and_model_property(
+            self.Session, get_or_create_many
+        )
         self._base_model.update_or_create = session_and_model_property(
             self.Session, update_or_create
         )
-        # Alembic
+        self._base_model.update_or_create_many = session_and_model_property(
+            self.Session, update_or_create_many
+        )
+        self._base_model.iter_all = session_and_model_property(self.Session, iter_all)
+
+    def __getattr__(self, name):
+        # Only called for the attributes that are not set yet, i.e. when the manager is lazy.
+        if name in _LAZY_ENGINE_ATTRIBUTES:
+            setup = self._setup_engines
+        elif name in _LAZY_ALEMBIC_ATTRIBUTES:
+            setup = self._setup_alembic
+        else:
+            raise AttributeError(f"{type(self).__name__!r} object has no attribute {name!r}")
+        with self._setup_lock:
+            if name not in self.__dict__:
+                setup()
+        return self.__dict__[name]
+
+    def _setup_engines(self):
+        """Create the engines and the session factory."""
+        options = self._engine_options
+        acquired = []
+
+        def make_engine(uri):
+            engine = self._make_engine(uri, options["engine_args"])
+            acquired.append(engine)
+            return engine
+
+        try:
+            self.replica_engines = [make_engine(uri) for uri in options["replica_uris"]]
+            self.engine = make_engine(options["uri"])
+            self.replica_router = None
+            if self.replica_engines:
+                self.replica_router = ReplicaRouter(
+                    self.engine,
+                    self.replica_engines,
+                    strategy=options["replica_strategy"],
+                    read_your_writes=options["read_your_writes"],
+                    max_lag=options["max_replica_lag"],
+                )
+            self.shard_engines = {
+                shard_id: make_engine(shard_uri)
+                for shard_id, shard_uri in options["shards"].items()
+            }
+            self.shard_map = None
+            self._shard_executor = None
+            if self.shard_engines:
+                self.shard_map = ShardMap(self.engine, self.shard_engines, options["shard_keys"])
+                self._shard_executor = ThreadPoolExecutor(
+                    max_workers=len(self.shard_engines), thread_name_prefix="sqlah-shard"
+                )
+            self._sessionmaker = self._make_sessionmaker()
+        except BaseException:
+            # A lazy manager tries again on the next access, release what was set up so far.
+            if self.__dict__.get("_shard_executor") is not None:
+                self._shard_executor.shutdown()
+            for name in _LAZY_ENGINE_ATTRIBUTES:
+                self.__dict__.pop(name, None)
+            for engine in acquired:
+                if engine_registry.release(engine):
+                    getattr(engine, "sync_engine", engine).dispose()
+            raise
+        for callback in self._engine_callbacks:
+            callback(self)
+        self._engine_callbacks.clear()
+
+    def _when_engines_ready(self, callback):
+        """Call ``callback(manager)`` once the engines are created, right away if they are."""
+        with self._setup_lock:
+            if "engine" in self.__dict__:
+                callback(self)
+            else:
+                self._engine_callbacks.append(callback)
+
+    def _make_sessionmaker(self):
+        return sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine, **self._session_args()
+        )
+
+    def _setup_alembic(self):
+        """Parse the Alembic configuration of the database and of each shard."""
+        from alembic.config import Config as AlembicConfig
+
+        alembic_location = self._alembic_location
+        uri = self._engine_options["uri"]
         self.alembic_cfg = AlembicConfig(os.path.join(alembic_location, "alembic.ini"))
         self.alembic_cfg.set_main_option("script_location", alembic_location)
         self.alembic_cfg.set_main_option("sqlalchemy.url", uri.replace("%", "%%"))
+        self._shard_alembic_cfgs = {}
+        for shard_id, shard_uri in self._engine_options["shards"].items():
+            shard_alembic_cfg = AlembicConfig(os.path.join(alembic_location, "alembic.ini"))
+            shard_alembic_cfg.set_main_option("script_location", alembic_location)
+            shard_alembic_cfg.set_main_option("sqlalchemy.url", shard_uri.replace("%", "%%"))
+            self._shard_alembic_cfgs[shard_id] = shard_alembic_cfg
+        self._script_cache = ScriptCache(self.alembic_cfg)
+
+    def _session_args(self):
+        """Get the session factory arguments that route the statements to replicas or shards."""
+        if self.replica_router is not None:
+            return {"class_": RoutingSession, "router": self.replica_router}
+        if self.shard_map is not None:
+            return self.shard_map.session_args()
+        return {}
+
+    def _databases(self):
+        """Get the engine and the Alembic configuration of the database and of each shard."""
+        return [(self.engine, self.alembic_cfg)] + [
+            (self.shard_engines[shard_id], self._shard_alembic_cfgs[shard_id])
+            for shard_id in self.shard_engines
+        ]
 
     def _make_engine(self, uri, engine_args):
         """Create the SQLAlchemy engine.
@@ -89,9 +320,203 @@ class DatabaseManager:
         Returns:
             sqlalchemy.Engine: the SQLAlchemy engine
         """
-        engine_args = engine_args or {}
-        engine_args["url"] = uri
-        return create_engine(**engine_args)
+        engine_args = {**(engine_args or {}), "url": uri}
+        if self._share_engine:
+            engine = engine_registry.acquire(create_engine, engine_args)
+        else:
+            engine = create_engine(**engine_args)
+        protect_from_fork(engine)
+        return engine
+
+    def _remove_listeners(self):
+        """Remove the listeners that the manager added to its engine, which may be shared."""
+        if self.n_plus_one_detector is not None:
+            self.n_plus_one_detector.remove()
+            self.n_plus_one_detector = None
+        for listener in self._engine_listeners:
+            listener.remove()
+        self._engine_listeners.clear()
+
+    def _all_engines(self):
+        return [self.engine, *self.replica_engines, *self.shard_engines.values()]
+
+    def dispose(self):
+        """Stop using the database.
+
+        The connections of the engines are closed, unless the engines are shared with other
+        managers that still use them. The N+1 query detector, the instrumentations and the slow
+        query logs of the manager are removed. The manager must not be used afterwards.
+        """
+        if self._disposed:
+            return
+        self._disposed = True
+        self.Session.remove()
+        if "engine" not in self.__dict__:
+            # A lazy manager that was never used
+            return
+        self._remove_listeners()
+        self.stop_replica_checks()
+        if self._shard_executor is not None:
+            self._shard_executor.shutdown()
+        for engine in self._all_engines():
+            if engine_registry.release(engine):
+                engine.dispose()
+
+    def check_replicas(self):
+        """Check the health and the replication lag of the replicas.
+
+        Replicas that fail the check or that lag too much behind the primary stop receiving read
+        queries until a later check succeeds. The replication lag is only available on PostgreSQL,
+        the other databases are only checked for availability.
+
+        Returns:
+            list: the :class:`sqlalchemy_helpers.replicas.ReplicaHealth` of each replica.
+        """
+        for index, engine in enumerate(self.replica_engines):
+            start = time.perf_counter()
+            try:
+                with engine.connect() as connection:
+                    lag = _check_replica(connection)
+            except Exception as e:
+                self._record_replica_failure(index, e)
+            else:
+                self.replica_router.record_check(index, time.perf_counter() - start, lag)
+        return self.get_replica_status()
+
+    def _record_replica_failure(self, index, error):
+        _log.warning(
+            "The health check of replica %s failed: %s",
+            self.replica_router.health[index].url,
+            error,
+        )
+        self.replica_router.record_failure(index, error)
+
+    def get_replica_status(self):
+        """Get the health of the replicas, as observed by the last check.
+
+        Returns:
+            list: the :class:`sqlalchemy_helpers.replicas.ReplicaHealth` of each replica.
+        """
+        if self.replica_router is None:
+            return []
+        return list(self.replica_router.health)
+
+    def start_replica_checks(self, interval=10.0):
+        """Check the replicas periodically in a background thread.
+
+        Args:
+            interval (float): the number of seconds between two checks.
+        """
+        self.stop_replica_checks()
+        stopped = threading.Event()
+
+        def run():
+            while True:
+                self.check_replicas()
+                if stopped.wait(interval):
+                    return
+
+        thread = threading.Thread(target=run, name="sqlah-replica-checks", daemon=True)
+        self._replica_checks = (thread, stopped)
+        thread.start()
+
+    def stop_replica_checks(self):
+        """Stop the periodic checks of the replicas."""
+        if self._replica_checks is None:
+            return
+        thread, stopped = self._replica_checks
+        stopped.set()
+        thread.join()
+        self._replica_checks = None
+
+    def instrument(self, sink, prefix="db"):
+        """Send the connection pool and statement metrics to a sink.
+
+        Args:
+            sink (sqlalchemy_helpers.metrics.MetricsSink): the sink to send the metrics to.
+            prefix (str): the prefix of the metric names.
+
+        Returns:
+            sqlalchemy_helpers.metrics.EngineInstrumentation: the instrumentation, call its
+            ``remove()`` method to stop sending metrics. It is removed when the manager is disposed.
+        """
+        instrumentation = EngineInstrumentation(self.engine, sink, prefix=prefix)
+        self._engine_listeners.append(instrumentation)
+        return instrumentation
+
+    def log_slow_queries(self, threshold=0.5, max_fingerprints=1000):
+        """Time the executed statements and log the slow ones.
+
+        Args:
+            threshold (float): the duration in seconds above which statements are logged.
+            max_fingerprints (int): the maximum number of statement fingerprints to keep
+                statistics for.
+
+        Returns:
+            sqlalchemy_helpers.querylog.SlowQueryLog: the query log, call its ``top()`` method to
+            get the most expensive statements and its ``remove()`` method to stop recording. It is
+            removed when the manager is disposed.
+        """
+        query_log = SlowQueryLog(
+            self.engine, threshold=threshold, max_fingerprints=max_fingerprints
+        )
+        self._engine_listeners.append(query_log)
+        return query_log
+
+    def detect_n_plus_one(self, threshold=5, raise_error=False):
+        """Report the statements that are repeated in the same request.
+
+        The Flask and FastAPI integrations count the statements executed during each request when
+        the detector is enabled.
+
+        Args:
+            threshold (int): the number of times a statement can be executed in a request before
+                being reported.
+            raise_error (bool): whether to raise an exception instead of emitting a warning.
+
+        Returns:
+            sqlalchemy_helpers.nplusone.NPlusOneDetector: the detector.
+        """
+        if self.n_plus_one_detector is not None:
+            self.n_plus_one_detector.remove()
+        self.n_plus_one_detector = NPlusOneDetector(
+            self.engine, threshold=threshold, raise_error=raise_error
+        )
+        return self.n_plus_one_detector
+
+    def fan_out(self, statement, shard_ids=None):
+        """Execute a statement on several shards in parallel.
+
+        Each shard is queried in its own session and thread, the returned model instances are
+        detached. Statements executed with the manager's sessions are also sent to every shard when
+        the shard key is unknown, but one shard after the other.
+
+        Example: ``events = manager.fan_out(select(Event).where(Event.late)).scalars().all()``
+
+        Args:
+            statement (sqlalchemy.sql.Executable): the statement to execute.
+            shard_ids (list or None): the shards to query, defaults to all the shards.
+
+        Returns:
+            sqlalchemy.engine.Result: the results of all the shards.
+
+        Raises:
+            ValueError: if there is no shard to query.
+        """
+        shard_ids = list(self.shard_engines) if shard_ids is None else shard_ids
+        if not shard_ids:
+            raise ValueError("There is no shard to query")
+
+        def execute(shard_id):
+            with Session(bind=self.shard_engines[shard_id], autoflush=False) as session:
+                return session.execute(statement).freeze()
+
+        futures = [
+            self._shard_executor.submit(copy_context().run, execute, shard_id)
+            for shard_id in shard_ids
+        ]
+        results = [future.result()() for future in futures]
+        return results[0].merge(*results[1:])
 
     def _get_session_context(self, session=None):
         if session is None:
@@ -106,32 +531,57 @@ class DatabaseManager:
             session (sqlalchemy.Session or None): the session instance to use, or ``None``
                 if one is to be created.
         """
+        from alembic.migration import MigrationContext
+
         with self._get_session_context(session) as session:
             alembic_context = MigrationContext.configure(session.connection())
             return alembic_context.get_current_revision()
 
+    def get_script_directory(self):
+        """Get the Alembic script directory, loaded once and reloaded when the migrations change.
+
+        Returns:
+            alembic.script.ScriptDirectory: the script directory.
+        """
+        return self._script_cache.get_script_directory()
+
     def get_latest_revision(self):
-        """Get the most up-to-date alembic database revision available."""
-        script_dir = ScriptDirectory.from_config(self.alembic_cfg)
-        return script_dir.get_current_head()
+        """Get the most up-to-date alembic database revision available.
+
+        The head revision is cached until the versions directory changes, see
+        :class:`ScriptCache`.
+        """
+        return self._script_cache.get_head()
 
     def create(self):
-        """Create the database tables."""
-        self._base_model.metadata.create_all(bind=self.engine)
-        command.stamp(self.alembic_cfg, "head")
+        """Create the database tables, in the shards too."""
+        for engine, alembic_cfg in self._databases():
+            self._create(engine, alembic_cfg)
+
+    def _create(self, engine, alembic_cfg):
+        from alembic import command
+
+        self._base_model.metadata.create_all(bind=engine)
+        command.stamp(alembic_cfg, "head")
 
     def upgrade(self, target="head"):
-        """Upgrade the database schema."""
-        command.upgrade(self.alembic_cfg, target)
+        """Upgrade the database schema, in the shards too."""
+        from alembic import command
+
+        for _engine, alembic_cfg in self._databases():
+            command.upgrade(alembic_cfg, target)
 
     def drop(self):
-        """Drop all the database tables."""
-        self._base_model.metadata.drop_all(bind=self.engine)
-        # Also drop the Alembic version table
-        with self.engine.connect() as connection:
-            with connection.begin():
-                alembic_context = MigrationContext.configure(connection)
-                alembic_context._version.drop(bind=connection)
+        """Drop all the database tables, in the shards too."""
+        from alembic.migration import MigrationContext
+
+        for engine, _alembic_cfg in self._databases():
+            self._base_model.metadata.drop_all(bind=engine)
+            # Also drop the Alembic version table
+            with engine.connect() as connection:
+                with connection.begin():
+                    alembic_context = MigrationContext.configure(connection)
+                    alembic_context._version.drop(bind=connection)
 
     def get_status(self, session=None):
         """Get the status of the database.
@@ -146,35 +596,71 @@ class DatabaseManager:
             current = self.get_current_revision(session=session)
         return self._compare_to_latest(current)
 
+    def get_shard_status(self):
+        """Get the status of the shards.
+
+        Returns:
+            dict: the :class:`DatabaseStatus` members by shard id.
+        """
+        return {
+            shard_id: self._compare_to_latest(self._get_engine_revision(engine))
+            for shard_id, engine in self.shard_engines.items()
+        }
+
+    def _get_engine_revision(self, engine):
+        from alembic.migration import MigrationContext
+
+        with engine.connect() as connection:
+            return MigrationContext.configure(connection).get_current_revision()
+
     def _compare_to_latest(self, current):
         if current is None:
             return DatabaseStatus.NO_INFO
-        latest = self.get_latest_revision()
-        if current != latest:
-            return DatabaseStatus.UPGRADE_AVAILABLE
-        return DatabaseStatus.UP_TO_DATE
+        return _compare_revisions(current, self.get_latest_revision())
 
     def sync(self, session=None):
         """Create or update the database schema.
 
+        The shards are synced too, see :meth:`sync_shards`.
+
         Args:
             session (sqlalchemy.Session or None): the session instance to use, or ``None``
                 if one is to be created.
 
         Returns:
-            SyncResult member: see :class:`SyncResult`.
+            SyncResult member: see :class:`SyncResult`, for the database at the manager's URI.
         """
         with self._get_session_context(session) as session:
             current_rev = self.get_current_revision(session)
+        result = self._sync(self.engine, self.alembic_cfg, current_rev)
+        self.sync_shards()
+        return result
+
+    def sync_shards(self):
+        """Create or update the database schema of the shards.
+
+        Returns:
+            dict: the :class:`SyncResult` members by shard id.
+        """
+        return {
+            shard_id: self._sync(
+                engine, self._shard_alembic_cfgs[shard_id], self._get_engine_revision(engine)
+            )
+            for shard_id, engine in self.shard_engines.items()
+        }
+
+    def _sync(self, engine, alembic_cfg, current_rev):
         # If the database is empty, it should be created ; otherwise it should
         # be upgraded.
         if current_rev is None:
-            self.create()
+            self._create(engine, alembic_cfg)
             return SyncResult.CREATED
         elif current_rev == self.get_latest_revision():
             return SyncResult.ALREADY_UP_TO_DATE
         else:
-            self.upgrade()
+            from alembic import command
+
+            command.upgrade(alembic_cfg, "head")
             return SyncResult.UPGRADED
 
 
@@ -189,6 +675,93 @@ class DatabaseStatus(enum.Enum):
     """Returned when the database schema can be upgraded."""
 
 
+def _compare_revisions(current, latest):
+    if current is None:
+        return DatabaseStatus.NO_INFO
+    if current != latest:
+        return DatabaseStatus.UPGRADE_AVAILABLE
+    return DatabaseStatus.UP_TO_DATE
+
+
+class ScriptCache:
+    """The Alembic script directory and its head revision, cached between calls.
+
+    Finding the head revision loads every migration file, which gets slow with hundreds of
+    revisions. The cache is checked against the modification time of the versions directories,
+    which changes when a migration file is added, removed or renamed. Editing a migration file in
+    place is not detected. A modification time that is too recent to be reliable on filesystems
+    with a coarse timestamp resolution is not cached.
+
+    Args:
+        alembic_cfg (alembic.config.Config): the Alembic configuration object.
+    """
+
+    RECENT_MTIME = 1.0
+    """float: the age in seconds under which a modification time is not trusted."""
+
+    def __init__(self, alembic_cfg):
+        self.alembic_cfg = alembic_cfg
+        self._lock = threading.Lock()
+        self._locations = None
+        self._key = None
+        self._script_dir = None
+        self._head = None
+
+    def _get_key(self):
+        if self._locations is None:
+            return None
+        now = time.time_ns()
+        key = []
+        for location in self._locations:
+            try:
+                mtime = os.stat(location).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            else:
+                if now - mtime < self.RECENT_MTIME * 1e9:
+                    return None
+            key.append(mtime)
+        return tuple(key)
+
+    def _load(self):
+        key = self._get_key()
+        if key is not None and key == self._key:
+            return
+        from alembic.script import ScriptDirectory
+
+        script_dir = ScriptDirectory.from_config(self.alembic_cfg)
+        self._locations = [str(location) for location in script_dir._version_locations]
+        # Read the modification times before the revisions, a change in between reloads them.
+        self._key = self._get_key()
+        self._head = script_dir.get_current_head()
+        self._script_dir = script_dir
+
+    def get_script_directory(self):
+        """Get the script directory, reloaded if the versions directories changed.
+
+        Returns:
+            alembic.script.ScriptDirectory: the script directory.
+        """
+        with self._lock:
+            self._load()
+            return self._script_dir
+
+    def get_head(self):
+        """Get the head revision, reloaded if the versions directories changed.
+
+        Returns:
+            str or None: the head revision, or ``None`` if there are no revisions.
+        """
+        with self._lock:
+            self._load()
+            return self._head
+
+    def clear(self):
+        """Forget the cached script directory."""
+        with self._lock:
+            self._key = None
+
+
 class SyncResult(enum.Enum):
     """The result of a sync() call."""
 
@@ -200,6 +773,103 @@ class SyncResult(enum.Enum):
     """Returned when the database schema has been upgraded."""
 
 
+@dataclass
+class UpsertResult:
+    """The result of an update_or_create_many() call."""
+
+    inserted: int = 0
+    """The number of inserted rows."""
+    updated: int = 0
+    """The number of updated rows."""
+    objects: Optional[list] = None
+    """The model instances, if they were requested."""
+
+    def _add(self, inserted, updated, objects=None):
+        self.inserted += inserted
+        self.updated += updated
+        if objects is not None:
+            self.objects.extend(objects)
+
+    def _add_returned_rows(self, rows):
+        """Add the rows returned by an upsert statement with the creation flags."""
+        inserted = sum(1 for row in rows if row.created)
+        objects = None if self.objects is None else [row[0] for row in rows]
+        self._add(inserted, len(rows) - inserted, objects)
+
+
+identity_map_stats = CacheStats()
+"""CacheStats: lookups by primary key in the session's identity map made by the query helpers."""
+
+
+class StatementCache:
+    """A LRU cache of the ``SELECT`` statements built by the query helpers.
+
+    The statements are keyed on the model and the names of the filtered attributes, and use bound
+    parameters for the values, so repeated lookups only need to bind new values instead of building
+    a new statement and generating its cache key. Only filters on column attributes are cached: the
+    other attributes, such as relationships, can't be compared to a bound parameter.
+
+    Args:
+        maxsize (int): the maximum number of statements to keep.
+
+    Attributes:
+        maxsize (int): the maximum number of statements to keep.
+        stats (CacheStats): the hit and miss counters.
+    """
+
+    def __init__(self, maxsize=500):
+        self.maxsize = maxsize
+        self.stats = CacheStats()
+        self._statements = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._statements)
+
+    def get(self, model, attrs):
+        """Get the statement filtering the model on the provided attributes.
+
+        Args:
+            model (manager.Base): the model class.
+            attrs (dict): the attributes to filter on.
+
+        Returns:
+            tuple: the statement and the parameters to execute it with.
+        """
+        column_attrs = sa_inspect(model).column_attrs
+        if not all(name in column_attrs for name in attrs):
+            return select(model).filter_by(**attrs), {}
+        # Comparisons to None must be rendered as IS NULL, they can't be bound parameters.
+        null_names = frozenset(name for name, value in attrs.items() if value is None)
+        params = {name: value for name, value in attrs.items() if value is not None}
+        key = (model, frozenset(params), null_names)
+        with self._lock:
+            try:
+                stmt = self._statements[key]
+            except KeyError:
+                self.stats.misses += 1
+                stmt = select(model).filter_by(
+                    **{name: bindparam(name) for name in params},
+                    **{name: None for name in null_names},
+                )
+                self._statements[key] = stmt
+                if len(self._statements) > self.maxsize:
+                    self._statements.popitem(last=False)
+            else:
+                self.stats.hits += 1
+                self._statements.move_to_end(key)
+        return stmt, params
+
+    def clear(self):
+        """Remove all the statements from the cache."""
+        with self._lock:
+            self._statements.clear()
+
+
+statement_cache = StatementCache()
+"""StatementCache: the cache of statements used by the query helpers."""
+
+
 # Events
 
 
@@ -215,22 +885,48 @@ def set_sqlite_pragma(dbapi_connection, connection_record):
 # Query helpers
 
 
+@tag_origin("get_by_pk")
 def get_by_pk(pk, *, session, model):
     """Get a model instance using its primary key.
 
+    If the model is cached in the :data:`~sqlalchemy_helpers.cache.result_cache` and the instance
+    is not already in the session, the instance will be looked up in the cache before querying the
+    database.
+
     Example: ``user = get_by_pk(42, session=session, model=User)``
     """
-    return session.get(model, pk)
-
-
+    if not result_cache.is_cached(model):
+        return session.get(model, pk)
+    identity, in_session = identity_in_session(session, model, pk)
+    if not in_session:
+        cached = result_cache.load(model, identity)
+        if cached is not None:
+            return session.merge(cached, load=False)
+    obj = session.get(model, pk)
+    if obj is not None and not in_session:
+        result_cache.store(obj)
+    return obj
+
+
+@tag_origin("get_one")
 def get_one(session, model, **attrs):
     """Get a model instance using filters.
 
+    If the filters are exactly the primary key, the instance is looked up in the session's identity
+    map first, and no query is issued if it is already loaded. See :data:`identity_map_stats`.
+    Otherwise, the statement is taken from the :data:`statement_cache`.
+
     Example: ``user = get_one(session, User, name="foo")``
     """
-    return session.query(model).filter_by(**attrs).one()
+    pk = _primary_key_from_attrs(model, attrs)
+    if pk is not None:
+        _record_identity_map_lookup(session, model, pk)
+        return _one_or_raise(session.get(model, pk))
+    stmt, params = statement_cache.get(model, attrs)
+    return session.execute(stmt, params).unique().scalar_one()
 
 
+@tag_origin("get_or_create")
 def get_or_create(session, model, **attrs):
     """Function like Django's ``get_or_create()`` method.
 
@@ -249,7 +945,51 @@ def get_or_create(session, model, **attrs):
         return obj, True
 
 
-def update_or_create(session, model, defaults=None, create_defaults=None, **attrs):
+@tag_origin("get_or_create_many")
+def get_or_create_many(session, model, rows, key=None):
+    """Like :func:`get_or_create`, but for many rows at once.
+
+    The existing rows are fetched with a single ``IN`` query and the missing ones are inserted in a
+    single flush, instead of a query and a flush per row.
+
+    It will return a list of tuples in the same order as ``rows``, the first item being the instance
+    and the second being a boolean: ``True`` if the instance has been created and ``False``
+    otherwise. If the same key appears more than once, the same instance will be returned and only
+    the first occurrence will be flagged as created.
+
+    Example::
+
+        results = get_or_create_many(session, User, [{"name": "foo"}, {"name": "bar"}])
+        for user, created in results:
+            ...
+
+    Args:
+        session (sqlalchemy.Session): the session instance to use.
+        model (manager.Base): the model class.
+        rows (iterable of dict): the attributes of each instance.
+        key (str or sequence of str, optional): the attribute(s) that identify an instance. Defaults
+            to all the attributes of the first row.
+
+    Returns:
+        list: a list of ``(instance, created)`` tuples.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    key = _normalize_key(key, rows)
+    existing = {
+        _key_of(obj, key): obj
+        for obj in session.query(model).filter(_key_criterion(model, key, rows))
+    }
+    results, new_objs = _match_or_build(model, key, rows, existing)
+    if new_objs:
+        session.add_all(new_objs)
+        session.flush()  # get the ids
+    return results
+
+
+@tag_origin("update_or_create")
+def update_or_create(session, model, defaults=None, create_defaults=None, upsert=False, **attrs):
     """Function like Django's ``update_or_create()`` method.
 
     It will return a tuple, the first argument being the instance and the
@@ -260,9 +1000,17 @@ def update_or_create(session, model, defaults=None, create_defaults=None, **attr
 
         user, created = update_or_create(session, User, name="foo", defaults={"full_name": "Foo"})
 
+    If ``upsert`` is ``True``, a single ``INSERT ... ON CONFLICT DO UPDATE`` statement (``ON
+    DUPLICATE KEY UPDATE`` on MySQL) will be used instead of a query followed by an update or an
+    insert, which avoids race conditions between concurrent callers. In this mode, the ``attrs``
+    must match a unique constraint or index of the table, only PostgreSQL, SQLite and MySQL are
+    supported, and SQLAlchemy 2.0 is required. The database must tell whether the row was created,
+    which only PostgreSQL does: on other databases the ``created`` boolean will be ``None``.
     """
     defaults = defaults or {}
     create_defaults = create_defaults or defaults
+    if upsert:
+        return _upsert(session, model, attrs, defaults, create_defaults)
     try:
         obj = get_one(session=session, model=model, **attrs)
         for key, value in defaults.items():
@@ -277,26 +1025,361 @@ def update_or_create(session, model, defaults=None, create_defaults=None, **attr
         return obj, True
 
 
+def _upsert(session, model, attrs, defaults, create_defaults):
+    dialect = session.get_bind().dialect
+    stmt = _upsert_statement(dialect, model, {**attrs, **create_defaults}, attrs, update=defaults)
+    result = session.execute(
+        _upsert_returning(dialect, stmt, model), execution_options={"populate_existing": True}
+    )
+    if _upsert_returns_row(dialect):
+        return _upsert_result(dialect, result)
+    # No RETURNING support, get the row with a separate query.
+    return session.query(model).populate_existing().filter_by(**attrs).one(), None
+
+
+@tag_origin("update_or_create_many")
+def update_or_create_many(
+    session,
+    model,
+    rows,
+    keys=None,
+    defaults_fields=None,
+    chunk_size=1000,
+    return_objects=False,
+):
+    """Insert or update many rows using one multi-row upsert statement per chunk.
+
+    The rows are read from the ``rows`` iterable in chunks of ``chunk_size``, so it can be a
+    generator. For each chunk, a single ``INSERT ... ON CONFLICT DO UPDATE`` statement (``ON
+    DUPLICATE KEY UPDATE`` on MySQL) is issued. On databases other than PostgreSQL, an additional
+    query counts the existing rows in the chunk to report how many were updated.
+
+    Only PostgreSQL, SQLite and MySQL are supported, and SQLAlchemy 2.0 is required. If the same
+    keys appear more than once in a chunk, the last row wins. The instances already loaded in the
+    session are only refreshed if ``return_objects`` is ``True``.
+
+    Example::
+
+        rows = ({"name": name, "full_name": name.title()} for name in names)
+        result = update_or_create_many(session, User, rows, keys="name")
+        print(f"{result.inserted} users created, {result.updated} users updated")
+
+    Args:
+        session (sqlalchemy.Session): the session instance to use.
+        model (manager.Base): the model class.
+        rows (iterable of dict): the attributes of each instance.
+        keys (str or sequence of str, optional): the attribute(s) that identify an instance, they
+            must match a unique constraint or index. Defaults to the primary key.
+        defaults_fields (sequence of str, optional): the attributes to update if the instance
+            exists. Defaults to all the attributes of the row except the ``keys``.
+        chunk_size (int): the number of rows in each statement.
+        return_objects (bool): whether to return the model instances. Defaults to ``False``.
+
+    Returns:
+        UpsertResult: the number of inserted and updated rows, and the model instances if
+        requested.
+    """
+    dialect = session.get_bind().dialect
+    keys = _upsert_keys(model, keys)
+    result = UpsertResult(objects=[] if return_objects else None)
+    for chunk in _upsert_chunks(rows, keys, chunk_size):
+        stmt = _upsert_many_statement(dialect, model, chunk, keys, defaults_fields, return_objects)
+        if _upsert_returns_created(dialect):
+            chunk_result = session.execute(stmt, execution_options={"populate_existing": True})
+            result._add_returned_rows(chunk_result.all())
+            continue
+        criterion = _key_criterion(model, keys, chunk)
+        existing = session.query(model).filter(criterion).count()
+        chunk_result = session.execute(stmt, execution_options={"populate_existing": True})
+        objects = None
+        if return_objects and _upsert_returns_row(dialect):
+            objects = chunk_result.scalars().all()
+        elif return_objects:
+            objects = session.query(model).populate_existing().filter(criterion).all()
+        result._add(len(chunk) - existing, existing, objects)
+    return result
+
+
+def _upsert_returns_row(dialect):
+    return getattr(dialect, "insert_returning", False)
+
+
+def _upsert_returns_created(dialect):
+    # The system column xmax is only set on updated rows.
+    return dialect.name == "postgresql"
+
+
+_CREATED_COLUMN = literal_column("xmax = 0", Boolean).label("created")
+
+
+def _upsert_statement(dialect, model, values, keys, update=None, update_from_values=()):
+    """Build an ``INSERT`` statement that updates the row if it already exists.
+
+    Args:
+        dialect (sqlalchemy.engine.Dialect): the database dialect.
+        model (manager.Base): the model class.
+        values (dict or list of dict): the values to insert.
+        keys (iterable of str): the attributes that identify the row, they must match a unique
+            constraint.
+        update (dict, optional): the values to set if the row exists.
+        update_from_values (iterable of str): the attributes to set to the inserted values if the
+            row exists.
+
+    Raises:
+        ValueError: if the dialect does not support upserts.
+
+    Returns:
+        sqlalchemy.sql.expression.Insert: the upsert statement.
+    """
+    columns = sa_inspect(model).columns
+    key_columns = [columns[name] for name in keys]
+    if dialect.name == "mysql":
+        stmt = mysql.insert(model).values(values)
+        inserted = stmt.inserted
+    elif dialect.name in ("postgresql", "sqlite"):
+        insert = postgresql.insert if dialect.name == "postgresql" else sqlite.insert
+        stmt = insert(model).values(values)
+        inserted = stmt.excluded
+    else:
+        raise ValueError(f"Upserts are not supported on {dialect.name}")
+    set_ = {columns[name]: value for name, value in (update or {}).items()}
+    set_.update({columns[name]: inserted[columns[name].key] for name in update_from_values})
+    # The row must be updated even without values to update, for the statement to return it.
+    set_ = set_ or {key_columns[0]: inserted[key_columns[0].key]}
+    if dialect.name == "mysql":
+        return stmt.on_duplicate_key_update(set_)
+    return stmt.on_conflict_do_update(index_elements=key_columns, set_=set_)
+
+
+def _upsert_returning(dialect, stmt, model=None):
+    """Make the upsert statement return the instances and the creation flags, when possible.
+
+    Args:
+        dialect (sqlalchemy.engine.Dialect): the database dialect.
+        stmt (sqlalchemy.sql.expression.Insert): the upsert statement.
+        model (manager.Base, optional): the model class, or ``None`` to only return the creation
+            flags.
+    """
+    returning = [] if model is None else [model]
+    if _upsert_returns_created(dialect):
+        returning.append(_CREATED_COLUMN)
+    if not returning or not _upsert_returns_row(dialect):
+        return stmt
+    return stmt.returning(*returning)
+
+
+def _upsert_result(dialect, result):
+    """Get the instance and the creation flag from the result of an upsert statement."""
+    row = result.one()
+    if _upsert_returns_created(dialect):
+        return row[0], row[1]
+    return row[0], None
+
+
+def _upsert_many_statement(dialect, model, rows, keys, defaults_fields, return_objects):
+    """Build the multi-row upsert statement for :func:`update_or_create_many`."""
+    if defaults_fields is None:
+        defaults_fields = [name for name in rows[0] if name not in keys]
+    stmt = _upsert_statement(dialect, model, rows, keys, update_from_values=defaults_fields)
+    # Don't build the instances unless asked to.
+    return _upsert_returning(dialect, stmt, model if return_objects else None)
+
+
+def _upsert_keys(model, keys):
+    if keys is None:
+        return _primary_key_names(model)
+    if isinstance(keys, str):
+        return (keys,)
+    return tuple(keys)
+
+
+def _upsert_chunks(rows, keys, chunk_size):
+    """Split the rows in chunks, keeping only the last row for each key in a chunk."""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        # A statement can't update the same row twice.
+        yield list({tuple(row[name] for name in keys): row for row in chunk}.values())
+
+
+def iter_all(session, model, *, chunk_size=1000, expunge=True, **filters):
+    """Iterate over all the instances of a model, without loading them all in memory.
+
+    The instances are loaded in chunks of ``chunk_size``, ordered by primary key. Each chunk is a
+    separate query that starts after the last primary key of the previous chunk (keyset
+    pagination), and is read with ``yield_per`` to use server-side cursors where available.
+
+    If ``expunge`` is ``True``, the instances of a chunk are removed from the session when the next
+    chunk is loaded, to keep the memory usage flat. Changes made to them that have not been flushed
+    by then will be lost.
+
+    Example::
+
+        for user in iter_all(session, User, chunk_size=500, active=True):
+            export(user)
+
+    Args:
+        session (sqlalchemy.Session): the session instance to use.
+        model (manager.Base): the model class.
+        chunk_size (int): the number of instances to load in each query.
+        expunge (bool): whether to remove the previous chunk from the session.
+        filters: the attributes to filter on, as in :func:`get_one`.
+
+    Yields:
+        manager.Base: the model instances.
+    """
+    query, pk_columns = _iter_all_query(model, chunk_size, filters)
+    chunk_query = query
+    while True:
+        chunk = []
+        with query_origin("iter_all"):
+            result = session.execute(chunk_query.execution_options(yield_per=chunk_size))
+        for obj in result.scalars():
+            chunk.append(obj)
+            yield obj
+        if expunge:
+            for obj in chunk:
+                session.expunge(obj)
+        if len(chunk) < chunk_size:
+            return
+        chunk_query = query.where(_keyset_after(pk_columns, sa_inspect(chunk[-1]).identity))
+
+
+def _iter_all_query(model, chunk_size, filters):
+    pk_columns = sa_inspect(model).primary_key
+    query = select(model).filter_by(**filters).order_by(*pk_columns).limit(chunk_size)
+    return query, pk_columns
+
+
+def _keyset_after(columns, values, descending=False):
+    """Build the criterion selecting the rows that come after ``values`` in ``columns`` order."""
+    if len(columns) == 1:
+        left, right = columns[0], values[0]
+    else:
+        left, right = tuple_(*columns), tuple_(*values)
+    return left < right if descending else left > right
+
+
+def _primary_key_names(model):
+    mapper = sa_inspect(model)
+    return tuple(mapper.get_property_by_column(column).key for column in mapper.primary_key)
+
+
+def _primary_key_from_attrs(model, attrs):
+    """Get the primary key identity if the attributes are exactly the primary key.
+
+    Returns:
+        tuple or None: the primary key values in the mapper's order, or ``None``.
+    """
+    names = _primary_key_names(model)
+    if len(attrs) != len(names) or any(attrs.get(name) is None for name in names):
+        return None
+    return tuple(attrs[name] for name in names)
+
+
+def _record_identity_map_lookup(session, model, pk):
+    if sa_inspect(model).identity_key_from_primary_key(pk) in session.identity_map:
+        identity_map_stats.hits += 1
+    else:
+        identity_map_stats.misses += 1
+
+
+def _one_or_raise(obj):
+    if obj is None:
+        raise NoResultFound("No row was found when one was required")
+    return obj
+
+
+def _normalize_key(key, rows):
+    if key is None:
+        return tuple(rows[0])
+    if isinstance(key, str):
+        return (key,)
+    return tuple(key)
+
+
+def _key_of(obj, key):
+    return tuple(getattr(obj, attr) for attr in key)
+
+
+def _key_criterion(model, key, rows):
+    """Build the ``IN`` criterion matching the keys of the provided rows."""
+    values = {tuple(row[attr] for attr in key) for row in rows}
+    if len(key) == 1:
+        return getattr(model, key[0]).in_([value[0] for value in values])
+    return tuple_(*[getattr(model, attr) for attr in key]).in_(values)
+
+
+def _match_or_build(model, key, rows, existing):
+    """Match the rows with the existing instances, and build the missing ones.
+
+    The ``existing`` mapping is updated with the new instances.
+
+    Returns:
+        tuple: the list of ``(instance, created)`` tuples and the list of new instances.
+    """
+    results = []
+    new_objs = []
+    for row in rows:
+        row_key = tuple(row[attr] for attr in key)
+        try:
+            results.append((existing[row_key], False))
+        except KeyError:
+            obj = existing[row_key] = model(**row)
+            new_objs.append(obj)
+            results.append((obj, True))
+    return results, new_objs
+
+
 def session_and_model_property(Session, func):
-    """Add a model property that uses the database session."""
+    """Add a model property that uses the database session.
 
-    # https://docs.python.org/3/howto/descriptor.html
-    class accessor:
-        def __get__(self, obj, objtype=None):
-            return partial(func, session=Session(), model=objtype)
+    The session is obtained from the ``Session`` factory when the function is called, not when the
+    property is accessed.
+    """
 
-    return accessor()
+    # Calling a scoped session's registry directly skips the handling of its arguments.
+    get_session = getattr(Session, "registry", Session)
+
+    def bind(model):
+        @wraps(func)
+        def helper(*args, **kwargs):
+            return func(*args, session=get_session(), model=model, **kwargs)
+
+        return helper
+
+    return _ModelHelperAccessor(bind)
 
 
 def model_property(func):
     """Add a model property to call a function that uses the database model."""
 
+    def bind(model):
+        return partial(func, model=model)
+
+    return _ModelHelperAccessor(bind)
+
+
+class _ModelHelperAccessor:
+    """A descriptor returning a function bound to the model, like a classmethod.
+
+    The bound functions are cached for each model, so accessing the property doesn't allocate
+    anything.
+    """
+
     # https://docs.python.org/3/howto/descriptor.html
-    class accessor:
-        def __get__(self, obj, objtype=None):
-            return partial(func, model=objtype)
+    def __init__(self, bind):
+        self._bind = bind
+        self._helpers = {}
 
-    return accessor()
+    def __get__(self, obj, objtype=None):
+        try:
+            return self._helpers[objtype]
+        except KeyError:
+            helper = self._helpers[objtype] = self._bind(objtype)
+            return helper
 
 
 # Migration helpers
@@ -310,22 +1393,85 @@ def is_sqlite(bind):
     return bind.dialect.name == "sqlite"
 
 
-def exists_in_db(bind, tablename, columnname=None):
+# The reflection caches of the inspectors, keyed on their bind. The inspectors themselves can't be
+# stored: they reference their bind, which would never be garbage collected.
+_info_caches = weakref.WeakKeyDictionary()
+
+
+def _get_inspector(bind, cache):
+    inspector = sa_inspect(bind)
+    if cache:
+        inspector.info_cache = _info_caches.setdefault(bind, {})
+    return inspector
+
+
+def clear_inspection_cache(bind):
+    """Forget the cached schema of a database, after changing it.
+
+    Args:
+        bind (sqlalchemy.engine.Engine): the database engine or connection, sync or async.
+    """
+    bind = getattr(bind, "sync_connection", getattr(bind, "sync_engine", bind))
+    _info_caches.pop(bind, None)
+
+
+def exists_in_db(bind, tablename, columnname=None, *, cache=False):
     """Check whether a table and optionally a column exist in the database.
 
+    Only the requested table is inspected.
+
     Args:
         bind (sqlalchemy.engine.Engine): the database engine or connection.
         tablename (str): the table to look for.
         columnname (str, optional): the column to look for, if any. Defaults to None.
+        cache (bool): whether to reuse the schema inspected by the previous calls with the same
+            ``bind``. The cache is not updated when the schema changes, see
+            :func:`clear_inspection_cache`.
 
     Returns:
         bool: Whether the database (and column) exist.
     """
-    md = MetaData()
-    md.reflect(bind=bind)
+    return _exists_in_db(_get_inspector(bind, cache), tablename, columnname)
+
+
+def _exists_in_db(inspector, tablename, columnname):
+    if not inspector.has_table(tablename):
+        return False
     if columnname is None:
-        return tablename in md.tables
-    else:
-        return tablename in md.tables and columnname in [
-            c.name for c in md.tables[tablename].columns
-        ]
+        return True
+    return columnname in [c["name"] for c in inspector.get_columns(tablename)]
+
+
+def exists_in_db_many(bind, names, *, cache=False):
+    """Check whether several tables and columns exist in the database.
+
+    The table names are listed in a single query, and the columns of each table in another.
+
+    Args:
+        bind (sqlalchemy.engine.Engine): the database engine or connection.
+        names (list): the table names, or ``(tablename, columnname)`` tuples to look for columns.
+        cache (bool): whether to reuse the schema inspected by the previous calls with the same
+            ``bind``, see :func:`exists_in_db`.
+
+    Returns:
+        dict: whether each of the tables (and columns) exist, keyed by the items of ``names``.
+    """
+    return _exists_in_db_many(_get_inspector(bind, cache), names)
+
+
+def _exists_in_db_many(inspector, names):
+    tables = set(inspector.get_table_names())
+    columns = {}
+    result = {}
+    for name in names:
+        if isinstance(name, str):
+            result[name] = name in tables
+            continue
+        tablename, columnname = name
+        if tablename not in tables:
+            result[name] = False
+            continue
+        if tablename not in columns:
+            columns[tablename] = {c["name"] for c in inspector.get_columns(tablename)}
+        result[name] = columnname in columns[tablename]
+    return result
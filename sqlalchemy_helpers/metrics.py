@@ -0,0 +1,293 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Connection pool and statement metrics.
+
+The metrics are sent to a :class:`MetricsSink`, which can be an adapter for your monitoring system
+(StatsD, Prometheus, etc) or the in-memory :class:`MemorySink`. Durations are in seconds.
+
+This must remain independent from any web framework.
+"""
+
+import threading
+import time
+from dataclasses import dataclass
+from functools import wraps
+from typing import Optional
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import exc as sa_exc
+
+
+class MetricsSink:
+    """The interface of the metrics sinks.
+
+    Implementations must be thread-safe.
+    """
+
+    def increment(self, name, value=1):
+        """Increment a counter.
+
+        Args:
+            name (str): the name of the counter.
+            value (int): the value to add to the counter.
+        """
+        raise NotImplementedError
+
+    def gauge(self, name, value):
+        """Set the current value of a gauge.
+
+        Args:
+            name (str): the name of the gauge.
+            value (float): the current value.
+        """
+        raise NotImplementedError
+
+    def observe(self, name, value):
+        """Record a value in a histogram.
+
+        Args:
+            name (str): the name of the histogram.
+            value (float): the observed value.
+        """
+        raise NotImplementedError
+
+
+@dataclass
+class Histogram:
+    """A summary of the values observed by :class:`MemorySink`."""
+
+    count: int = 0
+    """The number of observed values."""
+    total: float = 0.0
+    """The sum of the observed values."""
+    min: Optional[float] = None
+    """The smallest observed value."""
+    max: Optional[float] = None
+    """The largest observed value."""
+
+    @property
+    def mean(self):
+        """float or None: the average of the observed values."""
+        return self.total / self.count if self.count else None
+
+    def add(self, value):
+        """Record a value.
+
+        Args:
+            value (float): the observed value.
+        """
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+
+class MemorySink(MetricsSink):
+    """A metrics sink that keeps the values in memory, to be inspected at runtime.
+
+    Attributes:
+        counters (dict): the counter values by name.
+        gauges (dict): the gauge values by name.
+        histograms (dict): the :class:`Histogram` instances by name.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).add(value)
+
+    def reset(self):
+        """Remove all the values."""
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.histograms.clear()
+
+
+_pool_lock = threading.Lock()
+
+
+def _instrument_pool(pool, instrumentation):
+    """Measure the time spent in ``Pool.connect()``, including the wait for a connection.
+
+    A single wrapper is installed on the pool, it reports to all the instrumentations of the pool.
+    """
+    with _pool_lock:
+        timed_connect = pool.__dict__.get("connect")
+        if not hasattr(timed_connect, "instrumentations"):
+            original = timed_connect
+            connect = pool.connect
+
+            @wraps(connect)
+            def timed_connect():
+                start = time.perf_counter()
+                try:
+                    connection = connect()
+                except sa_exc.TimeoutError:
+                    for other in timed_connect.instrumentations:
+                        other._on_pool_timeout()
+                    raise
+                duration = time.perf_counter() - start
+                for other in timed_connect.instrumentations:
+                    other._on_pool_connect(duration)
+                return connection
+
+            timed_connect.original = original
+            timed_connect.instrumentations = ()
+            pool.connect = timed_connect
+        # Replace the tuple instead of changing it, the wrapper may be iterating over it
+        timed_connect.instrumentations += (instrumentation,)
+
+
+def _uninstrument_pool(pool, instrumentation):
+    """Stop reporting to an instrumentation, and remove the wrapper when it is the last one."""
+    with _pool_lock:
+        timed_connect = pool.__dict__.get("connect")
+        if instrumentation not in getattr(timed_connect, "instrumentations", ()):
+            return
+        timed_connect.instrumentations = tuple(
+            other for other in timed_connect.instrumentations if other is not instrumentation
+        )
+        if timed_connect.instrumentations:
+            return
+        if timed_connect.original is None:
+            del pool.connect
+        else:
+            pool.connect = timed_connect.original
+
+
+class EngineInstrumentation:
+    """Send the connection pool and statement metrics of an engine to a sink.
+
+    The following metrics are sent, prefixed with ``prefix`` and a dot:
+
+    - ``pool.checkout_time`` (histogram): the time spent waiting for a connection from the pool
+    - ``pool.checkouts`` (counter): the number of connections checked out from the pool
+    - ``pool.timeouts`` (counter): the number of times no connection was available in time
+    - ``pool.connects`` (counter): the number of new database connections
+    - ``pool.invalidations`` (counter): the number of invalidated connections
+    - ``pool.in_use`` (gauge): the number of connections currently checked out
+    - ``pool.overflow`` (gauge): the number of connections above ``pool_size``, for the pools that
+      have an overflow
+    - ``statements`` (counter): the number of SQL statements, counted before their execution
+    - ``statement_time`` (histogram): the execution time of the SQL statements
+    - ``statement_rows`` (counter): the number of rows reported by the driver (``SELECT``
+      statements are not counted by all drivers)
+    - ``statement_errors`` (counter): the number of SQL statements that failed
+
+    Args:
+        engine (sqlalchemy.engine.Engine or sqlalchemy.ext.asyncio.AsyncEngine): the engine.
+        sink (MetricsSink): the sink to send the metrics to.
+        prefix (str): the prefix of the metric names.
+    """
+
+    def __init__(self, engine, sink, prefix="db"):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.sink = sink
+        self.prefix = prefix
+        self._in_use = 0
+        self._lock = threading.Lock()
+        # Several instrumentations can be attached to the same engine
+        self._start_key = f"_sqlah_metrics_statement_start_{id(self)}"
+        self._pool = None
+        self._listeners = [
+            ("checkout", self._on_checkout),
+            ("checkin", self._on_checkin),
+            ("detach", self._on_checkin),
+            ("connect", self._on_connect),
+            ("invalidate", self._on_invalidate),
+            ("soft_invalidate", self._on_invalidate),
+            ("before_cursor_execute", self._before_cursor_execute),
+            ("after_cursor_execute", self._after_cursor_execute),
+            ("handle_error", self._on_error),
+            ("engine_disposed", self._on_disposed),
+        ]
+        for name, listener in self._listeners:
+            sa_event.listen(self.engine, name, listener)
+        self._instrument_pool(self.engine.pool)
+
+    def remove(self):
+        """Stop sending metrics."""
+        if self._pool is None:
+            # Already removed
+            return
+        for name, listener in self._listeners:
+            sa_event.remove(self.engine, name, listener)
+        _uninstrument_pool(self._pool, self)
+        self._pool = None
+
+    def _name(self, name):
+        return f"{self.prefix}.{name}"
+
+    def _instrument_pool(self, pool):
+        if self._pool is not None:
+            _uninstrument_pool(self._pool, self)
+        _instrument_pool(pool, self)
+        self._pool = pool
+
+    def _on_pool_connect(self, duration):
+        self.sink.observe(self._name("pool.checkout_time"), duration)
+
+    def _on_pool_timeout(self):
+        self.sink.increment(self._name("pool.timeouts"))
+
+    def _set_in_use(self, delta):
+        with self._lock:
+            self._in_use += delta
+            in_use = self._in_use
+        self.sink.gauge(self._name("pool.in_use"), in_use)
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.sink.increment(self._name("pool.checkouts"))
+        self._set_in_use(1)
+        overflow = getattr(self.engine.pool, "overflow", None)
+        if overflow is not None:
+            self.sink.gauge(self._name("pool.overflow"), max(overflow(), 0))
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        self._set_in_use(-1)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        self.sink.increment(self._name("pool.connects"))
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        self.sink.increment(self._name("pool.invalidations"))
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Keyed on the execution context: a statement that fails before its execution never
+        # reaches after_cursor_execute or handle_error, it must not shift the other start times
+        conn.info.setdefault(self._start_key, {})[context] = time.perf_counter()
+        self.sink.increment(self._name("statements"))
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info[self._start_key].pop(context)
+        self.sink.observe(self._name("statement_time"), time.perf_counter() - start)
+        if cursor.rowcount > 0:
+            self.sink.increment(self._name("statement_rows"), cursor.rowcount)
+
+    def _on_error(self, exception_context):
+        self.sink.increment(self._name("statement_errors"))
+        connection = exception_context.connection
+        if connection is not None and self._start_key in connection.info:
+            # The start time was already removed if the error came from after_cursor_execute
+            connection.info[self._start_key].pop(exception_context.execution_context, None)
+
+    def _on_disposed(self, engine):
+        # Disposing of the engine replaces its pool
+        self._instrument_pool(engine.pool)
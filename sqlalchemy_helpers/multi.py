@@ -0,0 +1,216 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Schema management of several databases at once.
+
+This is useful when the same schema is deployed in many databases, one per tenant for example.
+
+This must remain independent from any web framework.
+"""
+
+import importlib
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from .manager import _compare_revisions, Base, DatabaseManager, ScriptCache
+
+
+_log = logging.getLogger(__name__)
+
+
+@dataclass
+class DatabaseResult:
+    """The result of an operation on one of the databases of a :class:`MultiDatabaseManager`."""
+
+    uri: str
+    """The URI of the database, without the password."""
+    result: Any = None
+    """The :class:`~sqlalchemy_helpers.manager.DatabaseStatus` or
+    :class:`~sqlalchemy_helpers.manager.SyncResult` member, ``None`` if the operation failed."""
+    duration: float = 0.0
+    """The duration of the operation, in seconds."""
+    error: Optional[str] = None
+    """The error that made the operation fail, if any."""
+
+    @property
+    def failed(self):
+        """bool: whether the operation failed."""
+        return self.error is not None
+
+
+@contextmanager
+def _timed(description, uri):
+    """Measure the duration of an operation and catch its error, in the yielded DatabaseResult."""
+    database_result = DatabaseResult(uri=repr(make_url(uri)))
+    start = time.perf_counter()
+    try:
+        yield database_result
+    except Exception as e:
+        database_result.error = f"{type(e).__name__}: {e}"
+        _log.warning("Failed to %s %s: %s", description, database_result.uri, database_result.error)
+    finally:
+        database_result.duration = time.perf_counter() - start
+
+
+def _import_base_model(path):
+    """Import a declarative base from its ``module:attribute`` or dotted path."""
+    if ":" in path:
+        module_name, _, attribute = path.partition(":")
+    else:
+        module_name, _, attribute = path.rpartition(".")
+    base_model = importlib.import_module(module_name)
+    for name in attribute.split("."):
+        base_model = getattr(base_model, name)
+    return base_model
+
+
+def _make_manager(manager_class, uri, alembic_location, engine_args, base_model, action):
+    """Create the manager of a worker process, with the declarative base imported by its path."""
+    base_model = Base if base_model is None else _import_base_model(base_model)
+    if action == "sync" and not base_model.metadata.tables:
+        # In a spawned process the models have not been imported, don't create an empty schema.
+        raise ValueError(
+            "The declarative base has no table, set base_model to the import path of your models"
+        )
+    return manager_class(uri, alembic_location, engine_args=engine_args, base_model=base_model)
+
+
+def _run_action(manager_class, uri, alembic_location, engine_args, base_model, action, args):
+    """Run a manager's method on a database, in a worker process."""
+    with _timed(action, uri) as database_result:
+        manager = _make_manager(
+            manager_class, uri, alembic_location, engine_args, base_model, action
+        )
+        try:
+            database_result.result = getattr(manager, action)(*args)
+        finally:
+            manager.dispose()
+    return database_result
+
+
+def _future_result(uri, action, future):
+    """Get the DatabaseResult of a worker, or of its crash."""
+    with _timed(action, uri) as database_result:
+        return future.result()
+    return database_result
+
+
+class MultiDatabaseManager:
+    """Manage the schema of several databases that share the same Alembic migrations.
+
+    The databases are handled concurrently by a pool of workers, and the failure of one database
+    does not stop the operation on the others. Alembic's migration environment is global to the
+    process, so :meth:`sync` and :meth:`upgrade` run in a pool of processes. Declarative bases can't
+    be sent to another process, so ``base_model`` is the import path of the base, like
+    ``"myapp.models:Base"``, and the worker processes import it. :meth:`get_status` only reads the
+    current revision and runs in a pool of threads.
+
+    Args:
+        uris (list): the database URIs
+        alembic_location (str): a path to the alembic directory
+        engine_args (dict): additional arguments passed to ``create_engine``
+        base_model (str): the import path of the declarative base of the models to create in new
+            databases, like ``"myapp.models:Base"``
+        max_workers (int): the maximum number of databases handled at the same time
+    """
+
+    manager_class = DatabaseManager
+    _worker = staticmethod(_run_action)
+    _mp_context = None
+
+    def __init__(self, uris, alembic_location, *, engine_args=None, base_model=None, max_workers=4):
+        if base_model is not None and not isinstance(base_model, str):
+            raise TypeError(
+                'base_model must be the import path of the declarative base, like "myapp.models:Base"'
+            )
+        self.uris = list(uris)
+        self.alembic_location = alembic_location
+        self.engine_args = engine_args
+        self.base_model = base_model
+        self.max_workers = max_workers
+        from alembic.config import Config as AlembicConfig
+
+        alembic_cfg = AlembicConfig(os.path.join(alembic_location, "alembic.ini"))
+        alembic_cfg.set_main_option("script_location", alembic_location)
+        self._script_cache = ScriptCache(alembic_cfg)
+
+    def get_latest_revision(self):
+        """Get the most up-to-date alembic database revision available."""
+        return self._script_cache.get_head()
+
+    def get_status(self):
+        """Get the status of the databases.
+
+        Returns:
+            list: a :class:`DatabaseResult` per database, with a
+            :class:`~sqlalchemy_helpers.manager.DatabaseStatus` member as result.
+        """
+        latest = self.get_latest_revision()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return list(executor.map(lambda uri: self._get_status(uri, latest), self.uris))
+
+    def _get_status(self, uri, latest):
+        from alembic.migration import MigrationContext
+
+        with _timed("get the status of", uri) as database_result:
+            engine = create_engine(uri, **(self.engine_args or {}))
+            try:
+                with engine.connect() as connection:
+                    current = MigrationContext.configure(connection).get_current_revision()
+            finally:
+                engine.dispose()
+            database_result.result = _compare_revisions(current, latest)
+        return database_result
+
+    def sync(self):
+        """Create or update the schema of the databases.
+
+        Returns:
+            list: a :class:`DatabaseResult` per database, with a
+            :class:`~sqlalchemy_helpers.manager.SyncResult` member as result.
+        """
+        return self._run_in_processes("sync")
+
+    def upgrade(self, target="head"):
+        """Upgrade the schema of the databases.
+
+        Args:
+            target (str): the revision to upgrade to.
+
+        Returns:
+            list: a :class:`DatabaseResult` per database, with ``None`` as result.
+        """
+        return self._run_in_processes("upgrade", target)
+
+    def _run_in_processes(self, action, *args):
+        if not self.uris:
+            return []
+        with ProcessPoolExecutor(
+            max_workers=min(self.max_workers, len(self.uris)), mp_context=self._mp_context
+        ) as executor:
+            futures = [
+                executor.submit(self._worker, *self._worker_args(uri, action, args))
+                for uri in self.uris
+            ]
+            return [_future_result(uri, action, future) for uri, future in zip(self.uris, futures)]
+
+    def _worker_args(self, uri, action, args):
+        return (
+            self.manager_class,
+            uri,
+            self.alembic_location,
+            self.engine_args,
+            self.base_model,
+            action,
+            args,
+        )
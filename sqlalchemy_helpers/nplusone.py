@@ -0,0 +1,136 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Detection of N+1 queries.
+
+An N+1 query happens when the same statement is executed for each item of a list, typically when a
+lazy-loaded relationship is accessed in a loop. The statements executed in a scope (a web request or
+a session) are counted by fingerprint, and the repeated ones are reported.
+
+This must remain independent from any web framework.
+"""
+
+import threading
+import warnings
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event as sa_event
+from sqlalchemy.orm import Session
+
+from .querylog import fingerprint
+
+
+class NPlusOneWarning(UserWarning):
+    """A statement has been repeated more than the threshold in the same scope."""
+
+
+class NPlusOneError(Exception):
+    """A statement has been repeated more than the threshold in the same scope.
+
+    Attributes:
+        fingerprint (str): the fingerprint of the repeated statement.
+        count (int): the number of times it was executed.
+        attribute (str or None): the relationship attribute whose lazy load executed it, if any.
+    """
+
+    def __init__(self, message, fingerprint, count, attribute=None):
+        super().__init__(message)
+        self.fingerprint = fingerprint
+        self.count = count
+        self.attribute = attribute
+
+
+class _ScopeCounter:
+    def __init__(self, detector):
+        self.detector = detector
+        self.counts = {}
+        self.reported = set()
+        self.lock = threading.Lock()
+
+
+_scope = ContextVar("sqlah_n_plus_one_scope", default=None)
+_LAZY_LOAD_OPTION = "_sqlah_lazy_load"
+
+
+class NPlusOneDetector:
+    """Report the statements of an engine that are repeated in a scope.
+
+    Scopes are opened by the Flask and FastAPI integrations for each request, or with
+    :meth:`scope`.
+
+    Args:
+        engine (sqlalchemy.engine.Engine or sqlalchemy.ext.asyncio.AsyncEngine): the engine.
+        threshold (int): the number of times a statement can be executed in a scope before being
+            reported.
+        raise_error (bool): whether to raise :class:`NPlusOneError` instead of emitting a
+            :class:`NPlusOneWarning`.
+    """
+
+    def __init__(self, engine, threshold=5, raise_error=False):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.threshold = threshold
+        self.raise_error = raise_error
+        # Raising in before_cursor_execute would skip the handle_error listeners of the engine
+        sa_event.listen(self.engine, "after_cursor_execute", self._after_cursor_execute)
+
+    def remove(self):
+        """Stop detecting N+1 queries."""
+        if sa_event.contains(self.engine, "after_cursor_execute", self._after_cursor_execute):
+            sa_event.remove(self.engine, "after_cursor_execute", self._after_cursor_execute)
+
+    @contextmanager
+    def scope(self):
+        """Count the statements executed in the context.
+
+        Example::
+
+            with detector.scope():
+                for user in User.query.all():
+                    print(user.groups)
+        """
+        token = self._enter_scope()
+        try:
+            yield
+        finally:
+            self._exit_scope(token)
+
+    def _enter_scope(self):
+        return _scope.set(_ScopeCounter(self))
+
+    def _exit_scope(self, token):
+        try:
+            _scope.reset(token)
+        except ValueError:
+            # The token was created in another context, which the scope has not leaked out of
+            pass
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        counter = _scope.get()
+        if counter is None or counter.detector is not self:
+            return
+        key = fingerprint(statement)
+        with counter.lock:
+            count = counter.counts[key] = counter.counts.get(key, 0) + 1
+            if count <= self.threshold or key in counter.reported:
+                return
+            counter.reported.add(key)
+        attribute = context.execution_options.get(_LAZY_LOAD_OPTION)
+        message = f"Potential N+1 query: the same statement was executed {count} times"
+        if attribute is not None:
+            message += f", by the lazy load of {attribute}"
+        message += f": {key}"
+        if self.raise_error:
+            raise NPlusOneError(message, key, count, attribute)
+        warnings.warn(message, NPlusOneWarning, stacklevel=2)
+
+
+@sa_event.listens_for(Session, "do_orm_execute")
+def _tag_lazy_load(orm_execute_state):
+    """Tag the statements of lazy loads with the relationship attribute that triggered them."""
+    if _scope.get() is None or orm_execute_state.lazy_loaded_from is None:
+        return
+    attribute = orm_execute_state.loader_strategy_path.path[-1]
+    orm_execute_state.update_execution_options(**{_LAZY_LOAD_OPTION: str(attribute)})
@@ -0,0 +1,230 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Keyset pagination.
+
+Instead of skipping rows with ``OFFSET``, which gets slower as the page number grows, the next page
+is selected with a seek condition on the sort columns (``WHERE (a, b) > (:a, :b)``) that can use an
+index. The position in the result set is carried by an opaque cursor token.
+
+This must remain independent from any web framework.
+"""
+
+import base64
+import binascii
+import datetime
+import json
+import uuid
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.elements import ClauseElement, UnaryExpression
+from sqlalchemy.sql.expression import Executable
+from sqlalchemy.sql.operators import desc_op
+
+from .manager import _keyset_after
+from .querylog import tag_origin
+
+
+class InvalidCursor(ValueError):
+    """The pagination cursor could not be decoded."""
+
+
+@dataclass
+class Page:
+    """A page of results."""
+
+    items: list
+    """The model instances, or tuples if the query selects more than one entity or column."""
+    next_cursor: Optional[str] = None
+    """The cursor to get the next page, or ``None`` if this is the last page."""
+    total: Optional[int] = None
+    """The approximate number of results in all the pages, if it was requested."""
+
+    @property
+    def has_next(self):
+        """bool: whether there is a page after this one."""
+        return self.next_cursor is not None
+
+
+@tag_origin("paginate")
+def paginate(
+    query_or_select,
+    *,
+    order_by,
+    after=None,
+    limit=20,
+    session=None,
+    estimate_total=False,
+    max_count=1000,
+):
+    """Get a page of results using keyset pagination.
+
+    The ``order_by`` columns must uniquely identify a row (include the primary key) and must not
+    contain ``NULL`` values. They can all be in ascending order, or all in descending order with
+    ``column.desc()``. Any ordering already present on the query is replaced.
+
+    Args:
+        query_or_select (sqlalchemy.orm.Query or sqlalchemy.sql.Select): the query to paginate.
+        order_by (list): the columns to sort the results by.
+        after (str, optional): the cursor returned by the previous page, ``None`` to get the first
+            page.
+        limit (int): the maximum number of results in the page.
+        session (sqlalchemy.orm.Session, optional): the session to run the query with, required if
+            ``query_or_select`` is not a ``Query``.
+        estimate_total (bool): whether to compute an approximate total number of results. On
+            PostgreSQL this is the query planner's estimate, on other databases the results are
+            counted up to ``max_count``.
+        max_count (int): the maximum number of results to count when the planner's estimate is not
+            available.
+
+    Returns:
+        Page: the page of results.
+
+    Raises:
+        InvalidCursor: if the ``after`` cursor is invalid.
+    """
+    if isinstance(query_or_select, Query):
+        session = session or query_or_select.session
+        query_or_select = query_or_select.statement
+    stmt, n_columns = _page_statement(query_or_select, order_by, after, limit)
+    page = _make_page(session.execute(stmt).all(), n_columns, limit)
+    if estimate_total:
+        dialect = session.get_bind().dialect
+        result = session.execute(_total_statement(query_or_select, dialect, max_count))
+        page.total = _total_from_result(result.scalar(), dialect)
+    return page
+
+
+def _sort_columns(order_by):
+    """Get the columns in ``order_by`` and whether they are sorted in descending order."""
+    if not isinstance(order_by, (list, tuple)):
+        order_by = [order_by]
+    if not order_by:
+        raise ValueError("At least one column is required to paginate")
+    columns = []
+    directions = set()
+    for clause in order_by:
+        if isinstance(clause, UnaryExpression) and clause.modifier is not None:
+            columns.append(clause.element)
+            directions.add(clause.modifier is desc_op)
+        else:
+            columns.append(clause)
+            directions.add(False)
+    if len(directions) > 1:
+        raise ValueError("All the pagination columns must be sorted in the same direction")
+    return columns, directions.pop()
+
+
+def _page_statement(stmt, order_by, after, limit):
+    """Build the statement selecting a page, and the number of columns used by the cursor.
+
+    The sort columns are added to the selected columns to build the next cursor from the last row.
+    One more row than the limit is selected to know whether there is a next page.
+    """
+    if limit < 1:
+        raise ValueError("The page limit must be a positive number")
+    columns, descending = _sort_columns(order_by)
+    stmt = stmt.add_columns(*(column.label(f"_cursor_{i}") for i, column in enumerate(columns)))
+    stmt = stmt.order_by(None).order_by(
+        *(column.desc() if descending else column for column in columns)
+    )
+    if after is not None:
+        values = _decode_cursor(after, len(columns))
+        stmt = stmt.where(_keyset_after(columns, values, descending))
+    return stmt.limit(limit + 1), len(columns)
+
+
+def _make_page(rows, n_columns, limit):
+    """Build the page from the rows returned by the statement built by ``_page_statement()``."""
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = _encode_cursor(rows[-1][-n_columns:])
+    items = [row[0] if len(row) == n_columns + 1 else tuple(row[:-n_columns]) for row in rows]
+    return Page(items=items, next_cursor=next_cursor)
+
+
+# Cursor tokens
+
+_VALUE_TYPES = {
+    "dt": (datetime.datetime, datetime.datetime.fromisoformat),
+    "d": (datetime.date, datetime.date.fromisoformat),
+    "t": (datetime.time, datetime.time.fromisoformat),
+    "dec": (Decimal, Decimal),
+    "uuid": (uuid.UUID, uuid.UUID),
+}
+
+
+def _dump_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    for tag, (value_type, _load) in _VALUE_TYPES.items():
+        if isinstance(value, value_type):
+            return {tag: value.isoformat() if hasattr(value, "isoformat") else str(value)}
+    raise TypeError(f"Unsupported value in a pagination cursor: {value!r}")
+
+
+def _load_value(value):
+    if not isinstance(value, dict):
+        return value
+    ((tag, dumped),) = value.items()
+    return _VALUE_TYPES[tag][1](dumped)
+
+
+def _encode_cursor(values):
+    """Encode the sort column values of the last row of a page into an opaque token."""
+    payload = json.dumps([_dump_value(value) for value in values], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor, length):
+    """Decode a token built by ``_encode_cursor()``."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = [_load_value(value) for value in json.loads(payload)]
+    except (ArithmeticError, AttributeError, binascii.Error, KeyError, TypeError, ValueError) as e:
+        raise InvalidCursor(f"Invalid pagination cursor: {cursor!r}") from e
+    if len(values) != length:
+        raise InvalidCursor(f"Invalid pagination cursor: {cursor!r}")
+    return values
+
+
+# Total count estimation
+
+
+class _Explain(Executable, ClauseElement):
+    """An ``EXPLAIN`` statement returning the query plan in JSON."""
+
+    inherit_cache = False
+
+    def __init__(self, stmt):
+        self.stmt = stmt
+
+
+@compiles(_Explain)
+def _compile_explain(element, compiler, **kw):
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.stmt, **kw)}"
+
+
+def _total_statement(stmt, dialect, max_count):
+    """Build the statement estimating the number of rows selected by ``stmt``."""
+    if dialect.name == "postgresql":
+        return _Explain(stmt)
+    return select(func.count()).select_from(stmt.limit(max_count).subquery())
+
+
+def _total_from_result(result, dialect):
+    """Get the estimated number of rows from the result of ``_total_statement()``."""
+    if dialect.name != "postgresql":
+        return result
+    if isinstance(result, str):
+        # The JSON type is not decoded by all drivers
+        result = json.loads(result)
+    return int(result[0]["Plan"]["Plan Rows"])
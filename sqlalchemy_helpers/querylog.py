@@ -0,0 +1,302 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Slow query log.
+
+Statements are grouped by fingerprint: the SQL with literals and bound parameters replaced by
+placeholders. Each statement is tagged with its origin: the helper functions, Flask endpoints and
+FastAPI routes that were running when it was executed.
+
+This must remain independent from any web framework.
+"""
+
+import logging
+import re
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from inspect import iscoroutinefunction
+
+from sqlalchemy import event as sa_event
+
+
+_log = logging.getLogger(__name__)
+
+
+# Fingerprints
+
+_FINGERPRINT_SUBSTITUTIONS = [
+    # String literals
+    (re.compile(r"'(?:[^']|'')*'"), "?"),
+    # Bound parameters in the styles of the various drivers
+    (re.compile(r"%\(\w+\)s|%s|\$\d+|(?<!:):\w+"), "?"),
+    # Numeric literals
+    (re.compile(r"\b\d+(?:\.\d+)?\b"), "?"),
+    # Lists of values, as in IN clauses or multi-row inserts
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(...)"),
+    (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...)"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(statement):
+    """Normalize an SQL statement so that the executions of the same query can be grouped.
+
+    Args:
+        statement (str): the SQL statement.
+
+    Returns:
+        str: the statement with literals, bound parameters and lists of values replaced by
+        placeholders.
+    """
+    for pattern, replacement in _FINGERPRINT_SUBSTITUTIONS:
+        statement = pattern.sub(replacement, statement)
+    return statement.strip()
+
+
+# Origin tagging
+
+_origin = ContextVar("sqlah_query_origin", default=())
+# The number of attached query logs, origins are not tracked when it is zero.
+_tracking = 0
+_tracking_lock = threading.Lock()
+
+
+def _track(delta):
+    global _tracking
+    with _tracking_lock:
+        _tracking += delta
+
+
+def current_origin():
+    """Get the origin of the statements executed in the current context.
+
+    Returns:
+        str or None: the nested origins separated by ``" > "``, or ``None`` if there is no origin.
+    """
+    origin = _origin.get()
+    return " > ".join(origin) if origin else None
+
+
+def _push_origin(name):
+    return _origin.set((*_origin.get(), name))
+
+
+def _enter_origin(name):
+    """Tag the following statements with an origin, for the framework integrations.
+
+    Returns:
+        contextvars.Token or None: the token to pass to :func:`_exit_origin`.
+    """
+    if not _tracking:
+        return None
+    return _push_origin(name)
+
+
+def _exit_origin(token):
+    """Stop tagging the statements with the origin set by :func:`_enter_origin`."""
+    if token is None:
+        return
+    try:
+        _origin.reset(token)
+    except ValueError:
+        # The token was created in another context, which the origin has not leaked out of
+        pass
+
+
+@contextmanager
+def query_origin(name):
+    """Tag the statements executed in the context with an origin.
+
+    Example::
+
+        with query_origin("nightly-report"):
+            session.execute(...)
+
+    Args:
+        name (str): the origin, nested in the current one if any.
+    """
+    if not _tracking:
+        yield
+        return
+    token = _push_origin(name)
+    try:
+        yield
+    finally:
+        _origin.reset(token)
+
+
+def tag_origin(name):
+    """Decorate a function to tag the statements it executes with an origin.
+
+    Origins are only tracked when a :class:`SlowQueryLog` is attached, the overhead is negligible
+    otherwise.
+
+    Args:
+        name (str): the origin.
+    """
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+
+            @wraps(func)
+            async def wrapper(*args, **kwargs):
+                if not _tracking:
+                    return await func(*args, **kwargs)
+                token = _push_origin(name)
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    _origin.reset(token)
+
+        else:
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                if not _tracking:
+                    return func(*args, **kwargs)
+                token = _push_origin(name)
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _origin.reset(token)
+
+        return wrapper
+
+    return decorator
+
+
+# Query log
+
+
+@dataclass
+class QueryStats:
+    """The aggregated executions of the statements sharing a fingerprint."""
+
+    fingerprint: str
+    """The statement's fingerprint."""
+    count: int = 0
+    """The number of executions."""
+    total_time: float = 0.0
+    """The total execution time, in seconds."""
+    max_time: float = 0.0
+    """The longest execution time, in seconds."""
+    rows: int = 0
+    """The total number of rows reported by the driver. Most drivers don't report the number of
+    rows of ``SELECT`` statements, which are then not counted."""
+    origins: dict = field(default_factory=dict)
+    """The number of executions by origin."""
+
+    @property
+    def mean_time(self):
+        """float: the average execution time, in seconds."""
+        return self.total_time / self.count if self.count else 0.0
+
+
+class SlowQueryLog:
+    """Time the statements executed by an engine and log the slow ones.
+
+    Statements are aggregated by fingerprint, the most expensive ones can be retrieved with
+    :meth:`top`. Statements slower than the threshold are logged as warnings with their origin.
+
+    Args:
+        engine (sqlalchemy.engine.Engine or sqlalchemy.ext.asyncio.AsyncEngine): the engine.
+        threshold (float): the duration in seconds above which statements are logged.
+        max_fingerprints (int): the maximum number of fingerprints to keep statistics for. When
+            it is reached, the fingerprint with the lowest total time is forgotten.
+    """
+
+    def __init__(self, engine, threshold=0.5, max_fingerprints=1000):
+        self.engine = getattr(engine, "sync_engine", engine)
+        self.threshold = threshold
+        self.max_fingerprints = max_fingerprints
+        self._stats = {}
+        self._lock = threading.Lock()
+        # Several query logs can be attached to the same engine
+        self._start_key = f"_sqlah_querylog_start_{id(self)}"
+        self._attached = True
+        sa_event.listen(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        sa_event.listen(self.engine, "after_cursor_execute", self._after_cursor_execute)
+        sa_event.listen(self.engine, "handle_error", self._on_error)
+        _track(1)
+
+    def remove(self):
+        """Stop recording statements."""
+        if not self._attached:
+            return
+        self._attached = False
+        sa_event.remove(self.engine, "before_cursor_execute", self._before_cursor_execute)
+        sa_event.remove(self.engine, "after_cursor_execute", self._after_cursor_execute)
+        sa_event.remove(self.engine, "handle_error", self._on_error)
+        _track(-1)
+
+    def top(self, n=10, key="total_time"):
+        """Get the statistics of the most expensive statements.
+
+        Args:
+            n (int): the number of fingerprints to return.
+            key (str): the :class:`QueryStats` attribute to sort by, such as ``total_time``,
+                ``max_time``, ``mean_time`` or ``count``.
+
+        Returns:
+            list(QueryStats): the statistics, most expensive first.
+        """
+        with self._lock:
+            stats = list(self._stats.values())
+        return sorted(stats, key=lambda s: getattr(s, key), reverse=True)[:n]
+
+    def reset(self):
+        """Forget the recorded statistics."""
+        with self._lock:
+            self._stats.clear()
+
+    def record(self, statement, duration, rows=0, origin=None):
+        """Record the execution of a statement.
+
+        Args:
+            statement (str): the SQL statement.
+            duration (float): the execution time, in seconds.
+            rows (int or None): the number of rows, ``None`` if the driver did not report it.
+            origin (str or None): the origin of the statement.
+        """
+        key = fingerprint(statement)
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= self.max_fingerprints:
+                    cheapest = min(self._stats.values(), key=lambda s: s.total_time)
+                    del self._stats[cheapest.fingerprint]
+                stats = self._stats[key] = QueryStats(fingerprint=key)
+            stats.count += 1
+            stats.total_time += duration
+            stats.max_time = max(stats.max_time, duration)
+            stats.rows += rows or 0
+            stats.origins[origin] = stats.origins.get(origin, 0) + 1
+        if duration >= self.threshold:
+            rows = "?" if rows is None else rows
+            _log.warning(
+                "Slow query (%.3fs, %s rows) from %s: %s", duration, rows, origin or "?", key
+            )
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        # Keyed on the execution context: a statement that fails before its execution never
+        # reaches after_cursor_execute or handle_error, it must not shift the other start times
+        conn.info.setdefault(self._start_key, {})[context] = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - conn.info[self._start_key].pop(context)
+        # The rowcount is -1 when the driver does not know it, as for SELECT on most drivers
+        rows = cursor.rowcount if cursor.rowcount >= 0 else None
+        self.record(statement, duration, rows, current_origin())
+
+    def _on_error(self, exception_context):
+        connection = exception_context.connection
+        if connection is not None and self._start_key in connection.info:
+            # The start time was already removed if the error came from after_cursor_execute
+            connection.info[self._start_key].pop(exception_context.execution_context, None)
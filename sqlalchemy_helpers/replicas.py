@@ -0,0 +1,242 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Routing of read queries to replica databases.
+
+This must remain independent from any web framework.
+"""
+
+import dataclasses
+import enum
+import itertools
+import random
+import threading
+import time
+from typing import Optional
+
+from sqlalchemy import event as sa_event
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import Select
+
+
+class ReplicaStatus(enum.Enum):
+    """The status of a replica database, as observed by the last health check."""
+
+    UNKNOWN = enum.auto()
+    """The replica has not been checked yet, it is used."""
+    HEALTHY = enum.auto()
+    """The replica is reachable and up-to-date, it is used."""
+    LAGGING = enum.auto()
+    """The replica is more than ``max_lag`` seconds behind the primary, it is not used."""
+    UNAVAILABLE = enum.auto()
+    """The health check failed, the replica is not used."""
+
+
+@dataclasses.dataclass
+class ReplicaHealth:
+    """The health of a replica database."""
+
+    url: str
+    """The URL of the replica, without the password."""
+    status: ReplicaStatus = ReplicaStatus.UNKNOWN
+    """The status of the replica."""
+    lag: Optional[float] = None
+    """The replication lag in seconds, if the database can report it."""
+    latency: Optional[float] = None
+    """The moving average of the health check duration, in seconds."""
+    last_check: Optional[float] = None
+    """The timestamp of the last health check."""
+    error: Optional[str] = None
+    """The error of the last health check, if it failed."""
+
+    @property
+    def available(self):
+        """bool: whether read queries can be sent to the replica."""
+        return self.status in (ReplicaStatus.UNKNOWN, ReplicaStatus.HEALTHY)
+
+
+class ReplicaRouter:
+    """Choose the engine that a statement should be executed on.
+
+    Args:
+        primary (sqlalchemy.engine.Engine): the engine of the primary database.
+        replicas (list): the engines of the replica databases.
+        strategy (str): how to choose a replica: ``round-robin``, ``least-connections`` to use
+            the replica with the fewest connections checked out of its pool, or ``latency`` to
+            choose randomly with a higher probability for the replicas that answer the health
+            checks faster.
+        read_your_writes (float): the number of seconds after a commit during which all the
+            queries are sent to the primary, so that the replication lag does not hide the changes
+            that were just made.
+        max_lag (float): the replication lag in seconds above which a replica is not used.
+
+    Raises:
+        ValueError: if the strategy is unknown.
+    """
+
+    STRATEGIES = ("round-robin", "least-connections", "latency")
+    # The weight of the last health check in the latency moving average
+    LATENCY_SMOOTHING = 0.3
+
+    def __init__(
+        self, primary, replicas, strategy="round-robin", read_your_writes=2.0, max_lag=30.0
+    ):
+        if strategy not in self.STRATEGIES:
+            raise ValueError(
+                f"Unknown replica strategy {strategy!r}, use one of: {', '.join(self.STRATEGIES)}"
+            )
+        self.primary = getattr(primary, "sync_engine", primary)
+        self.replicas = [getattr(replica, "sync_engine", replica) for replica in replicas]
+        self.strategy = strategy
+        self.read_your_writes = read_your_writes
+        self.max_lag = max_lag
+        self.health = [ReplicaHealth(url=repr(replica.url)) for replica in self.replicas]
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._primary_until = 0.0
+
+    def get_replica(self):
+        """Choose a replica for a read query.
+
+        Returns:
+            sqlalchemy.engine.Engine: the replica's engine, or the primary's engine if no replica
+            is available or if a commit happened less than ``read_your_writes`` seconds ago.
+        """
+        if time.monotonic() < self._primary_until:
+            return self.primary
+        available = [index for index, health in enumerate(self.health) if health.available]
+        if not available:
+            return self.primary
+        if self.strategy == "least-connections":
+            return min((self.replicas[index] for index in available), key=_checked_out)
+        if self.strategy == "latency":
+            latencies = [self.health[index].latency for index in available]
+            known = [latency for latency in latencies if latency is not None]
+            default = sum(known) / len(known) if known else 1.0
+            weights = [1 / max(latency or default, 1e-6) for latency in latencies]
+            (index,) = random.choices(available, weights=weights)  # noqa: S311
+            return self.replicas[index]
+        # Choose among the replicas that were available above, the health checks may have changed
+        # their status since then.
+        with self._lock:
+            index = available[next(self._counter) % len(available)]
+        return self.replicas[index]
+
+    def record_write(self):
+        """Send the read queries to the primary for the ``read_your_writes`` window."""
+        self._primary_until = time.monotonic() + self.read_your_writes
+
+    def record_check(self, index, latency, lag):
+        """Record a successful health check.
+
+        Args:
+            index (int): the index of the replica.
+            latency (float): the duration of the health check, in seconds.
+            lag (float or None): the replication lag in seconds, if known.
+        """
+        health = self.health[index]
+        if health.latency is not None:
+            latency = (
+                self.LATENCY_SMOOTHING * latency + (1 - self.LATENCY_SMOOTHING) * health.latency
+            )
+        lagging = lag is not None and lag > self.max_lag
+        self.health[index] = dataclasses.replace(
+            health,
+            status=ReplicaStatus.LAGGING if lagging else ReplicaStatus.HEALTHY,
+            lag=lag,
+            latency=latency,
+            last_check=time.time(),
+            error=None,
+        )
+
+    def record_failure(self, index, error):
+        """Record a failed health check.
+
+        Args:
+            index (int): the index of the replica.
+            error (Exception): the error.
+        """
+        self.health[index] = dataclasses.replace(
+            self.health[index],
+            status=ReplicaStatus.UNAVAILABLE,
+            last_check=time.time(),
+            error=str(error),
+        )
+
+
+# Replication lag, on the databases that can report it
+_LAG_STATEMENTS = {
+    "postgresql": text(
+        "SELECT CASE"
+        " WHEN NOT pg_is_in_recovery() THEN 0"
+        " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0"
+        " ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())"
+        " END"
+    ),
+}
+
+
+def _check_replica(connection):
+    """Run the health check on a replica's connection.
+
+    Returns:
+        float or None: the replication lag in seconds, if the database can report it.
+    """
+    statement = _LAG_STATEMENTS.get(connection.dialect.name)
+    if statement is None:
+        connection.execute(text("SELECT 1"))
+        return None
+    lag = connection.execute(statement).scalar()
+    return None if lag is None else float(lag)
+
+
+def _checked_out(engine):
+    checkedout = getattr(engine.pool, "checkedout", None)
+    return checkedout() if checkedout is not None else 0
+
+
+class RoutingSession(Session):
+    """A session that executes the read queries on replicas.
+
+    ``SELECT`` statements are sent to a replica chosen by the router, unless they lock rows
+    (``FOR UPDATE``) or the session has already written in the current transaction. Everything
+    else, including the flushes, is sent to the primary.
+
+    Args:
+        router (ReplicaRouter or None): the router, if ``None`` the session behaves like a regular
+            :class:`sqlalchemy.orm.Session`.
+    """
+
+    def __init__(self, *args, router=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.router = router
+        self._sqlah_has_writes = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.router is None:
+            return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+        if (
+            not self._flushing
+            and not self._sqlah_has_writes
+            and isinstance(clause, Select)
+            and clause._for_update_arg is None
+        ):
+            return self.router.get_replica()
+        if self._flushing or (clause is not None and clause.is_dml):
+            self._sqlah_has_writes = True
+        return self.router.primary
+
+
+@sa_event.listens_for(RoutingSession, "after_commit")
+def _record_write(session):
+    if session._sqlah_has_writes:
+        session.router.record_write()
+    session._sqlah_has_writes = False
+
+
+@sa_event.listens_for(RoutingSession, "after_rollback")
+def _reset_writes(session):
+    session._sqlah_has_writes = False
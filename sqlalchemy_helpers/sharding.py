@@ -0,0 +1,188 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+"""
+Horizontal sharding of the models across several databases.
+
+The rows of a sharded model are stored in one of the shards, chosen by the model's shard key
+function. The models without a shard key function are stored in the default database. This is
+built on SQLAlchemy's :mod:`horizontal sharding extension <sqlalchemy.ext.horizontal_shard>`.
+
+This must remain independent from any web framework.
+"""
+
+import sqlalchemy
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.orm.exc import UnmappedColumnError
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList
+
+
+DEFAULT_SHARD = "default"
+"""str: the shard id of the default database."""
+
+
+class ShardMap:
+    """Choose the shards that the instances and statements of the models are sent to.
+
+    A shard key function is passed a dict of attribute values and returns a shard id. It must raise
+    a ``KeyError`` if the attributes it needs are missing, in which case the statements are sent to
+    every shard. For example::
+
+        ShardMap(engine, shards, {Event: lambda attrs: "eu" if attrs["region"] == "eu" else "us"})
+
+    The values are taken from the instances when they are flushed, from the primary keys in
+    ``session.get()``, and from the equality criteria of the ``WHERE`` clause in the ``SELECT``,
+    ``UPDATE`` and ``DELETE`` statements.
+
+    Args:
+        default (sqlalchemy.engine.Engine): the engine of the default database.
+        shards (dict): the engines of the shards by shard id.
+        shard_keys (dict): the shard key functions by model class.
+
+    Raises:
+        ValueError: if a shard uses the id of the default database.
+    """
+
+    def __init__(self, default, shards, shard_keys=None):
+        if DEFAULT_SHARD in shards:
+            raise ValueError(f"The shard id {DEFAULT_SHARD!r} is reserved for the default database")
+        self.engines = {DEFAULT_SHARD: getattr(default, "sync_engine", default)}
+        for shard_id, engine in shards.items():
+            self.engines[shard_id] = getattr(engine, "sync_engine", engine)
+        self.shard_ids = list(shards)
+        self.shard_keys = dict(shard_keys or {})
+
+    def _key_function(self, mapper):
+        for base_mapper in mapper.iterate_to_root():
+            if base_mapper.class_ in self.shard_keys:
+                return self.shard_keys[base_mapper.class_]
+        return None
+
+    def shard_for(self, model, attrs):
+        """Get the shard that a model's row is stored in.
+
+        Args:
+            model (manager.Base or sqlalchemy.orm.Mapper): the model class.
+            attrs (dict): the attribute values of the row.
+
+        Returns:
+            str or None: the shard id, or ``None`` if the attributes do not contain the shard key.
+        """
+        key_function = self._key_function(sa_inspect(model))
+        if key_function is None:
+            return DEFAULT_SHARD
+        try:
+            return key_function(attrs)
+        except KeyError:
+            return None
+
+    def shards_for(self, model, attrs):
+        """Get the shards that a model's row may be stored in.
+
+        Args:
+            model (manager.Base or sqlalchemy.orm.Mapper): the model class.
+            attrs (dict): the known attribute values of the row.
+
+        Returns:
+            list: the shard ids.
+        """
+        shard_id = self.shard_for(model, attrs)
+        if shard_id is None:
+            return list(self.shard_ids)
+        return [shard_id]
+
+    def session_args(self):
+        """Get the session factory arguments that route the statements to the shards.
+
+        Returns:
+            dict: the keyword arguments of :class:`sqlalchemy.orm.sessionmaker`.
+        """
+        args = {
+            "class_": ShardingSession,
+            "shards": self.engines,
+            "shard_chooser": self._choose_shard,
+            "execute_chooser": self._choose_execute,
+        }
+        if sqlalchemy.__version__.startswith("1."):  # pragma: no cover
+            args["id_chooser"] = self._choose_identity_legacy
+        else:
+            args["identity_chooser"] = self._choose_identity
+        return args
+
+    def _choose_shard(self, mapper, instance, clause=None, **kwargs):
+        if instance is None:
+            # Only the dialect of the engine is needed
+            return self.shards_for(mapper, {})[0]
+        shard_id = self.shard_for(mapper, sa_inspect(instance).dict)
+        if shard_id is None:
+            raise ValueError(f"The shard key of {instance!r} is not set")
+        return shard_id
+
+    def _choose_identity(self, mapper, primary_key, *, lazy_loaded_from=None, **kwargs):
+        if lazy_loaded_from is not None and lazy_loaded_from.identity_token is not None:
+            return [lazy_loaded_from.identity_token]
+        attrs = {
+            mapper.get_property_by_column(column).key: value
+            for column, value in zip(mapper.primary_key, primary_key)
+        }
+        return self.shards_for(mapper, attrs)
+
+    def _choose_identity_legacy(self, query, primary_key):  # pragma: no cover
+        mapper = sa_inspect(query.column_descriptions[0]["entity"])
+        return self._choose_identity(mapper, primary_key)
+
+    def _choose_execute(self, orm_context):
+        mapper = orm_context.bind_mapper
+        if mapper is None:
+            return [DEFAULT_SHARD]
+        if orm_context.is_insert and self._key_function(mapper) is not None:
+            raise ValueError(
+                f"Can't choose the shard of an INSERT statement on {mapper.class_.__name__}, "
+                "pass a shard_id in the bind_arguments"
+            )
+        attrs = _criteria_values(mapper, orm_context.statement, orm_context.parameters)
+        return self.shards_for(mapper, attrs)
+
+
+class ShardingSession(ShardedSession):
+    """A sharded session that uses the default database for the statements without a model.
+
+    This is where the Alembic version table is read from, for example.
+    """
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kwargs):
+        if shard_id is None and mapper is None and instance is None:
+            shard_id = DEFAULT_SHARD
+        return super().get_bind(
+            mapper, shard_id=shard_id, instance=instance, clause=clause, **kwargs
+        )
+
+
+def _criteria_values(mapper, statement, parameters):
+    """Get the attribute values that a statement's ``WHERE`` clause requires."""
+    whereclause = getattr(statement, "whereclause", None)
+    if whereclause is None:
+        return {}
+    if isinstance(whereclause, BooleanClauseList) and whereclause.operator is operators.and_:
+        clauses = whereclause.clauses
+    else:
+        clauses = [whereclause]
+    if not isinstance(parameters, dict):
+        parameters = {}
+    values = {}
+    for clause in clauses:
+        if not (
+            isinstance(clause, BinaryExpression)
+            and clause.operator is operators.eq
+            and isinstance(clause.right, BindParameter)
+        ):
+            continue
+        try:
+            prop = mapper.get_property_by_column(clause.left)
+        except UnmappedColumnError:
+            continue
+        values[prop.key] = parameters.get(clause.right.key, clause.right.effective_value)
+    return values
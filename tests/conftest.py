@@ -9,7 +9,8 @@ from contextlib import suppress
 from importlib import import_module
 from shutil import copyfile
 
-import alembic
+import alembic.command
+import alembic.config
 import pytest
 from flask import Flask
 
@@ -6,7 +6,8 @@ import os
 import shutil
 import sys
 
-import alembic
+import alembic.command
+import alembic.config
 import pytest
 
 from sqlalchemy_helpers.manager import Base
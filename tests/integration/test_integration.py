@@ -7,7 +7,8 @@ import subprocess
 import sys
 from importlib import import_module
 
-import alembic
+import alembic.command
+import alembic.config
 
 
 def test_config(full_app, clear_metadata, tmpdir):
@@ -3,25 +3,49 @@
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
 import asyncio
+from collections import namedtuple
 from functools import partial
 from unittest import mock
 
 import alembic
 import pytest
+import sqlalchemy
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.orm.exc import NoResultFound
 
 from sqlalchemy_helpers.aio import (
     _async_from_sync_url,
     AsyncDatabaseManager,
     get_by_pk,
+    get_one,
     get_or_create,
+    get_or_create_many,
+    iter_all,
     update_or_create,
+    update_or_create_many,
+)
+from sqlalchemy_helpers.aio import exists_in_db as async_exists_in_db
+from sqlalchemy_helpers.aio import exists_in_db_many as async_exists_in_db_many
+from sqlalchemy_helpers.manager import (
+    CacheStats,
+    clear_inspection_cache,
+    DatabaseStatus,
+    exists_in_db,
+    identity_map_stats,
+    SyncResult,
+    UpsertResult,
 )
-from sqlalchemy_helpers.manager import DatabaseStatus, exists_in_db, SyncResult
 
 from .models import User
 
 
+requires_sqla2 = pytest.mark.skipif(
+    sqlalchemy.__version__.startswith("1."), reason="Upserts require SQLAlchemy 2.0"
+)
+
+
 @pytest.fixture
 async def manager(app, async_enabled_env_script):
     yield AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
@@ -29,6 +53,7 @@ async def manager(app, async_enabled_env_script):
 
 def test_manager_engine_args(app, monkeypatch):
     create_engine = mock.Mock()
+    monkeypatch.setattr("sqlalchemy_helpers.aio.protect_from_fork", mock.Mock())
     monkeypatch.setattr("sqlalchemy_helpers.aio.create_async_engine", create_engine)
     AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], engine_args={"foo": "bar"})
     create_engine.assert_called_once_with(
@@ -130,6 +155,21 @@ async def test_async_get_by_pk(manager, async_session):
     assert user.id == user2.id
 
 
+async def test_async_get_one_primary_key(manager, async_session):
+    await manager.create()
+    user = User(name="dummy")
+    async_session.add(user)
+    await async_session.flush()
+    identity_map_stats.reset()
+    assert (await get_one(async_session, User, id=user.id)) is user
+    assert identity_map_stats == CacheStats(hits=1, misses=0)
+    async_session.expunge_all()
+    assert (await get_one(async_session, User, id=user.id)).name == "dummy"
+    assert identity_map_stats == CacheStats(hits=1, misses=1)
+    with pytest.raises(NoResultFound):
+        await get_one(async_session, User, id=user.id + 1)
+
+
 async def test_async_get_or_create(manager, async_session):
     await manager.create()
     user, created = await get_or_create(async_session, User, name="dummy")
@@ -156,6 +196,36 @@ async def test_get_or_create_property(manager, async_session):
     assert user.id == user2.id
 
 
+async def test_async_get_or_create_many(manager, async_session):
+    await manager.create()
+    existing = User(name="existing")
+    async_session.add(existing)
+    await async_session.flush()
+    results = await get_or_create_many(
+        async_session,
+        User,
+        [{"name": "new1"}, {"name": "existing"}, {"name": "new1"}],
+        key="name",
+    )
+    assert [(user.name, created) for user, created in results] == [
+        ("new1", True),
+        ("existing", False),
+        ("new1", False),
+    ]
+    assert results[1][0] is existing
+    assert results[0][0] is results[2][0]
+    assert results[0][0].id is not None
+    assert await get_or_create_many(async_session, User, []) == []
+
+
+async def test_async_get_or_create_many_property(manager, async_session):
+    await manager.create()
+    results = await User.get_or_create_many(async_session, rows=[{"name": "dummy"}])
+    assert [(user.name, created) for user, created in results] == [("dummy", True)]
+    results = await User.get_or_create_many(async_session, rows=[{"name": "dummy"}])
+    assert [(user.name, created) for user, created in results] == [("dummy", False)]
+
+
 async def test_async_update_or_create(manager, async_session):
     await manager.create()
     user, created = await update_or_create(
@@ -186,6 +256,186 @@ async def test_async_update_or_create(manager, async_session):
     assert user3.full_name == "Correct Value"
 
 
+@requires_sqla2
+async def test_async_update_or_create_upsert(manager, async_session):
+    await manager.create()
+    user, created = await update_or_create(
+        async_session, User, name="dummy", defaults={"full_name": "Dummy"}, upsert=True
+    )
+    assert created is None
+    assert user.full_name == "Dummy"
+    user2, created = await update_or_create(
+        async_session, User, name="dummy", defaults={"full_name": "New Value"}, upsert=True
+    )
+    assert user2 is user
+    assert user.full_name == "New Value"
+
+
+@requires_sqla2
+async def test_async_update_or_create_upsert_no_returning(manager, async_session, monkeypatch):
+    await manager.create()
+    monkeypatch.setattr(async_session.get_bind().dialect, "insert_returning", False)
+    user, created = await update_or_create(
+        async_session, User, name="dummy", defaults={"full_name": "Dummy"}, upsert=True
+    )
+    assert created is None
+    assert user.full_name == "Dummy"
+
+
+@requires_sqla2
+async def test_async_update_or_create_many(manager, async_session):
+    await manager.create()
+    async_session.add(User(name="existing", full_name="Old Value"))
+    await async_session.flush()
+    rows = ({"name": name, "full_name": f"Full {name}"} for name in ["new1", "existing", "new2"])
+    result = await update_or_create_many(async_session, User, rows, keys="name", chunk_size=2)
+    assert result == UpsertResult(inserted=2, updated=1, objects=None)
+    result = await User.update_or_create_many(
+        async_session,
+        rows=[{"name": "new1", "full_name": "Updated"}],
+        keys="name",
+        return_objects=True,
+    )
+    assert result.updated == 1
+    assert [user.full_name for user in result.objects] == ["Updated"]
+
+
+@requires_sqla2
+async def test_async_update_or_create_many_no_returning(manager, async_session, monkeypatch):
+    await manager.create()
+    monkeypatch.setattr(async_session.get_bind().dialect, "insert_returning", False)
+    result = await update_or_create_many(
+        async_session,
+        User,
+        [{"name": "dummy", "full_name": "Dummy"}],
+        keys="name",
+        return_objects=True,
+    )
+    assert result.inserted == 1
+    assert [user.full_name for user in result.objects] == ["Dummy"]
+
+
+@requires_sqla2
+async def test_async_update_or_create_many_postgresql():
+    session = mock.AsyncMock()
+    session.get_bind = mock.Mock()
+    session.get_bind.return_value.dialect = postgresql.dialect()
+    Row = namedtuple("Row", ["created"])
+    session.execute.return_value = mock.Mock()
+    session.execute.return_value.all.return_value = [Row(True), Row(False)]
+    result = await update_or_create_many(session, User, [{"name": "foo"}], keys="name")
+    assert result == UpsertResult(inserted=1, updated=1, objects=None)
+
+
+async def test_async_iter_all(manager, async_session):
+    await manager.create()
+    async_session.add_all([User(name=f"user{i}") for i in range(5)])
+    await async_session.commit()
+    names = [user.name async for user in iter_all(async_session, User, chunk_size=2)]
+    assert names == [f"user{i}" for i in range(5)]
+    assert len(async_session.identity_map) == 0
+    users = [
+        user
+        async for user in User.iter_all(async_session, chunk_size=10, expunge=False, name="user3")
+    ]
+    assert [user.name for user in users] == ["user3"]
+    assert users[0] in async_session
+
+
+async def test_async_manager_lazy(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    assert "engine" not in manager.__dict__
+    await manager.create()
+    async with manager.Session() as session:
+        session.add(User(name="dummy"))
+        await session.commit()
+        assert (await User.get_one(session, name="dummy")).name == "dummy"
+    await manager.dispose()
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    await manager.dispose()
+    assert "engine" not in manager.__dict__
+
+
+async def test_async_manager_lazy_configure(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    manager.Session.configure(autoflush=False)
+    await manager.create()
+    async with manager.Session() as session:
+        assert session.bind is manager.engine
+        assert not session.autoflush
+        # The manager's session arguments are kept
+        assert not session.sync_session.expire_on_commit
+    await manager.dispose()
+
+
+async def test_async_manager_warm_up(app, async_enabled_env_script):
+    # SQLite files use a NullPool with SQLAlchemy 1.4
+    engine_args = {"poolclass": sqlalchemy.pool.AsyncAdaptedQueuePool, "pool_size": 3}
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], engine_args=engine_args)
+    await manager.create()
+    result = await manager.warm_up(statements=[sqlalchemy.select(User), "SELECT 2"])
+    assert result.connections == 3
+    assert result.duration > 0
+    assert result.errors == []
+    assert manager.engine.sync_engine.pool.checkedin() == 3
+    # Capped to the pool size
+    assert (await manager.warm_up(10)).connections == 3
+    # Errors
+    result = await manager.warm_up(2, statements=["SELECT * FROM dummy"])
+    assert result.connections == 0
+    assert len(result.errors) == 2
+    assert result.errors[0].startswith("OperationalError: ")
+    assert manager.engine.sync_engine.pool.checkedout() == 0
+    # Cancellations
+    with mock.patch.object(AsyncConnection, "start", side_effect=asyncio.CancelledError()):
+        result = await manager.warm_up(1)
+    assert result.connections == 0
+    assert result.errors == ["CancelledError: "]
+    await manager.dispose()
+
+
+async def test_async_manager_warm_up_no_pool(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(
+        app["db_uri"], app["alembic_dir"], engine_args={"poolclass": sqlalchemy.pool.NullPool}
+    )
+    assert (await manager.warm_up()).connections == 1
+    assert (await manager.warm_up(2)).connections == 2
+    await manager.dispose()
+
+
+async def test_async_exists_in_db(manager):
+    async with manager.engine.connect() as connection:
+        result = await async_exists_in_db_many(connection, ["users"], cache=True)
+        assert result == {"users": False}
+        await connection.run_sync(manager._base_model.metadata.create_all)
+        # The cached schema is out of date
+        result = await async_exists_in_db_many(connection, ["users"], cache=True)
+        assert result == {"users": False}
+        clear_inspection_cache(connection)
+        assert await async_exists_in_db(connection, "users", "name", cache=True)
+        await connection.commit()
+    assert await async_exists_in_db(manager.engine, "users", "id")
+    assert not await async_exists_in_db(manager.engine, "users", "foobar")
+    assert await async_exists_in_db_many(manager.engine, ["users", ("users", "foobar")]) == {
+        "users": True,
+        ("users", "foobar"): False,
+    }
+
+
+async def test_async_exists_in_db_create_drop(manager):
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(
+        None, partial(alembic.command.revision, manager.alembic_cfg, rev_id="dummy")
+    )
+    await manager.create()
+    async with manager.Session() as session:
+        conn = await session.connection()
+        assert await async_exists_in_db(conn, "users")
+    await manager.drop()
+    async with manager.engine.connect() as conn:
+        assert not (await async_exists_in_db(conn, "users"))
+
+
 async def test_async_update_or_create_property(app, monkeypatch):
     session = mock.Mock()
     update_or_create = mock.AsyncMock()
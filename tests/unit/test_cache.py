@@ -0,0 +1,190 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+from unittest import mock
+
+import pytest
+import sqlalchemy
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.aio import get_by_pk as async_get_by_pk
+from sqlalchemy_helpers.cache import (
+    CacheBackend,
+    CacheStats,
+    identity_in_session,
+    MemoryBackend,
+    result_cache,
+)
+from sqlalchemy_helpers.manager import DatabaseManager, get_by_pk
+
+from .models import User
+
+
+@pytest.fixture
+def manager(app):
+    return DatabaseManager(app["db_uri"], app["alembic_dir"])
+
+
+@pytest.fixture
+def cached_users():
+    backend = MemoryBackend()
+    result_cache.configure(User, backend)
+    result_cache.stats.reset()
+    yield backend
+    result_cache.configure(User, None)
+
+
+@pytest.fixture
+def statements(manager):
+    statements = []
+    sqlalchemy.event.listen(
+        manager.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    return statements
+
+
+def test_memory_backend_lru():
+    backend = MemoryBackend(maxsize=2)
+    backend.set(("a",), {"v": 1})
+    backend.set(("b",), {"v": 2})
+    assert backend.get(("a",)) == {"v": 1}
+    backend.set(("c",), {"v": 3})
+    assert len(backend) == 2
+    assert backend.get(("b",)) is None
+    assert backend.get(("a",)) == {"v": 1}
+    backend.delete(("a",))
+    backend.delete(("a",))
+    assert backend.get(("a",)) is None
+    backend.clear()
+    assert len(backend) == 0
+
+
+def test_memory_backend_ttl(monkeypatch):
+    monotonic = mock.Mock(return_value=100)
+    monkeypatch.setattr("sqlalchemy_helpers.cache.time.monotonic", monotonic)
+    backend = MemoryBackend(ttl=10)
+    backend.set(("a",), {"v": 1})
+    monotonic.return_value = 109
+    assert backend.get(("a",)) == {"v": 1}
+    monotonic.return_value = 110
+    assert backend.get(("a",)) is None
+    assert len(backend) == 0
+
+
+def test_backend_interface():
+    backend = CacheBackend()
+    with pytest.raises(NotImplementedError):
+        backend.get(("a",))
+    with pytest.raises(NotImplementedError):
+        backend.set(("a",), {})
+    with pytest.raises(NotImplementedError):
+        backend.delete(("a",))
+    with pytest.raises(NotImplementedError):
+        backend.clear()
+
+
+def test_identity_in_session(manager):
+    manager.create()
+    with manager.Session() as session:
+        user = User(name="dummy")
+        session.add(user)
+        session.flush()
+        assert identity_in_session(session, User, user.id) == ((user.id,), True)
+        assert identity_in_session(session, User, (user.id,)) == ((user.id,), True)
+        assert identity_in_session(session, User, {"id": 42}) == ((42,), False)
+
+
+def test_get_by_pk_cached(manager, cached_users, statements):
+    manager.create()
+    with manager.Session() as session:
+        session.add(User(name="dummy", full_name="Dummy"))
+        session.commit()
+    with manager.Session() as session:
+        user = get_by_pk(1, session=session, model=User)
+        assert user.name == "dummy"
+        assert result_cache.stats == CacheStats(hits=0, misses=1)
+        # Already in the session
+        assert get_by_pk(1, session=session, model=User) is user
+        assert result_cache.stats == CacheStats(hits=0, misses=1)
+    statements.clear()
+    with manager.Session() as session:
+        user = get_by_pk(1, session=session, model=User)
+        assert statements == []
+        assert result_cache.stats == CacheStats(hits=1, misses=1)
+        assert user in session
+        assert user.full_name == "Dummy"
+        # Not found
+        assert get_by_pk(2, session=session, model=User) is None
+        assert len(cached_users) == 1
+
+
+def test_get_by_pk_cached_invalidation(manager, cached_users):
+    manager.create()
+    with manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+    with manager.Session() as session:
+        user = get_by_pk(1, session=session, model=User)
+        user.full_name = "Changed"
+        session.flush()
+        # Invalidated on commit only
+        assert len(cached_users) == 1
+        session.commit()
+        assert len(cached_users) == 0
+    with manager.Session() as session:
+        assert get_by_pk(1, session=session, model=User).full_name == "Changed"
+        assert len(cached_users) == 1
+        session.delete(get_by_pk(1, session=session, model=User))
+        session.flush()
+        session.rollback()
+        assert len(cached_users) == 0
+    # The model is not cached anymore
+    with manager.Session() as session:
+        get_by_pk(1, session=session, model=User).full_name = "Changed again"
+        session.flush()
+        result_cache.configure(User, None)
+        session.commit()
+    assert not result_cache.is_cached(User)
+
+
+def test_get_by_pk_not_cached(manager):
+    manager.create()
+    other_backend = MemoryBackend()
+    result_cache.configure(mock.Mock, other_backend)
+    with manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+        user = get_by_pk(1, session=session, model=User)
+        assert user.name == "dummy"
+        assert not result_cache.is_cached(User)
+        user.full_name = "Changed"
+        session.commit()
+    assert len(other_backend) == 0
+    result_cache.configure(mock.Mock, None)
+
+
+def test_result_cache_clear(cached_users):
+    cached_users.set(("key",), {})
+    result_cache.clear()
+    assert len(cached_users) == 0
+
+
+async def test_async_get_by_pk_cached(app, async_enabled_env_script, cached_users):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    await manager.create()
+    async with manager.Session() as session:
+        session.add(User(name="dummy"))
+        await session.commit()
+    async with manager.Session() as session:
+        assert (await async_get_by_pk(1, session=session, model=User)).name == "dummy"
+        assert result_cache.stats == CacheStats(hits=0, misses=1)
+    async with manager.Session() as session:
+        user = await async_get_by_pk(1, session=session, model=User)
+        assert user.name == "dummy"
+        assert result_cache.stats == CacheStats(hits=1, misses=1)
+        assert (await async_get_by_pk(1, session=session, model=User)) is user
+        assert (await async_get_by_pk(2, session=session, model=User)) is None
+    async with manager.Session() as session:
+        result_cache.configure(User, None)
+        assert (await async_get_by_pk(1, session=session, model=User)).name == "dummy"
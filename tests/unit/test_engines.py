@@ -0,0 +1,198 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import gc
+import os
+import threading
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.engines import _dispose_after_fork, engine_registry, EngineRegistry
+from sqlalchemy_helpers.manager import DatabaseManager
+
+
+# SQLite files use a NullPool with SQLAlchemy 1.4, and connections limited to their thread
+POOLED = {"poolclass": sa.pool.QueuePool, "connect_args": {"check_same_thread": False}}
+
+
+def test_shared_engine(app):
+    engines = len(engine_registry)
+    manager1 = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    manager2 = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    assert manager1.engine is manager2.engine
+    assert len(engine_registry) == engines + 1
+    engine = manager1.engine
+    with mock.patch.object(engine, "dispose") as dispose:
+        manager1.dispose()
+        dispose.assert_not_called()
+        # Disposing twice does not release the engine twice
+        manager1.dispose()
+        manager2.dispose()
+        dispose.assert_called_once_with()
+    assert len(engine_registry) == engines
+    manager3 = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    assert manager3.engine is not engine
+    manager3.dispose()
+
+
+def test_not_shared_by_default(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    unshared = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    assert unshared.engine is not manager.engine
+    with mock.patch.object(unshared.engine, "dispose") as dispose:
+        unshared.dispose()
+    dispose.assert_called_once_with()
+    manager.dispose()
+
+
+def test_engine_args(app):
+    kwargs = {"engine_args": {"echo": True}, "share_engine": True}
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    other = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    assert manager.engine is not other.engine
+    manager2 = DatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    assert manager.engine is manager2.engine
+    for m in (manager, manager2, other):
+        m.dispose()
+
+
+@pytest.mark.parametrize(
+    "uri", ["sqlite://", "sqlite:///:memory:", "sqlite:///file:shared?mode=memory&uri=true"]
+)
+def test_memory_database_not_shared(app, uri):
+    engines = len(engine_registry)
+    manager1 = DatabaseManager(uri, app["alembic_dir"], share_engine=True)
+    manager2 = DatabaseManager(uri, app["alembic_dir"], share_engine=True)
+    assert manager1.engine is not manager2.engine
+    assert len(engine_registry) == engines
+    manager1.dispose()
+    manager2.dispose()
+
+
+def test_registry_weak_references(app):
+    registry = EngineRegistry()
+    engine = registry.acquire(sa.create_engine, {"url": app["db_uri"]})
+    assert len(registry) == 1
+    # The engine was never released, but nothing uses it anymore
+    del engine
+    gc.collect()
+    assert len(registry) == 0
+    engine = registry.acquire(sa.create_engine, {"url": app["db_uri"]})
+    assert len(registry._engines) == 1
+    assert registry.release(engine)
+
+
+def test_registry_unhashable_args(app):
+    registry = EngineRegistry()
+    engine_args = {"url": app["db_uri"], "connect_args": {"timeout": 5, "dummy": [bytearray()]}}
+    engine = registry.acquire(sa.create_engine, engine_args)
+    assert registry.acquire(sa.create_engine, engine_args) is not engine
+    assert len(registry) == 0
+    assert registry.release(engine)
+    engine_args = {"url": app["db_uri"], "execution_options": {"dummy": {"a", "b"}}}
+    assert registry.acquire(sa.create_engine, engine_args) is registry.acquire(
+        sa.create_engine, engine_args
+    )
+
+
+async def test_async_shared_engine(app):
+    # SQLite files use a NullPool with SQLAlchemy 1.4
+    kwargs = {"engine_args": {"poolclass": sa.pool.AsyncAdaptedQueuePool}, "share_engine": True}
+    manager1 = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    manager2 = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    assert manager1.engine is manager2.engine
+    sync_manager = DatabaseManager(app["db_uri"], app["alembic_dir"], share_engine=True)
+    assert manager1.engine is not sync_manager.engine
+    sync_manager.dispose()
+    # Not shared by default
+    unshared = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    assert unshared.engine is not manager1.engine
+    async with manager1.engine.connect() as connection:
+        await connection.execute(sa.text("SELECT 1"))
+    await manager1.dispose()
+    await manager1.dispose()
+    assert manager2.engine.sync_engine.pool.checkedin() == 1
+    await manager2.dispose()
+    assert manager2.engine.sync_engine.pool.checkedin() == 0
+    await unshared.dispose()
+
+
+def test_dispose_after_fork(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], engine_args=POOLED)
+    with manager.engine.connect() as connection:
+        connection.execute(sa.text("SELECT 1"))
+    pool = manager.engine.pool
+    assert pool.checkedin() == 1
+    _dispose_after_fork()
+    assert manager.engine.pool is not pool
+    # The connections of the parent process are not closed
+    assert pool.checkedin() == 1
+    manager.dispose()
+
+
+def test_connection_from_another_process(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], engine_args=POOLED)
+    with manager.engine.connect() as connection:
+        dbapi_connection = connection.connection.dbapi_connection
+        connection.connection._connection_record.info["pid"] = -1
+    with manager.engine.connect() as connection:
+        assert connection.connection.dbapi_connection is not dbapi_connection
+        assert connection.connection._connection_record.info["pid"] == os.getpid()
+    manager.dispose()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="Requires os.fork()")
+def test_fork(app):
+    manager = DatabaseManager(
+        app["db_uri"], app["alembic_dir"], engine_args={**POOLED, "pool_size": 4}
+    )
+    with manager.engine.begin() as connection:
+        connection.execute(sa.text("CREATE TABLE counters (pid INTEGER, value INTEGER)"))
+    parent_pool = manager.engine.pool
+    errors = []
+
+    def hammer():
+        try:
+            insert_rows()
+        except Exception as e:
+            errors.append(e)
+
+    def insert_rows():
+        for value in range(50):
+            with manager.engine.begin() as connection:
+                record = connection.connection._connection_record
+                assert record.info["pid"] == os.getpid()
+                connection.execute(
+                    sa.text("INSERT INTO counters VALUES (:pid, :value)"),
+                    {"pid": os.getpid(), "value": value},
+                )
+
+    children = []
+    for _i in range(4):
+        pid = os.fork()
+        if pid == 0:  # pragma: no cover
+            status = 1
+            try:
+                assert manager.engine.pool is not parent_pool
+                threads = [threading.Thread(target=hammer) for _j in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                status = 1 if errors else 0
+            finally:
+                os._exit(status)
+        children.append(pid)
+    for pid in children:
+        _pid, status = os.waitpid(pid, 0)
+        assert os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+    with manager.engine.connect() as connection:
+        counts = connection.execute(
+            sa.text("SELECT pid, COUNT(*) FROM counters GROUP BY pid")
+        ).all()
+    assert sorted(counts) == sorted((pid, 200) for pid in children)
+    manager.dispose()
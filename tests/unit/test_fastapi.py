@@ -12,12 +12,22 @@ import pytest
 from click.testing import CliRunner
 from pydantic import AnyUrl, BaseModel, ConfigDict, DirectoryPath
 from pydantic_settings import BaseSettings
+from sqlalchemy import select
 
 from sqlalchemy_helpers.aio import AsyncDatabaseManager
-from sqlalchemy_helpers.fastapi import make_db_session, manager_from_config, syncdb
+from sqlalchemy_helpers.fastapi import (
+    AsyncHealthCheck,
+    check_health,
+    make_db_session,
+    make_health_router,
+    make_lifespan,
+    manager_from_config,
+    paginate,
+    syncdb,
+)
 from sqlalchemy_helpers.manager import exists_in_db
 
-from .models import User  # noqa: F401
+from .models import User
 
 
 @pytest.fixture
@@ -150,3 +160,53 @@ async def test_make_db_session_commit_exception(mocked_manager):
         await agen.asend(None)
     mock_session.rollback.assert_awaited_with()
     mock_session.close.assert_awaited_with()
+
+
+async def test_make_lifespan(manager):
+    await manager.create()
+    app = mock.Mock()
+    async with make_lifespan(manager, connections=2)(app):
+        assert app.state.db_warm_up.connections == 2
+        assert app.state.db_warm_up.errors == []
+    assert manager._disposed
+
+
+async def test_check_health(app, manager):
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    health_check = AsyncHealthCheck(manager, status_ttl=0)
+    response = mock.Mock()
+    result = await check_health(health_check, response)
+    assert response.status_code == 503
+    assert result["status"] == "NO_INFO"
+    await manager.create()
+    result = await check_health(health_check, response)
+    assert response.status_code == 200
+    assert result["ready"] is True
+
+
+async def test_make_health_router(app, manager):
+    pytest.importorskip("fastapi")
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    await manager.create()
+    router = make_health_router(AsyncHealthCheck(manager), path="/health")
+    [route] = router.routes
+    assert route.path == "/health"
+    assert route.methods == {"GET"}
+    response = mock.Mock()
+    result = await route.endpoint(response)
+    assert response.status_code == 200
+    assert result["ready"] is True
+    await manager.dispose()
+
+
+async def test_paginate(manager):
+    fastapi = pytest.importorskip("fastapi")
+    await manager.create()
+    async with manager.Session() as session:
+        session.add_all([User(name=f"user{i}") for i in range(3)])
+        await session.commit()
+        page = await paginate(session, select(User), order_by=[User.id], limit=2)
+        assert [u.name for u in page.items] == ["user0", "user1"]
+        with pytest.raises(fastapi.HTTPException) as excinfo:
+            await paginate(session, select(User), order_by=[User.id], after="not-a-cursor")
+    assert excinfo.value.status_code == 400
@@ -2,18 +2,26 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import dataclasses
 from functools import partial
 
 import alembic
-from flask import jsonify
+from flask import g, jsonify, request
+from sqlalchemy import select
+from werkzeug.utils import import_string as import_string_function
 
 from sqlalchemy_helpers.flask_ext import (
+    _RequestStatsSink,
     DatabaseExtension,
     first_or_404,
     get_or_404,
     get_url_from_app,
+    paginate,
+    RequestStats,
+    StatementBudgetExceeded,
 )
 from sqlalchemy_helpers.manager import exists_in_db
+from sqlalchemy_helpers.nplusone import NPlusOneError
 
 from .models import User
 
@@ -114,3 +122,223 @@ def test_flask_ext_get_url(flask_app_factory):
     flask_app = flask_app_factory({"SQLALCHEMY_DATABASE_URI": "sqlite:////inside/app/context"})
     with flask_app.app_context():
         assert get_url_from_app(factory) == "sqlite:////inside/app/context"
+
+
+def test_flask_ext_paginate(flask_app, flask_client):
+    db = DatabaseExtension(flask_app)
+    db.manager.create()
+    for name in ("user1", "user2", "user3"):
+        make_user(db, name)
+
+    @flask_app.route("/users")
+    def view():
+        page = paginate(select(User), order_by=[User.id], after=request.args.get("after"), limit=2)
+        return jsonify({"users": [u.name for u in page.items], "next": page.next_cursor})
+
+    @flask_app.route("/users-query")
+    def view_query():
+        page = paginate(db.session.query(User.name), order_by=[User.id], limit=2)
+        return jsonify(page.items)
+
+    response = flask_client.get("/users")
+    assert response.json["users"] == ["user1", "user2"]
+    response = flask_client.get(f"/users?after={response.json['next']}")
+    assert response.json == {"users": ["user3"], "next": None}
+    response = flask_client.get("/users?after=invalid")
+    assert response.status_code == 400
+    # Tampered cursor: [{"dec": "abc"}]
+    response = flask_client.get("/users?after=W3siZGVjIjogImFiYyJ9XQ")
+    assert response.status_code == 400
+    response = flask_client.get("/users-query")
+    assert response.json == ["user1", "user2"]
+
+
+def test_flask_ext_request_stats(flask_app_factory):
+    flask_app = flask_app_factory({"DB_REQUEST_STATS": True})
+    db = DatabaseExtension(flask_app)
+    with flask_app.app_context():
+        db.manager.create()
+        make_user(db, "dummy")
+
+    @flask_app.route("/")
+    def view():
+        User.get_one(name="dummy")
+        db.session.add(User(name="other"))
+        db.session.commit()
+        return jsonify(dataclasses.asdict(g.db_stats))
+
+    with flask_app.test_client() as client:
+        response = client.get("/")
+    stats = response.json
+    assert stats["statements"] == 2
+    assert stats["rows"] == 1
+    assert stats["db_time"] > 0
+    assert stats["pool_wait"] > 0
+    server_timing = response.headers["Server-Timing"]
+    assert server_timing.startswith("db;dur=")
+    assert 'desc="2 statements, 1 rows", db-pool;dur=' in server_timing
+
+
+def test_flask_ext_request_stats_sync(flask_app_factory):
+    flask_app = flask_app_factory({"DB_REQUEST_STATS": True, "DB_N_PLUS_ONE": "warn"})
+    db = DatabaseExtension(flask_app)
+    sync_cmd = flask_app.cli.commands["db"].commands["sync"]
+    runner = flask_app.test_cli_runner()
+    with flask_app.app_context():
+        engine = db.manager.engine
+    # The managers of the command are disposed, the listeners of the app engine are untouched
+    for _i in range(2):
+        assert "Database" in runner.invoke(sync_cmd).output
+    assert len(engine.dispatch.after_cursor_execute) == 2
+
+    @flask_app.route("/")
+    def view():
+        db.session.execute(select(1))
+        return jsonify(dataclasses.asdict(g.db_stats))
+
+    with flask_app.test_client() as client:
+        assert client.get("/").json["statements"] == 1
+
+
+def test_flask_ext_request_stats_disabled(flask_app, flask_client):
+    db = DatabaseExtension(flask_app)
+
+    @flask_app.route("/")
+    def view():
+        db.session.execute(select(1))
+        return jsonify("db_stats" in g)
+
+    response = flask_client.get("/")
+    assert response.json is False
+    assert "Server-Timing" not in response.headers
+
+
+def test_flask_ext_statement_budget(flask_app_factory):
+    flask_app = flask_app_factory({"DB_STATEMENT_BUDGET": 2})
+    db = DatabaseExtension(flask_app)
+    with flask_app.app_context():
+        db.manager.create()
+        # Outside of a request
+        assert db.session.execute(select(1)).scalar() == 1
+
+    @flask_app.route("/<int:count>")
+    def view(count):
+        for _i in range(count):
+            db.session.execute(select(1))
+        return "ok"
+
+    with flask_app.test_client() as client:
+        assert client.get("/2").status_code == 200
+        response = client.get("/3")
+        assert response.status_code == 500
+        assert "budget of 2 database statements" in response.get_data(as_text=True)
+        assert "Server-Timing" not in response.headers
+
+
+def start_times(connection):
+    return {key: value for key, value in connection.info.items() if key.startswith("_sqlah")}
+
+
+def test_flask_ext_statement_budget_start_times(flask_app_factory):
+    flask_app = flask_app_factory({"DB_STATEMENT_BUDGET": 1})
+    db = DatabaseExtension(flask_app)
+    with flask_app.app_context():
+        query_log = db.manager.log_slow_queries()
+
+    @flask_app.route("/")
+    def view():
+        connection = db.session.connection()
+        try:
+            for _i in range(2):
+                db.session.execute(select(1))
+        except StatementBudgetExceeded:
+            # The start times of the failed statement are removed
+            return jsonify(list(start_times(connection).values()))
+        return jsonify(None)
+
+    with flask_app.test_client() as client:
+        assert client.get("/").json == [{}, {}]
+    query_log.remove()
+
+
+def test_flask_ext_request_stats_sink(flask_app):
+    sink = _RequestStatsSink()
+    with flask_app.test_request_context():
+        g.db_stats = RequestStats()
+        sink.gauge("_sqlah_request.pool.in_use", 1)
+        sink.increment("_sqlah_request.pool.checkouts")
+        sink.observe("_sqlah_request.other", 1)
+        assert g.db_stats == RequestStats()
+    # Outside of the app context
+    sink.increment("_sqlah_request.statements")
+
+
+def test_flask_ext_health(flask_app_factory, app):
+    flask_app = flask_app_factory({"DB_HEALTH_ENDPOINT": "/healthz/db", "DB_HEALTH_STATUS_TTL": 0})
+    db = DatabaseExtension(flask_app)
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    with flask_app.test_client() as client:
+        response = client.get("/healthz/db")
+        assert response.status_code == 503
+        assert response.json["live"] is True
+        assert response.json["status"] == "NO_INFO"
+        with flask_app.app_context():
+            db.manager.create()
+            assert db.health_check.status_ttl == 0
+        response = client.get("/healthz/db")
+        assert response.status_code == 200
+        assert response.json["ready"] is True
+
+
+def test_flask_ext_no_health(flask_app, flask_client):
+    DatabaseExtension(flask_app)
+    assert flask_client.get("/healthz/db").status_code == 404
+
+
+def test_flask_ext_lazy(flask_app_factory, mocker):
+    import_string = mocker.patch(
+        "sqlalchemy_helpers.flask_ext.import_string", wraps=import_string_function
+    )
+    flask_app = flask_app_factory({"DB_LAZY": True})
+    db = DatabaseExtension(flask_app)
+    import_string.assert_not_called()
+    with flask_app.app_context():
+        manager = db.manager
+        import_string.assert_called_once_with("tests.unit.models")
+        assert "engine" not in manager.__dict__
+        manager.create()
+        assert exists_in_db(db.session.get_bind(), "users")
+
+
+def test_flask_ext_lazy_listeners(flask_app_factory):
+    flask_app = flask_app_factory(
+        {
+            "DB_LAZY": True,
+            "DB_N_PLUS_ONE": "raise",
+            "DB_N_PLUS_ONE_THRESHOLD": 1,
+            "DB_REQUEST_STATS": True,
+        }
+    )
+    db = DatabaseExtension(flask_app)
+    with flask_app.app_context():
+        assert db.manager.n_plus_one_detector is None
+        assert "engine" not in db.manager.__dict__
+
+    @flask_app.route("/")
+    def view():
+        try:
+            for _i in range(2):
+                db.session.execute(select(1))
+        except NPlusOneError:
+            return jsonify(g.db_stats.statements)
+        return jsonify(None)
+
+    # The engine is created in the first request, which is checked too
+    with flask_app.test_client() as client:
+        for _i in range(2):
+            assert client.get("/").json >= 1
+    with flask_app.app_context():
+        assert db.manager.n_plus_one_detector is not None
+        # The scopes of the requests are closed
+        for _i in range(2):
+            db.session.execute(select(1))
@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import asyncio
+import threading
+import time
+from unittest import mock
+
+import alembic
+import pytest
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.pool import NullPool, QueuePool
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.health import AsyncHealthCheck, get_pool_status, HealthCheck, PoolStatus
+from sqlalchemy_helpers.manager import DatabaseManager, DatabaseStatus
+
+
+@pytest.fixture
+def manager(app):
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    # SQLite files use a NullPool with SQLAlchemy 1.4, and connections limited to their thread
+    engine_args = {
+        "poolclass": QueuePool,
+        "pool_size": 2,
+        "max_overflow": 1,
+        "connect_args": {"check_same_thread": False},
+    }
+    return DatabaseManager(app["db_uri"], app["alembic_dir"], engine_args=engine_args)
+
+
+def test_health_check(manager, mocker):
+    health_check = HealthCheck(manager)
+    report = health_check.check()
+    assert report.live
+    assert not report.ready
+    assert report.status == DatabaseStatus.NO_INFO
+    manager.create()
+    # The schema status is cached
+    get_status = mocker.spy(manager, "get_status")
+    assert not health_check.check().ready
+    get_status.assert_not_called()
+    health_check.clear()
+    report = health_check.check()
+    assert report.ready
+    assert report.latency > 0
+    assert report.pool == PoolStatus(size=2, checked_out=0, overflow=0, max_overflow=1)
+    assert report.as_dict() == {
+        "live": True,
+        "ready": True,
+        "status": "UP_TO_DATE",
+        "latency": report.latency,
+        "pool": {
+            "size": 2,
+            "checked_out": 0,
+            "overflow": 0,
+            "max_overflow": 1,
+            "saturation": 0.0,
+        },
+        "error": None,
+    }
+    get_status.assert_called_once()
+
+
+def test_health_check_status_ttl(manager, mocker):
+    manager.create()
+    health_check = HealthCheck(manager, status_ttl=0.0)
+    get_status = mocker.spy(manager, "get_status")
+    health_check.check()
+    health_check.check()
+    assert get_status.call_count == 2
+
+
+def test_health_check_saturation(manager):
+    manager.create()
+    health_check = HealthCheck(manager, timeout=0.1, max_saturation=0.5)
+    connections = [manager.engine.connect()]
+    report = health_check.check()
+    # The health check's connection is returned to the pool
+    assert report.pool.checked_out == 1
+    assert report.pool.saturation == pytest.approx(1 / 3)
+    assert report.ready
+    connections.append(manager.engine.connect())
+    report = health_check.check()
+    assert report.pool.saturation == pytest.approx(2 / 3)
+    assert report.live
+    assert not report.ready
+    # No connection is available
+    connections.append(manager.engine.connect())
+    report = health_check.check()
+    assert report.pool.saturation == 1.0
+    assert not report.live
+    for connection in connections:
+        connection.close()
+
+
+def test_health_check_errors(manager):
+    health_check = HealthCheck(manager, timeout=0.1)
+    with mock.patch.object(manager.engine, "connect", side_effect=lambda: time.sleep(0.5)):
+        report = health_check.check()
+    assert not report.live
+    assert not report.ready
+    assert report.error == "The database did not answer within 0.1s"
+    health_check = HealthCheck(manager)
+    with mock.patch.object(manager.engine, "connect", side_effect=RuntimeError("dummy")):
+        report = health_check.check()
+    assert report.error == "RuntimeError: dummy"
+    assert report.as_dict()["status"] is None
+
+
+def test_health_check_hung_probe(manager):
+    health_check = HealthCheck(manager, timeout=0.1)
+    release = threading.Event()
+    with mock.patch.object(manager.engine, "connect", side_effect=release.wait) as connect:
+        report = health_check.check()
+        assert report.error == "The database did not answer within 0.1s"
+        # The hung probe is not queued again
+        report = health_check.check()
+        assert not report.live
+        assert report.error == "The previous health check has not finished yet"
+        assert connect.call_count == 1
+        release.set()
+        health_check._future.exception()
+    assert health_check.check().live
+
+
+def test_pool_status(app):
+    manager = DatabaseManager(
+        app["db_uri"], app["alembic_dir"], engine_args={"poolclass": QueuePool, "max_overflow": -1}
+    )
+    assert get_pool_status(manager.engine, max_overflow=-1).saturation is None
+    assert HealthCheck(manager).check().pool.saturation is None
+    # The default max_overflow of SQLAlchemy
+    assert get_pool_status(manager.engine).saturation == 0.0
+    manager = DatabaseManager(
+        app["db_uri"], app["alembic_dir"], engine_args={"poolclass": NullPool}
+    )
+    assert get_pool_status(manager.engine) is None
+
+
+async def test_async_health_check(app, async_enabled_env_script):
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    await manager.create()
+    health_check = AsyncHealthCheck(manager, timeout=0.1)
+    report = await health_check.check()
+    assert report.ready
+    assert report.status == DatabaseStatus.UP_TO_DATE
+    # The schema status is cached
+    with mock.patch.object(manager, "get_status") as get_status:
+        assert (await health_check.check()).ready
+    get_status.assert_not_called()
+
+    async def hang():
+        await asyncio.sleep(0.5)
+
+    with mock.patch.object(health_check, "_probe", hang):
+        report = await health_check.check()
+    assert report.error == "The database did not answer within 0.1s"
+    with mock.patch.object(AsyncEngine, "connect", side_effect=RuntimeError("dummy")):
+        report = await health_check.check()
+    assert report.error == "RuntimeError: dummy"
+    # No thread pool for the async health check
+    assert not isinstance(health_check, HealthCheck)
+    assert not hasattr(health_check, "_executor")
+    await manager.dispose()
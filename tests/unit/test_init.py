@@ -0,0 +1,87 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import sqlalchemy_helpers
+from sqlalchemy_helpers import manager, pagination
+
+
+HELPERS_SCRIPT = """
+from sqlalchemy import Column, Integer, Unicode
+
+from sqlalchemy_helpers import Base, DatabaseManager, get_or_create
+
+
+class User(Base):
+    __tablename__ = "users"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(Unicode(254), unique=True, nullable=False)
+
+
+db = DatabaseManager("{db_uri}", "{alembic_dir}", lazy=True)
+Base.metadata.create_all(db.engine)
+with db.Session() as session:
+    get_or_create(session, User, name="dummy")
+"""
+
+
+def imported_modules(script):
+    """Run a script in a fresh interpreter and get the names of the modules it imported."""
+    package_path = os.path.dirname(os.path.dirname(sqlalchemy_helpers.__file__))
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([package_path, os.environ.get("PYTHONPATH", "")]),
+    }
+    result = subprocess.run(  # noqa: S603
+        [sys.executable, "-X", "importtime", "-c", script],
+        check=True,
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    return {
+        line.split("|")[-1].strip()
+        for line in result.stderr.splitlines()
+        if line.startswith("import time:")
+    }
+
+
+def imports_alembic(modules):
+    return [module for module in modules if module.split(".")[0] == "alembic"]
+
+
+def test_lazy_exports():
+    assert sqlalchemy_helpers.DatabaseManager is manager.DatabaseManager
+    assert sqlalchemy_helpers.paginate is pagination.paginate
+    assert "get_or_create" in dir(sqlalchemy_helpers)
+    assert "__version__" in sqlalchemy_helpers.__all__
+    with pytest.raises(AttributeError):
+        sqlalchemy_helpers.dummy  # noqa: B018
+
+
+def test_import_is_light():
+    modules = imported_modules("import sqlalchemy_helpers")
+    assert "sqlalchemy_helpers" in modules
+    assert "sqlalchemy" not in modules
+
+
+def test_helpers_do_not_import_alembic(app):
+    modules = imported_modules(
+        HELPERS_SCRIPT.format(db_uri=app["db_uri"], alembic_dir=app["alembic_dir"])
+    )
+    assert "sqlalchemy.orm" in modules
+    assert not imports_alembic(modules)
+
+
+@pytest.mark.parametrize("module", ["sqlalchemy_helpers.aio", "sqlalchemy_helpers.fastapi"])
+def test_async_modules_do_not_import_alembic(module):
+    modules = imported_modules(f"import {module}")
+    assert module in modules
+    assert not imports_alembic(modules)
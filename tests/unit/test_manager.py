@@ -2,24 +2,57 @@
 #
 # SPDX-License-Identifier: LGPL-3.0-or-later
 
+import gc
+import os
+import shutil
+import time
+from collections import namedtuple
 from unittest import mock
 
 import alembic
 import pytest
+import sqlalchemy
+from alembic.script import ScriptDirectory
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from sqlalchemy.orm.exc import NoResultFound
 
+from sqlalchemy_helpers.engines import engine_registry
 from sqlalchemy_helpers.manager import (
+    _info_caches,
+    _keyset_after,
+    _primary_key_from_attrs,
+    _upsert_many_statement,
+    _upsert_result,
+    _upsert_returning,
+    _upsert_statement,
+    CacheStats,
+    clear_inspection_cache,
     DatabaseManager,
     DatabaseStatus,
     exists_in_db,
+    exists_in_db_many,
+    get_base,
+    get_one,
     get_or_create,
+    get_or_create_many,
+    identity_map_stats,
     is_sqlite,
+    iter_all,
+    StatementCache,
     SyncResult,
     update_or_create,
+    update_or_create_many,
+    UpsertResult,
 )
 
 from .models import User
 
 
+requires_sqla2 = pytest.mark.skipif(
+    sqlalchemy.__version__.startswith("1."), reason="Upserts require SQLAlchemy 2.0"
+)
+
+
 @pytest.fixture
 def manager(app):
     return DatabaseManager(app["db_uri"], app["alembic_dir"])
@@ -27,11 +60,76 @@ def manager(app):
 
 def test_manager_engine_args(app, monkeypatch):
     create_engine = mock.Mock()
+    monkeypatch.setattr("sqlalchemy_helpers.manager.protect_from_fork", mock.Mock())
     monkeypatch.setattr("sqlalchemy_helpers.manager.create_engine", create_engine)
     DatabaseManager(app["db_uri"], app["alembic_dir"], engine_args={"foo": "bar"})
     create_engine.assert_called_once_with(url=app["db_uri"], foo="bar")
 
 
+def test_manager_lazy(app, mocker):
+    create_engine = mocker.patch(
+        "sqlalchemy_helpers.manager.create_engine", wraps=sqlalchemy.create_engine
+    )
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    assert "engine" not in manager.__dict__
+    assert "alembic_cfg" not in manager.__dict__
+    create_engine.assert_not_called()
+    assert manager.alembic_cfg.get_main_option("script_location") == app["alembic_dir"]
+    create_engine.assert_not_called()
+    manager.create()
+    with manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+    create_engine.assert_called_once()
+    # Another thread set the engines up while this one was waiting for the lock
+    assert manager.__getattr__("engine") is manager.engine
+    create_engine.assert_called_once()
+    assert User.get_one(name="dummy").name == "dummy"
+    manager.Session.remove()
+    with pytest.raises(AttributeError):
+        manager.dummy  # noqa: B018
+    manager.dispose()
+    # Never used
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    manager.dispose()
+    assert "engine" not in manager.__dict__
+
+
+def test_manager_lazy_configure(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], lazy=True)
+    manager.Session.configure(expire_on_commit=False)
+    assert "engine" not in manager.__dict__
+    manager.create()
+    with manager.Session() as session:
+        assert session.bind is manager.engine
+        assert not session.expire_on_commit
+        # The manager's session arguments are kept
+        assert not session.autoflush
+    manager.Session.remove()
+    manager.Session.configure(autoflush=True)
+    with manager.Session() as session:
+        assert session.autoflush
+    manager.dispose()
+
+
+def test_manager_lazy_setup_failure(app):
+    engines = len(engine_registry)
+    manager = DatabaseManager(
+        app["db_uri"],
+        app["alembic_dir"],
+        shards={"other": "notadialect://"},
+        share_engine=True,
+        lazy=True,
+    )
+    for _i in range(2):
+        with pytest.raises(sqlalchemy.exc.NoSuchModuleError):
+            manager.engine  # noqa: B018
+        assert "engine" not in manager.__dict__
+        # The engine of the main database was released
+        assert len(engine_registry) == engines
+    manager.dispose()
+
+
 def test_manager_no_revision(manager):
     assert manager.get_latest_revision() is None
 
@@ -41,6 +139,45 @@ def test_manager_get_latest_revision(manager):
     assert manager.get_latest_revision() == "dummy"
 
 
+def make_old(path):
+    mtime = time.time() - 60
+    os.utime(path, (mtime, mtime))
+
+
+def test_manager_script_cache(app, manager, mocker):
+    versions = os.path.join(app["alembic_dir"], "versions")
+    from_config = mocker.spy(ScriptDirectory, "from_config")
+    alembic.command.revision(manager.alembic_cfg, rev_id="first")
+    from_config.reset_mock()
+    # A recent modification time is not trusted
+    assert manager.get_latest_revision() == "first"
+    assert manager.get_latest_revision() == "first"
+    assert from_config.call_count == 2
+    make_old(versions)
+    script_dir = manager.get_script_directory()
+    assert manager.get_latest_revision() == "first"
+    assert manager.get_script_directory() is script_dir
+    assert from_config.call_count == 3
+    # Adding a revision changes the versions directory
+    alembic.command.revision(manager.alembic_cfg, rev_id="second")
+    make_old(versions)
+    from_config.reset_mock()
+    assert manager.get_latest_revision() == "second"
+    assert manager.get_latest_revision() == "second"
+    assert from_config.call_count == 1
+    manager._script_cache.clear()
+    assert manager.get_latest_revision() == "second"
+    assert from_config.call_count == 2
+
+
+def test_manager_script_cache_no_versions(app, manager, mocker):
+    shutil.rmtree(os.path.join(app["alembic_dir"], "versions"))
+    from_config = mocker.spy(ScriptDirectory, "from_config")
+    assert manager.get_latest_revision() is None
+    assert manager.get_latest_revision() is None
+    assert from_config.call_count == 1
+
+
 def test_manager_create(manager):
     alembic.command.revision(manager.alembic_cfg, rev_id="dummy")
     manager.create()
@@ -78,6 +215,105 @@ def test_manager_drop(manager):
 # Query helpers
 
 
+def test_get_one_primary_key(manager, session):
+    manager.create()
+    user = User(name="dummy")
+    session.add(user)
+    session.flush()
+    identity_map_stats.reset()
+    statements = []
+    sqlalchemy.event.listen(
+        manager.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    # Loaded in the session: no query
+    assert get_one(session, User, id=user.id) is user
+    assert statements == []
+    assert identity_map_stats == CacheStats(hits=1, misses=0)
+    # Not loaded in the session
+    session.expunge_all()
+    assert get_one(session, User, id=user.id).name == "dummy"
+    assert len(statements) == 1
+    assert identity_map_stats == CacheStats(hits=1, misses=1)
+    with pytest.raises(NoResultFound):
+        get_one(session, User, id=user.id + 1)
+    # Not only the primary key
+    assert get_one(session, User, id=user.id, name="dummy").name == "dummy"
+    assert get_one(session, User, id=user.id, name="dummy").name == "dummy"
+    assert identity_map_stats == CacheStats(hits=1, misses=2)
+    # Null primary key
+    with pytest.raises(NoResultFound):
+        get_one(session, User, id=None)
+    identity_map_stats.reset()
+    assert identity_map_stats == CacheStats(hits=0, misses=0)
+
+
+def test_primary_key_from_attrs_composite():
+    class Membership(get_base()):
+        __tablename__ = "memberships"
+        user_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+        group_id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+
+    assert _primary_key_from_attrs(Membership, {"group_id": 2, "user_id": 1}) == (1, 2)
+    assert _primary_key_from_attrs(Membership, {"user_id": 1}) is None
+    assert _primary_key_from_attrs(Membership, {"user_id": 1, "other": 2}) is None
+
+
+def test_statement_cache(manager, session):
+    manager.create()
+    session.add_all([User(name="foo", full_name="Foo"), User(name="bar")])
+    session.flush()
+    cache = StatementCache(maxsize=2)
+    stmt, params = cache.get(User, {"name": "foo"})
+    assert params == {"name": "foo"}
+    assert session.execute(stmt, params).scalar_one().full_name == "Foo"
+    stmt2, params = cache.get(User, {"name": "bar"})
+    assert stmt2 is stmt
+    assert params == {"name": "bar"}
+    assert cache.stats == CacheStats(hits=1, misses=1)
+    # Comparisons with None
+    stmt3, params = cache.get(User, {"full_name": None})
+    assert stmt3 is not stmt
+    assert params == {}
+    assert session.execute(stmt3, params).scalar_one().name == "bar"
+    # LRU eviction
+    cache.get(User, {"name": "foo"})
+    cache.get(User, {"name": "foo", "full_name": "Foo"})
+    assert len(cache) == 2
+    assert cache.get(User, {"full_name": None})[0] is not stmt3
+    assert cache.stats == CacheStats(hits=2, misses=4)
+    cache.clear()
+    assert len(cache) == 0
+
+
+def test_statement_cache_relationship(session):
+    base = get_base()
+
+    class Parent(base):
+        __tablename__ = "parents"
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+
+    class Child(base):
+        __tablename__ = "children"
+        id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
+        parent_id = sqlalchemy.Column(sqlalchemy.Integer, sqlalchemy.ForeignKey("parents.id"))
+        parent = sqlalchemy.orm.relationship(Parent)
+
+    base.metadata.create_all(bind=session.get_bind())
+    parent = Parent()
+    session.add(parent)
+    session.flush()
+    cache = StatementCache()
+    # Relationship filters are not cached
+    stmt, params = cache.get(Child, {"parent": parent})
+    assert params == {}
+    assert len(cache) == 0
+    assert cache.stats == CacheStats(hits=0, misses=0)
+    child, created = get_or_create(session, Child, parent=parent)
+    assert created is True
+    assert get_one(session, Child, parent=parent) is child
+    assert update_or_create(session, Child, parent=parent)[1] is False
+
+
 def test_get_or_create(manager, session):
     manager.create()
     user, created = get_or_create(session, User, name="dummy")
@@ -100,6 +336,67 @@ def test_get_or_create_property(manager, session):
     assert user.id == user2.id
 
 
+def test_get_or_create_many(manager, session):
+    manager.create()
+    existing = User(name="existing")
+    session.add(existing)
+    session.flush()
+    results = get_or_create_many(
+        session,
+        User,
+        [{"name": "new1"}, {"name": "existing"}, {"name": "new2"}, {"name": "new1"}],
+    )
+    assert [(user.name, created) for user, created in results] == [
+        ("new1", True),
+        ("existing", False),
+        ("new2", True),
+        ("new1", False),
+    ]
+    assert results[1][0] is existing
+    assert results[0][0] is results[3][0]
+    assert all(user.id is not None for user, _created in results)
+    assert session.query(User).count() == 3
+
+
+def test_get_or_create_many_key(manager, session):
+    manager.create()
+    session.add(User(name="existing", full_name="Old Value"))
+    session.flush()
+    results = get_or_create_many(
+        session,
+        User,
+        [
+            {"name": "existing", "full_name": "New Value"},
+            {"name": "new", "full_name": "New"},
+        ],
+        key="name",
+    )
+    assert [(user.full_name, created) for user, created in results] == [
+        ("Old Value", False),
+        ("New", True),
+    ]
+    # Composite key
+    results = get_or_create_many(
+        session,
+        User,
+        [{"name": "existing", "full_name": "Old Value"}, {"name": "new2", "full_name": "Other"}],
+        key=("name", "full_name"),
+    )
+    assert [created for _user, created in results] == [False, True]
+
+
+def test_get_or_create_many_empty(manager, session):
+    assert get_or_create_many(session, User, []) == []
+
+
+def test_get_or_create_many_property(manager, session):
+    manager.create()
+    results = User.get_or_create_many(rows=[{"name": "dummy"}])
+    assert [(user.name, created) for user, created in results] == [("dummy", True)]
+    results = User.get_or_create_many(rows=[{"name": "dummy"}])
+    assert [(user.name, created) for user, created in results] == [("dummy", False)]
+
+
 def test_update_or_create(manager, session):
     manager.create()
     user, created = update_or_create(session, User, name="dummy", defaults={"full_name": "Dummy"})
@@ -128,6 +425,203 @@ def test_update_or_create(manager, session):
     assert user3.full_name == "Correct Value"
 
 
+@requires_sqla2
+def test_update_or_create_upsert(manager, session):
+    manager.create()
+    user, created = update_or_create(
+        session, User, name="dummy", defaults={"full_name": "Dummy"}, upsert=True
+    )
+    # SQLite can't tell whether the row was created
+    assert created is None
+    assert isinstance(user, User)
+    assert user.name == "dummy"
+    assert user.full_name == "Dummy"
+    # Now update it, the instance in the session must be refreshed
+    user2, created = update_or_create(
+        session, User, name="dummy", defaults={"full_name": "New Value"}, upsert=True
+    )
+    assert user2 is user
+    assert user.full_name == "New Value"
+    # Without values to update
+    user3, created = update_or_create(session, User, name="dummy", upsert=True)
+    assert user3 is user
+    assert user.full_name == "New Value"
+    # Test create_defaults
+    user4, created = update_or_create(
+        session,
+        User,
+        name="dummy2",
+        defaults={"full_name": "Wrong Value"},
+        create_defaults={"full_name": "Correct Value"},
+        upsert=True,
+    )
+    assert user4.full_name == "Correct Value"
+    assert session.query(User).count() == 2
+
+
+@requires_sqla2
+def test_update_or_create_upsert_no_returning(manager, session, monkeypatch):
+    manager.create()
+    monkeypatch.setattr(session.get_bind().dialect, "insert_returning", False)
+    user, created = update_or_create(
+        session, User, name="dummy", defaults={"full_name": "Dummy"}, upsert=True
+    )
+    assert created is None
+    assert user.full_name == "Dummy"
+
+
+@requires_sqla2
+@pytest.mark.parametrize(
+    "dialect,expected",
+    [
+        (
+            postgresql.dialect(),
+            "INSERT INTO users (name, full_name) VALUES (%(name)s, %(full_name)s) "
+            "ON CONFLICT (name) DO UPDATE SET full_name = %(param_1)s "
+            "RETURNING users.id, users.name, users.full_name, xmax = 0 AS created",
+        ),
+        (
+            sqlite.dialect(),
+            "INSERT INTO users (name, full_name) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET full_name = ? "
+            "RETURNING id, name, full_name",
+        ),
+        (
+            mysql.dialect(),
+            "INSERT INTO users (name, full_name) VALUES (%s, %s) "
+            "ON DUPLICATE KEY UPDATE full_name = %s",
+        ),
+    ],
+)
+def test_upsert_statement(dialect, expected):
+    stmt = _upsert_statement(
+        dialect, User, {"name": "foo", "full_name": "Foo"}, ["name"], update={"full_name": "Foo"}
+    )
+    stmt = _upsert_returning(dialect, stmt, User)
+    assert " ".join(str(stmt.compile(dialect=dialect)).split()) == expected
+
+
+def test_upsert_statement_unsupported():
+    dialect = mock.Mock()
+    dialect.name = "oracle"
+    with pytest.raises(ValueError):
+        _upsert_statement(dialect, User, {"name": "foo"}, ["name"])
+
+
+def test_upsert_result_postgresql():
+    user = User(name="foo")
+    result = mock.Mock()
+    result.one.return_value = (user, True)
+    assert _upsert_result(postgresql.dialect(), result) == (user, True)
+
+
+@requires_sqla2
+def test_update_or_create_many(manager, session):
+    manager.create()
+    session.add(User(name="existing", full_name="Old Value"))
+    session.flush()
+    rows = ({"name": name, "full_name": f"Full {name}"} for name in ["new1", "existing", "new2"])
+    result = update_or_create_many(session, User, rows, keys="name", chunk_size=2)
+    assert result == UpsertResult(inserted=2, updated=1, objects=None)
+    assert {(user.name, user.full_name) for user in session.query(User)} == {
+        ("new1", "Full new1"),
+        ("existing", "Full existing"),
+        ("new2", "Full new2"),
+    }
+
+
+@requires_sqla2
+def test_update_or_create_many_options(manager, session):
+    manager.create()
+    existing = User(name="existing", full_name="Old Value")
+    session.add(existing)
+    session.flush()
+    rows = [
+        {"name": "existing", "full_name": "Ignored"},
+        {"name": "new", "full_name": "First"},
+        {"name": "new", "full_name": "Last"},
+    ]
+    result = update_or_create_many(
+        session, User, rows, keys=["name"], defaults_fields=[], return_objects=True
+    )
+    assert result.inserted == 1
+    assert result.updated == 1
+    assert {(user.name, user.full_name) for user in result.objects} == {
+        ("existing", "Old Value"),
+        ("new", "Last"),
+    }
+    assert existing in result.objects
+    # Default to the primary key
+    result = update_or_create_many(session, User, [{"id": existing.id, "name": "renamed"}])
+    assert result == UpsertResult(inserted=0, updated=1, objects=None)
+    # Instances in the session are only refreshed when they are returned
+    session.refresh(existing)
+    assert existing.name == "renamed"
+
+
+@requires_sqla2
+def test_update_or_create_many_no_returning(manager, session, monkeypatch):
+    manager.create()
+    monkeypatch.setattr(session.get_bind().dialect, "insert_returning", False)
+    result = update_or_create_many(
+        session, User, [{"name": "dummy", "full_name": "Dummy"}], keys="name", return_objects=True
+    )
+    assert result.inserted == 1
+    assert [user.full_name for user in result.objects] == ["Dummy"]
+
+
+@requires_sqla2
+def test_update_or_create_many_postgresql():
+    rows = [{"name": "foo", "full_name": "Foo"}]
+    dialect = postgresql.dialect()
+    stmt = _upsert_many_statement(dialect, User, rows, ("name",), None, False)
+    assert " ".join(str(stmt.compile(dialect=dialect)).split()) == (
+        "INSERT INTO users (name, full_name) VALUES (%(name_m0)s, %(full_name_m0)s) "
+        "ON CONFLICT (name) DO UPDATE SET full_name = excluded.full_name "
+        "RETURNING xmax = 0 AS created"
+    )
+    session = mock.Mock()
+    session.get_bind.return_value.dialect = dialect
+    user = User(name="foo")
+    Row = namedtuple("Row", ["user", "created"])
+    session.execute.return_value.all.return_value = [Row(user, True), Row(user, False)]
+    result = update_or_create_many(session, User, rows, keys="name", return_objects=True)
+    assert result == UpsertResult(inserted=1, updated=1, objects=[user, user])
+
+
+def test_iter_all(manager, session):
+    manager.create()
+    session.add_all([User(name=f"user{i}", full_name="Full" if i % 2 else None) for i in range(5)])
+    session.commit()
+    statements = []
+    sqlalchemy.event.listen(
+        manager.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    users = iter_all(session, User, chunk_size=2)
+    first = next(users)
+    assert first in session
+    assert [user.name for user in users] == ["user1", "user2", "user3", "user4"]
+    assert first not in session
+    assert len(session.identity_map) == 0
+    assert len(statements) == 3
+    # Filters and keeping the instances in the session
+    users = list(iter_all(session, User, chunk_size=2, expunge=False, full_name=None))
+    assert [user.name for user in users] == ["user0", "user2", "user4"]
+    assert all(user in session for user in users)
+    # Model property
+    assert [user.name for user in User.iter_all(chunk_size=10, full_name="Full")] == [
+        "user1",
+        "user3",
+    ]
+
+
+def test_keyset_after_composite():
+    columns = [User.__table__.c.id, User.__table__.c.name]
+    assert (
+        str(_keyset_after(columns, (1, "foo"))) == "(users.id, users.name) > (:param_1, :param_2)"
+    )
+
+
 def test_update_or_create_property(app, monkeypatch):
     update_or_create = mock.Mock()
     monkeypatch.setattr("sqlalchemy_helpers.manager.update_or_create", update_or_create)
@@ -142,6 +636,26 @@ def test_update_or_create_property(app, monkeypatch):
     update_or_create.assert_called_once_with(session=manager.Session(), model=User, **kwargs)
 
 
+def test_model_property_cached(manager):
+    assert User.get_one is User.get_one
+    assert User.get_one.__name__ == "get_one"
+    assert User(name="dummy").get_by_pk is User.get_by_pk
+
+
+def test_model_property_session_resolved_at_call_time(app, monkeypatch):
+    get_one = mock.Mock()
+    monkeypatch.setattr("sqlalchemy_helpers.manager.get_one", get_one)
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    helper = User.get_one
+    first_session = manager.Session()
+    helper(name="dummy")
+    get_one.assert_called_once_with(session=first_session, model=User, name="dummy")
+    manager.Session.remove()
+    helper(name="dummy")
+    assert get_one.call_args.kwargs["session"] is manager.Session()
+    assert get_one.call_args.kwargs["session"] is not first_session
+
+
 # Migration helpers
 
 
@@ -154,5 +668,45 @@ def test_exists_in_db(manager):
     assert not exists_in_db(bind, "users", "foobar")
 
 
+def test_exists_in_db_many(manager):
+    manager.create()
+    names = ["users", ("users", "id"), ("users", "name"), ("users", "foobar"), "foobar"]
+    names.append(("foobar", "id"))
+    assert exists_in_db_many(manager.engine, names) == {
+        "users": True,
+        ("users", "id"): True,
+        ("users", "name"): True,
+        ("users", "foobar"): False,
+        "foobar": False,
+        ("foobar", "id"): False,
+    }
+
+
+def test_exists_in_db_cache(manager):
+    with manager.engine.connect() as connection:
+        assert exists_in_db_many(connection, ["users"], cache=True) == {"users": False}
+        manager._base_model.metadata.create_all(bind=connection)
+        # The cached schema is out of date
+        assert exists_in_db_many(connection, ["users"], cache=True) == {"users": False}
+        assert exists_in_db(connection, "users")
+        clear_inspection_cache(connection)
+        assert exists_in_db(connection, "users", cache=True)
+        assert exists_in_db_many(connection, [("users", "id")], cache=True) == {
+            ("users", "id"): True
+        }
+
+
+def test_exists_in_db_cache_closed_connections(manager):
+    gc.collect()
+    cached = len(_info_caches)
+    for _i in range(5):
+        with manager.engine.connect() as connection:
+            exists_in_db(connection, "users", cache=True)
+    assert len(_info_caches) == cached + 1
+    del connection
+    gc.collect()
+    assert len(_info_caches) == cached
+
+
 def test_is_sqlite(manager):
     assert is_sqlite(manager.Session.get_bind())
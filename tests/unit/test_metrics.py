@@ -0,0 +1,185 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import pytest
+import sqlalchemy
+from sqlalchemy.pool import QueuePool
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.manager import DatabaseManager
+from sqlalchemy_helpers.metrics import Histogram, MemorySink, MetricsSink
+
+from .models import User
+
+
+ENGINE_ARGS = {"poolclass": QueuePool, "pool_size": 1, "max_overflow": 1, "pool_timeout": 0.01}
+
+
+@pytest.fixture
+def manager(app):
+    return DatabaseManager(app["db_uri"], app["alembic_dir"], engine_args=ENGINE_ARGS)
+
+
+def test_instrument(manager):
+    sink = MemorySink()
+    instrumentation = manager.instrument(sink)
+    with manager.engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+        assert sink.gauges == {"db.pool.in_use": 1, "db.pool.overflow": 0}
+    assert sink.gauges["db.pool.in_use"] == 0
+    assert sink.counters == {"db.pool.checkouts": 1, "db.pool.connects": 1, "db.statements": 1}
+    assert sink.histograms["db.pool.checkout_time"].count == 1
+    assert sink.histograms["db.statement_time"].count == 1
+    # Connections are reused
+    with manager.engine.connect() as connection:
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            connection.execute(sqlalchemy.text("SELECT * FROM not_a_table"))
+        connection.invalidate()
+    assert sink.counters == {
+        "db.pool.checkouts": 2,
+        "db.pool.connects": 1,
+        "db.statements": 2,
+        "db.statement_errors": 1,
+        "db.pool.invalidations": 1,
+    }
+    assert sink.histograms["db.statement_time"].count == 1
+    instrumentation.remove()
+    sink.reset()
+    with manager.engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+    assert sink.counters == sink.gauges == sink.histograms == {}
+
+
+def test_instrument_pool_exhausted(manager):
+    sink = MemorySink()
+    manager.instrument(sink, prefix="app.db")
+    with manager.engine.connect(), manager.engine.connect():
+        assert sink.gauges == {"app.db.pool.in_use": 2, "app.db.pool.overflow": 1}
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            manager.engine.connect()
+    assert sink.counters["app.db.pool.timeouts"] == 1
+    assert sink.histograms["app.db.pool.checkout_time"].count == 2
+
+
+def test_instrument_engine_disposed(manager):
+    sink = MemorySink()
+    manager.instrument(sink)
+    manager.engine.dispose()
+    with manager.engine.connect():
+        pass
+    assert sink.histograms["db.pool.checkout_time"].count == 1
+
+
+def test_instrument_session(manager):
+    sink = MemorySink()
+    manager.instrument(sink)
+    manager.create()
+    sink.reset()
+    with manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+        assert User.get_one(name="dummy").name == "dummy"
+    assert sink.counters["db.pool.checkouts"] == 2
+    assert sink.counters["db.statement_rows"] == 1
+    assert sink.gauges["db.pool.in_use"] == 0
+    assert sink.histograms["db.statement_time"].count == 2
+
+
+async def test_instrument_async(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    sink = MemorySink()
+    manager.instrument(sink)
+    async with manager.engine.connect() as connection:
+        await connection.execute(sqlalchemy.text("SELECT 1"))
+    assert sink.counters["db.pool.checkouts"] == 1
+    assert sink.gauges["db.pool.in_use"] == 0
+    assert sink.histograms["db.pool.checkout_time"].count == 1
+    assert sink.histograms["db.statement_time"].count == 1
+
+
+def test_histogram():
+    histogram = Histogram()
+    assert histogram.mean is None
+    for value in (2, 1, 3):
+        histogram.add(value)
+    assert histogram == Histogram(count=3, total=6, min=1, max=3)
+    assert histogram.mean == 2
+
+
+def test_sink_interface():
+    sink = MetricsSink()
+    with pytest.raises(NotImplementedError):
+        sink.increment("name")
+    with pytest.raises(NotImplementedError):
+        sink.gauge("name", 1)
+    with pytest.raises(NotImplementedError):
+        sink.observe("name", 1)
+
+
+def test_instrument_no_overflow(tmpdir):
+    # SingletonThreadPool has no overflow
+    manager = DatabaseManager("sqlite://", str(tmpdir))
+    sink = MemorySink()
+    manager.instrument(sink)
+    with manager.engine.connect():
+        assert sink.gauges == {"db.pool.in_use": 1}
+    # Connection errors
+    manager = DatabaseManager(f"sqlite:///{tmpdir}/missing/db.sqlite", str(tmpdir))
+    manager.instrument(sink)
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        manager.engine.connect()
+    assert sink.counters["db.statement_errors"] == 1
+
+
+def test_instrument_twice(manager):
+    sink1 = MemorySink()
+    sink2 = MemorySink()
+    instrumentation1 = manager.instrument(sink1)
+    instrumentation2 = manager.instrument(sink2)
+    with manager.engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+    assert sink1.histograms["db.pool.checkout_time"].count == 1
+    assert sink2.histograms["db.pool.checkout_time"].count == 1
+    instrumentation2.remove()
+    instrumentation1.remove()
+    assert "connect" not in manager.engine.pool.__dict__
+    # Removed in the order of creation
+    instrumentation1 = manager.instrument(sink1)
+    instrumentation2 = manager.instrument(sink2)
+    instrumentation1.remove()
+    with manager.engine.connect():
+        pass
+    assert sink1.histograms["db.pool.checkout_time"].count == 1
+    assert sink2.histograms["db.pool.checkout_time"].count == 2
+    instrumentation2.remove()
+    assert "connect" not in manager.engine.pool.__dict__
+
+
+def test_instrument_engine_dispose(manager):
+    sink = MemorySink()
+    instrumentation = manager.instrument(sink)
+    pool = manager.engine.pool
+    manager.engine.dispose()
+    assert "connect" not in pool.__dict__
+    with manager.engine.connect():
+        pass
+    assert sink.histograms["db.pool.checkout_time"].count == 1
+    instrumentation.remove()
+    assert "connect" not in manager.engine.pool.__dict__
+
+
+def test_instrument_dispose(app):
+    kwargs = {"engine_args": ENGINE_ARGS, "share_engine": True}
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    sink = MemorySink()
+    manager.instrument(sink).remove()
+    manager.instrument(sink)
+    other = DatabaseManager(app["db_uri"], app["alembic_dir"], **kwargs)
+    assert other.engine is manager.engine
+    # The instrumentations are removed from the shared engine
+    manager.dispose()
+    with other.engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+    assert sink.counters == {}
+    other.dispose()
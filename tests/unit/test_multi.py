@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import multiprocessing
+from concurrent.futures import Future
+
+import alembic
+import pytest
+from sqlalchemy import create_engine, inspect
+
+from sqlalchemy_helpers.aio import (
+    _run_async_action,
+    AsyncDatabaseManager,
+    AsyncMultiDatabaseManager,
+)
+from sqlalchemy_helpers.manager import DatabaseManager, DatabaseStatus, SyncResult
+from sqlalchemy_helpers.manager import Base, get_base
+from sqlalchemy_helpers.multi import (
+    _future_result,
+    _import_base_model,
+    _run_action,
+    MultiDatabaseManager,
+)
+
+
+BASE_MODEL = "tests.unit.models:Base"
+EmptyBase = get_base()
+
+
+def database_uris(tmpdir):
+    return [
+        f"sqlite:///{tmpdir}/tenant1.sqlite",
+        f"sqlite:///{tmpdir}/tenant2.sqlite",
+        f"sqlite:///{tmpdir}/missing/tenant3.sqlite",
+    ]
+
+
+def results(database_results):
+    return [(r.result, r.failed) for r in database_results]
+
+
+@pytest.fixture
+def multi_manager(app, tmpdir):
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    return MultiDatabaseManager(
+        database_uris(tmpdir), app["alembic_dir"], base_model=BASE_MODEL, max_workers=2
+    )
+
+
+def table_names(uri):
+    engine = create_engine(uri)
+    try:
+        return inspect(engine).get_table_names()
+    finally:
+        engine.dispose()
+
+
+def test_multi_manager(app, multi_manager):
+    status = multi_manager.get_status()
+    assert results(status) == [
+        (DatabaseStatus.NO_INFO, False),
+        (DatabaseStatus.NO_INFO, False),
+        (None, True),
+    ]
+    assert status[0].uri.endswith("tenant1.sqlite")
+    assert status[0].duration > 0
+    assert status[2].error.startswith("OperationalError: ")
+    sync = multi_manager.sync()
+    assert results(sync) == [
+        (SyncResult.CREATED, False),
+        (SyncResult.CREATED, False),
+        (None, True),
+    ]
+    assert sync[2].error.startswith("OperationalError: ")
+    assert "users" in table_names(multi_manager.uris[0])
+    alembic.command.revision(app["alembic_cfg"], rev_id="second")
+    assert results(multi_manager.get_status())[:2] == [
+        (DatabaseStatus.UPGRADE_AVAILABLE, False),
+        (DatabaseStatus.UPGRADE_AVAILABLE, False),
+    ]
+    assert results(multi_manager.upgrade())[:2] == [(None, False), (None, False)]
+    assert results(multi_manager.sync())[:2] == [
+        (SyncResult.ALREADY_UP_TO_DATE, False),
+        (SyncResult.ALREADY_UP_TO_DATE, False),
+    ]
+
+
+def test_multi_manager_no_databases(app):
+    assert MultiDatabaseManager([], app["alembic_dir"]).sync() == []
+
+
+def test_multi_manager_spawn(app, multi_manager):
+    # The spawned workers don't inherit the imported models, they must import the base.
+    multi_manager._mp_context = multiprocessing.get_context("spawn")
+    multi_manager.uris = multi_manager.uris[:1]
+    assert results(multi_manager.sync()) == [(SyncResult.CREATED, False)]
+    assert "users" in table_names(multi_manager.uris[0])
+
+
+def test_multi_manager_base_model_class(app):
+    with pytest.raises(TypeError):
+        MultiDatabaseManager([], app["alembic_dir"], base_model=object)
+
+
+def test_import_base_model():
+    assert _import_base_model(BASE_MODEL) is Base
+    assert _import_base_model("sqlalchemy_helpers.manager.Base") is Base
+
+
+def test_run_action_no_table(app, tmpdir):
+    uri = database_uris(tmpdir)[0]
+    result = _run_action(
+        DatabaseManager, uri, app["alembic_dir"], None, f"{__name__}:EmptyBase", "sync", ()
+    )
+    assert result.failed
+    assert result.error.startswith("ValueError: The declarative base has no table")
+
+
+def test_run_action(app, tmpdir):
+    uri = database_uris(tmpdir)[0]
+    result = _run_action(DatabaseManager, uri, app["alembic_dir"], None, BASE_MODEL, "sync", ())
+    assert result.result == SyncResult.CREATED
+    assert result.uri == uri
+    assert "users" in table_names(uri)
+
+
+def test_future_result_crash(tmpdir):
+    future = Future()
+    future.set_exception(RuntimeError("worker crashed"))
+    result = _future_result(database_uris(tmpdir)[0], "sync", future)
+    assert result.failed
+    assert result.error == "RuntimeError: worker crashed"
+
+
+def test_run_async_action(app, async_enabled_env_script, tmpdir):
+    uri = database_uris(tmpdir)[0]
+    result = _run_async_action(
+        AsyncDatabaseManager, uri, app["alembic_dir"], None, BASE_MODEL, "sync", ()
+    )
+    assert result.result == SyncResult.CREATED
+    assert "users" in table_names(uri)
+
+
+async def test_async_multi_manager(app, async_enabled_env_script, tmpdir):
+    alembic.command.revision(app["alembic_cfg"], rev_id="first")
+    multi_manager = AsyncMultiDatabaseManager(
+        database_uris(tmpdir), app["alembic_dir"], base_model=BASE_MODEL, max_workers=2
+    )
+    assert results(await multi_manager.get_status()) == [
+        (DatabaseStatus.NO_INFO, False),
+        (DatabaseStatus.NO_INFO, False),
+        (None, True),
+    ]
+    assert results(await multi_manager.sync()) == [
+        (SyncResult.CREATED, False),
+        (SyncResult.CREATED, False),
+        (None, True),
+    ]
+    assert "users" in table_names(multi_manager.uris[0])
+    alembic.command.revision(app["alembic_cfg"], rev_id="second")
+    assert results(await multi_manager.upgrade())[:2] == [(None, False), (None, False)]
+    assert results(await multi_manager.get_status())[:2] == [
+        (DatabaseStatus.UP_TO_DATE, False),
+        (DatabaseStatus.UP_TO_DATE, False),
+    ]
+    assert await AsyncMultiDatabaseManager([], app["alembic_dir"]).sync() == []
@@ -0,0 +1,174 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import contextvars
+import warnings
+
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship, selectinload
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.fastapi import make_db_session
+from sqlalchemy_helpers.flask_ext import DatabaseExtension
+from sqlalchemy_helpers.manager import DatabaseManager, get_base
+from sqlalchemy_helpers.metrics import MemorySink
+from sqlalchemy_helpers.nplusone import NPlusOneError, NPlusOneWarning
+
+
+Base = get_base()
+
+
+class Author(Base):
+    __tablename__ = "authors"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.Unicode(254), nullable=False)
+    books = relationship("Book", back_populates="author")
+
+
+class Book(Base):
+    __tablename__ = "books"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    author_id = sa.Column(sa.Integer, sa.ForeignKey("authors.id"))
+    author = relationship("Author", back_populates="books")
+
+
+@pytest.fixture
+def manager(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"], base_model=Base)
+    Base.metadata.create_all(manager.engine)
+    with manager.Session() as session:
+        session.add_all([Author(name=f"author{i}", books=[Book()]) for i in range(3)])
+        session.commit()
+    return manager
+
+
+def read_books(session):
+    for author in session.query(Author).all():
+        author.books  # noqa: B018
+
+
+def test_warning(manager):
+    detector = manager.detect_n_plus_one(threshold=2)
+    with manager.Session() as session:
+        with pytest.warns(NPlusOneWarning) as record:
+            with detector.scope():
+                read_books(session)
+                session.expire_all()
+                read_books(session)
+    assert len(record) == 1
+    message = str(record[0].message)
+    assert message.startswith(
+        "Potential N+1 query: the same statement was executed 3 times, "
+        "by the lazy load of Author.books: SELECT"
+    )
+    assert "WHERE ? = books.author_id" in message
+
+
+def test_raise(manager):
+    manager.detect_n_plus_one(threshold=2, raise_error=True)
+    detector = manager.detect_n_plus_one(threshold=1, raise_error=True)
+    with manager.Session() as session:
+        with pytest.raises(NPlusOneError) as excinfo:
+            with detector.scope():
+                read_books(session)
+    assert excinfo.value.count == 2
+    assert excinfo.value.attribute == "Author.books"
+
+
+def test_raise_start_times(manager):
+    manager.instrument(MemorySink())
+    query_log = manager.log_slow_queries()
+    detector = manager.detect_n_plus_one(threshold=1, raise_error=True)
+    with manager.engine.connect() as connection:
+        with pytest.raises(NPlusOneError):
+            with detector.scope():
+                for _i in range(2):
+                    connection.execute(sa.select(1))
+        # The start times of the statement are removed
+        assert [value for key, value in connection.info.items() if key.startswith("_sqlah")] == [
+            {},
+            {},
+        ]
+    query_log.remove()
+
+
+def test_not_repeated(manager):
+    detector = manager.detect_n_plus_one(threshold=1, raise_error=True)
+    with manager.Session() as session:
+        with detector.scope():
+            # Eager loading
+            for author in session.query(Author).options(selectinload(Author.books)):
+                author.books  # noqa: B018
+        # Outside of a scope
+        session.expire_all()
+        read_books(session)
+
+
+def test_other_queries(manager):
+    detector = manager.detect_n_plus_one(threshold=1, raise_error=True)
+    with manager.Session() as session:
+        with pytest.raises(NPlusOneError) as excinfo:
+            with detector.scope():
+                for i in range(3):
+                    session.execute(sa.select(Author).where(Author.name == f"author{i}"))
+    assert excinfo.value.attribute is None
+    assert "lazy load" not in str(excinfo.value)
+    detector.remove()
+    with manager.Session() as session:
+        with detector.scope():
+            read_books(session)
+
+
+def test_flask(flask_app_factory):
+    flask_app = flask_app_factory({"DB_N_PLUS_ONE": "raise", "DB_N_PLUS_ONE_THRESHOLD": 2})
+    db = DatabaseExtension(flask_app, base_model=Base)
+    with flask_app.app_context():
+        Base.metadata.create_all(db.manager.engine)
+        db.session.add_all([Author(name=f"author{i}", books=[Book()]) for i in range(3)])
+        db.session.commit()
+        assert db.manager.n_plus_one_detector.threshold == 2
+
+    @flask_app.route("/")
+    def view():
+        try:
+            read_books(db.session)
+        except NPlusOneError as e:
+            return e.attribute
+        return "ok"
+
+    with flask_app.test_client() as client:
+        assert client.get("/").data == b"Author.books"
+
+
+def test_flask_disabled(flask_app):
+    db = DatabaseExtension(flask_app)
+    with flask_app.app_context():
+        assert db.manager.n_plus_one_detector is None
+
+
+async def test_fastapi(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"], base_model=Base)
+    async with manager.engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    manager.detect_n_plus_one(threshold=1)
+    agen = make_db_session(manager)
+    session = await agen.asend(None)
+    with warnings.catch_warnings(record=True) as record:
+        warnings.simplefilter("always")
+        for i in range(2):
+            await session.execute(sa.select(Author).where(Author.name == f"author{i}"))
+    with pytest.raises(StopAsyncIteration):
+        await agen.asend(None)
+    assert len(record) == 1
+    assert record[0].category is NPlusOneWarning
+
+
+def test_scope_other_context(manager):
+    detector = manager.detect_n_plus_one()
+    token = contextvars.copy_context().run(detector._enter_scope)
+    # Does not raise
+    detector._exit_scope(token)
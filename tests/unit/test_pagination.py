@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import base64
+import datetime
+import json
+import uuid
+from decimal import Decimal
+from unittest import mock
+
+import pytest
+import sqlalchemy
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.aio import paginate as async_paginate
+from sqlalchemy_helpers.manager import DatabaseManager
+from sqlalchemy_helpers.pagination import (
+    _decode_cursor,
+    _encode_cursor,
+    _Explain,
+    InvalidCursor,
+    Page,
+    paginate,
+)
+
+from .models import User
+
+
+@pytest.fixture
+def manager(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    manager.create()
+    with manager.Session() as session:
+        session.add_all([User(name=f"user{i:02d}", full_name=f"User {i % 2}") for i in range(5)])
+        session.commit()
+    return manager
+
+
+def test_paginate(manager):
+    with manager.Session() as session:
+        query = session.query(User)
+        page = paginate(query, order_by=[User.id], limit=2)
+        assert [u.name for u in page.items] == ["user00", "user01"]
+        assert page.has_next
+        page = paginate(query, order_by=[User.id], after=page.next_cursor, limit=2)
+        assert [u.name for u in page.items] == ["user02", "user03"]
+        page = paginate(query, order_by=[User.id], after=page.next_cursor, limit=2)
+        assert [u.name for u in page.items] == ["user04"]
+        assert page.next_cursor is None
+        assert not page.has_next
+        assert page.total is None
+
+
+def test_paginate_statements(manager):
+    statements = []
+    sqlalchemy.event.listen(
+        manager.engine, "before_cursor_execute", lambda *args: statements.append(args[2])
+    )
+    with manager.Session() as session:
+        page = paginate(select(User), order_by=[User.full_name, User.id], limit=2, session=session)
+        paginate(
+            select(User),
+            order_by=[User.full_name, User.id],
+            after=page.next_cursor,
+            session=session,
+        )
+    assert "(users.full_name, users.id) > (?, ?)" in statements[1]
+
+
+def test_paginate_descending(manager):
+    with manager.Session() as session:
+        stmt = select(User.name, User.full_name).order_by(User.name)
+        order_by = [User.full_name.desc(), User.id.desc()]
+        page = paginate(stmt, order_by=order_by, limit=3, session=session)
+        assert page.items == [
+            ("user03", "User 1"),
+            ("user01", "User 1"),
+            ("user04", "User 0"),
+        ]
+        page = paginate(stmt, order_by=order_by, after=page.next_cursor, session=session)
+        assert page.items == [("user02", "User 0"), ("user00", "User 0")]
+
+
+def test_paginate_total(manager):
+    with manager.Session() as session:
+        query = session.query(User).filter(User.full_name == "User 0")
+        page = paginate(query, order_by=User.id, limit=1, estimate_total=True)
+        assert page.total == 3
+        page = paginate(query, order_by=User.id, limit=1, estimate_total=True, max_count=2)
+        assert page.total == 2
+
+
+def test_paginate_total_postgresql():
+    session = mock.Mock()
+    session.get_bind.return_value.dialect = postgresql.dialect()
+    session.execute.return_value.all.return_value = []
+    plan = [{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 1234}}]
+    for result in (plan, json.dumps(plan)):
+        session.execute.return_value.scalar.return_value = result
+        page = paginate(select(User), order_by=[User.id], session=session, estimate_total=True)
+        assert page == Page(items=[], next_cursor=None, total=1234)
+    explain = session.execute.call_args[0][0]
+    assert isinstance(explain, _Explain)
+    assert str(explain.compile(dialect=postgresql.dialect())).startswith(
+        "EXPLAIN (FORMAT JSON) SELECT users.id"
+    )
+
+
+def test_paginate_invalid(manager):
+    with manager.Session() as session:
+        query = session.query(User)
+        with pytest.raises(ValueError):
+            paginate(query, order_by=[User.id], limit=0)
+        with pytest.raises(ValueError):
+            paginate(query, order_by=[])
+        with pytest.raises(ValueError):
+            paginate(query, order_by=[User.name, User.id.desc()])
+        for cursor in ("!!!", _encode_cursor([1, 2]), "e30", "W3siZm9vIjoxfV0"):
+            with pytest.raises(InvalidCursor):
+                paginate(query, order_by=[User.id], after=cursor)
+
+
+def test_cursor_values():
+    values = [
+        None,
+        True,
+        42,
+        1.5,
+        "text",
+        datetime.datetime(2023, 1, 2, 3, 4, 5, tzinfo=datetime.timezone.utc),
+        datetime.date(2023, 1, 2),
+        datetime.time(3, 4, 5),
+        Decimal("1.10"),
+        uuid.UUID("12345678-1234-5678-1234-567812345678"),
+    ]
+    cursor = _encode_cursor(values)
+    assert "=" not in cursor
+    assert _decode_cursor(cursor, len(values)) == values
+    with pytest.raises(TypeError):
+        _encode_cursor([object()])
+
+
+@pytest.mark.parametrize("value", ['{"dec": "abc"}', '{"uuid": 42}', '{"dt": 42}', '{"x": 1}'])
+def test_cursor_invalid_values(value):
+    cursor = base64.urlsafe_b64encode(f"[{value}]".encode()).decode()
+    with pytest.raises(InvalidCursor):
+        _decode_cursor(cursor, 1)
+
+
+async def test_async_paginate(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    await manager.create()
+    async with manager.Session() as session:
+        session.add_all([User(name=f"user{i}") for i in range(3)])
+        await session.commit()
+    async with manager.Session() as session:
+        page = await async_paginate(session, select(User), order_by=[User.id], limit=2)
+        assert [u.name for u in page.items] == ["user0", "user1"]
+        page = await async_paginate(
+            session, select(User), order_by=[User.id], after=page.next_cursor, estimate_total=True
+        )
+        assert [u.name for u in page.items] == ["user2"]
+        assert page.next_cursor is None
+        assert page.total == 3
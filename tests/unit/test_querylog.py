@@ -0,0 +1,207 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import contextvars
+from collections import Counter
+from unittest import mock
+
+import pytest
+import sqlalchemy
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.aio import get_one as async_get_one
+from sqlalchemy_helpers.fastapi import make_db_session
+from sqlalchemy_helpers.flask_ext import DatabaseExtension
+from sqlalchemy_helpers import querylog
+from sqlalchemy_helpers.manager import DatabaseManager
+from sqlalchemy_helpers.querylog import (
+    _enter_origin,
+    _exit_origin,
+    current_origin,
+    fingerprint,
+    query_origin,
+    QueryStats,
+    tag_origin,
+)
+
+from .models import User
+
+
+@pytest.fixture
+def manager(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    manager.create()
+    return manager
+
+
+@pytest.fixture
+def query_log(manager):
+    query_log = manager.log_slow_queries(threshold=10)
+    yield query_log
+    query_log.remove()
+
+
+@pytest.mark.parametrize(
+    "statement,expected",
+    [
+        (
+            "SELECT users.id FROM users WHERE users.name = ? AND users.id IN (?, ?, ?)",
+            "SELECT users.id FROM users WHERE users.name = ? AND users.id IN (...)",
+        ),
+        (
+            "SELECT anon_1.id FROM t2 AS anon_1\n  WHERE  anon_1.x = 'it''s' LIMIT 10",
+            "SELECT anon_1.id FROM t2 AS anon_1 WHERE anon_1.x = ? LIMIT ?",
+        ),
+        (
+            "INSERT INTO users (name) VALUES (%(name_m0)s), (%(name_m1)s)",
+            "INSERT INTO users (name) VALUES (...)",
+        ),
+        ("SELECT $1::integer, %s, :name", "SELECT ?::integer, ?, ?"),
+    ],
+)
+def test_fingerprint(statement, expected):
+    assert fingerprint(statement) == expected
+
+
+def test_slow_query_log(manager, query_log):
+    with manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+        User.get_one(name="dummy")
+        User.get_one(name="dummy")
+        session.execute(sqlalchemy.text("SELECT 1"))
+    top = query_log.top(n=2, key="count")
+    assert top[0].count == 2
+    assert top[0].origins == {"get_one": 2}
+    assert "WHERE users.name = ?" in top[0].fingerprint
+    assert top[0].mean_time > 0
+    assert top[1].count == 1
+    assert len(query_log.top()) == 3
+    insert = next(s for s in query_log.top() if s.fingerprint.startswith("INSERT"))
+    assert insert.rows == 1
+    assert insert.origins == {None: 1}
+    query_log.reset()
+    assert query_log.top() == []
+
+
+def test_slow_query_log_nested_origin(manager, query_log):
+    with manager.Session():
+        with query_origin("report"):
+            User.get_or_create(name="dummy")
+            assert current_origin() == "report"
+        assert current_origin() is None
+        list(User.iter_all())
+    origins = sum((Counter(stats.origins) for stats in query_log.top()), Counter())
+    assert origins == {
+        "report > get_or_create > get_one": 1,
+        "report > get_or_create": 1,
+        "iter_all": 1,
+    }
+
+
+def test_slow_query_log_threshold(manager, mocker):
+    log = mocker.patch("sqlalchemy_helpers.querylog._log")
+    query_log = manager.log_slow_queries(threshold=0)
+    with manager.engine.connect() as connection:
+        with query_origin("test"):
+            connection.execute(sqlalchemy.text("SELECT 42"))
+        with pytest.raises(sqlalchemy.exc.OperationalError):
+            connection.execute(sqlalchemy.text("SELECT * FROM not_a_table"))
+    query_log.remove()
+    # SQLite does not report the number of rows of SELECT statements
+    log.warning.assert_called_once_with(
+        "Slow query (%.3fs, %s rows) from %s: %s", mock.ANY, "?", "test", "SELECT ?"
+    )
+
+
+def test_slow_query_log_several(manager):
+    tracking = querylog._tracking
+    query_log1 = manager.log_slow_queries()
+    query_log2 = manager.log_slow_queries()
+    with manager.engine.connect() as connection:
+        connection.execute(sqlalchemy.text("SELECT 1"))
+    assert [s.count for s in query_log1.top()] == [1]
+    assert [s.count for s in query_log2.top()] == [1]
+    query_log1.remove()
+    query_log1.remove()
+    assert querylog._tracking == tracking + 1
+    # The query logs of the manager are removed when it is disposed
+    manager.dispose()
+    assert querylog._tracking == tracking
+    assert not sqlalchemy.event.contains(
+        manager.engine, "before_cursor_execute", query_log2._before_cursor_execute
+    )
+
+
+def test_slow_query_log_max_fingerprints(query_log):
+    query_log.max_fingerprints = 2
+    query_log.record("SELECT 1 FROM a", 3)
+    query_log.record("SELECT 1 FROM b", 1)
+    query_log.record("SELECT 1 FROM c", 2)
+    assert [s.fingerprint for s in query_log.top()] == ["SELECT ? FROM a", "SELECT ? FROM c"]
+    assert QueryStats(fingerprint="x").mean_time == 0
+
+
+def test_origin_not_tracked():
+    @tag_origin("func")
+    def func():
+        return current_origin()
+
+    with query_origin("outside"):
+        assert func() is None
+    assert _enter_origin("outside") is None
+    _exit_origin(None)
+
+
+def test_origin_other_context(query_log):
+    token = contextvars.copy_context().run(_enter_origin, "other")
+    # Does not raise
+    _exit_origin(token)
+    assert current_origin() is None
+
+
+def test_flask_endpoint_origin(flask_app, flask_client):
+    db = DatabaseExtension(flask_app)
+    db.manager.create()
+
+    @flask_app.route("/user/<name>")
+    def user_view(name):
+        return User.get_one(name=name).name
+
+    with db.manager.Session() as session:
+        session.add(User(name="dummy"))
+        session.commit()
+    query_log = db.manager.log_slow_queries(threshold=10)
+    response = flask_client.get("/user/dummy")
+    query_log.remove()
+    assert response.data == b"dummy"
+    assert query_log.top()[0].origins == {"user_view > get_one": 1}
+
+
+async def test_async_origin(app, async_enabled_env_script):
+    manager = AsyncDatabaseManager(app["db_uri"], app["alembic_dir"])
+    await manager.create()
+    query_log = manager.log_slow_queries(threshold=10)
+    request = mock.Mock()
+    request.scope = {"route": mock.Mock(path="/users/{name}")}
+    agen = make_db_session(manager, request=request)
+    session = await agen.asend(None)
+    session.add(User(name="dummy"))
+    await session.flush()
+    await async_get_one(session, User, name="dummy")
+    with pytest.raises(StopAsyncIteration):
+        await agen.asend(None)
+    query_log.remove()
+    assert current_origin() is None
+    origins = sum((Counter(stats.origins) for stats in query_log.top()), Counter())
+    assert origins == {"/users/{name}": 1, "/users/{name} > get_one": 1}
+
+
+def test_slow_query_log_connection_error(tmpdir):
+    manager = DatabaseManager(f"sqlite:///{tmpdir}/missing/db.sqlite", str(tmpdir))
+    query_log = manager.log_slow_queries()
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        manager.engine.connect()
+    query_log.remove()
+    assert query_log.top() == []
@@ -0,0 +1,258 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import asyncio
+import threading
+from unittest import mock
+
+import pytest
+import sqlalchemy as sa
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.manager import Base, DatabaseManager
+from sqlalchemy_helpers.replicas import (
+    _check_replica,
+    ReplicaHealth,
+    ReplicaRouter,
+    ReplicaStatus,
+    RoutingSession,
+)
+
+from .models import User
+
+
+def replica_uris(tmpdir, count=2):
+    return [f"sqlite:///{tmpdir}/replica{i}.sqlite" for i in range(count)]
+
+
+def add_user(engine, name):
+    with engine.begin() as connection:
+        connection.execute(sa.insert(User.__table__).values(name=name))
+
+
+@pytest.fixture
+def manager(app, tmpdir):
+    manager = DatabaseManager(
+        app["db_uri"], app["alembic_dir"], replica_uris=replica_uris(tmpdir), read_your_writes=60
+    )
+    manager.create()
+    add_user(manager.engine, "primary")
+    for i, engine in enumerate(manager.replica_engines):
+        Base.metadata.create_all(engine)
+        add_user(engine, f"replica{i}")
+    return manager
+
+
+def test_round_robin(manager):
+    with manager.Session() as session:
+        names = [session.execute(sa.select(User.name)).scalar_one() for _i in range(3)]
+        session.commit()
+    assert names == ["replica0", "replica1", "replica0"]
+    # Committing reads does not send the next reads to the primary
+    assert manager.replica_router._primary_until == 0
+
+
+def test_helpers(manager):
+    with manager.Session():
+        assert User.get_by_pk(1).name == "replica0"
+        assert User.get_one(id=1).name == "replica1"
+        # Locking reads
+        stmt = sa.select(User.name).with_for_update()
+        assert manager.Session.execute(stmt).scalar_one() == "primary"
+        # Non-select statements
+        assert manager.Session.execute(sa.text("SELECT name FROM users")).scalar_one() == "primary"
+
+
+def test_read_your_writes(manager):
+    with manager.Session() as session:
+        assert session.execute(sa.select(User.name)).scalar_one() == "replica0"
+        session.add(User(name="new"))
+        session.flush()
+        # Read from the primary after a write in the transaction
+        names = session.execute(sa.select(User.name).order_by(User.id)).scalars().all()
+        assert names == ["primary", "new"]
+        session.commit()
+        # And for some time after the commit
+        assert session.execute(sa.select(User.name).order_by(User.id)).scalar() == "primary"
+    manager.replica_router._primary_until = 0
+    with manager.Session() as session:
+        session.execute(sa.update(User).values(full_name="Updated"))
+        assert session.execute(sa.select(User.full_name).limit(1)).scalar_one() == "Updated"
+        session.rollback()
+        assert session.execute(sa.select(User.full_name).limit(1)).scalar_one() is None
+    # A rollback is not a write
+    assert manager.replica_router._primary_until == 0
+
+
+def test_least_connections(app, tmpdir):
+    manager = DatabaseManager(
+        app["db_uri"],
+        app["alembic_dir"],
+        replica_uris=replica_uris(tmpdir),
+        replica_strategy="least-connections",
+        engine_args={"poolclass": sa.pool.QueuePool},
+    )
+    replica0, replica1 = manager.replica_engines
+    assert manager.replica_router.get_replica() is replica0
+    with replica0.connect():
+        assert manager.replica_router.get_replica() is replica1
+    # Pools without a checked out count
+    manager.replica_router.replicas = [mock.Mock(pool=object()), replica1]
+    assert manager.replica_router.get_replica() is manager.replica_router.replicas[0]
+
+
+def test_router():
+    primary = mock.Mock(spec=["pool"])
+    assert ReplicaRouter(primary, []).get_replica() is primary
+    with pytest.raises(ValueError):
+        ReplicaRouter(primary, [], strategy="random")
+
+
+def test_no_replicas(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    assert manager.replica_router is None
+    assert not isinstance(manager.Session(), RoutingSession)
+    session = RoutingSession(bind=manager.engine)
+    assert session.get_bind() is manager.engine
+
+
+async def test_async(app, async_enabled_env_script, tmpdir):
+    manager = AsyncDatabaseManager(
+        app["db_uri"], app["alembic_dir"], replica_uris=replica_uris(tmpdir, 1)
+    )
+    await manager.create()
+    async with manager.engine.begin() as connection:
+        await connection.execute(sa.insert(User.__table__).values(name="primary"))
+    async with manager.replica_engines[0].begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(sa.insert(User.__table__).values(name="replica0"))
+    async with manager.Session() as session:
+        assert isinstance(session.sync_session, RoutingSession)
+        assert (await User.get_by_pk(1, session=session)).name == "replica0"
+        session.add(User(name="new"))
+        await session.commit()
+        assert (await User.get_one(session, name="new")).id == 2
+
+
+def test_check_replicas(manager):
+    assert [health.status for health in manager.get_replica_status()] == [
+        ReplicaStatus.UNKNOWN,
+        ReplicaStatus.UNKNOWN,
+    ]
+    # Make the second replica unreachable
+    error = sa.exc.OperationalError("SELECT 1", {}, Exception("down"))
+    with mock.patch.object(manager.replica_engines[1], "connect", side_effect=error):
+        status = manager.check_replicas()
+    assert status[0].status == ReplicaStatus.HEALTHY
+    assert status[0].lag is None
+    assert status[0].latency > 0
+    assert status[1].status == ReplicaStatus.UNAVAILABLE
+    assert "down" in status[1].error
+    assert not status[1].available
+    with manager.Session() as session:
+        names = [session.execute(sa.select(User.name)).scalar_one() for _i in range(3)]
+    assert names == ["replica0", "replica0", "replica0"]
+    # The replica is back
+    status = manager.check_replicas()
+    assert status[1].status == ReplicaStatus.HEALTHY
+    assert status[1].error is None
+
+
+def test_round_robin_unavailable():
+    primary = mock.Mock(spec=["pool"])
+    replicas = [mock.Mock(spec=["url"]) for _i in range(3)]
+    router = ReplicaRouter(primary, replicas)
+    router.record_failure(1, Exception("down"))
+    assert [router.get_replica() for _i in range(3)] == [replicas[0], replicas[2], replicas[0]]
+    # No replica is available
+    for index in (0, 2):
+        router.record_failure(index, Exception("down"))
+    assert router.get_replica() is primary
+
+
+def test_replica_lag(manager):
+    router = manager.replica_router
+    router.max_lag = 10
+    router.record_check(0, 0.01, 42.0)
+    router.record_check(1, 0.01, 1.0)
+    router.record_check(1, 0.11, 1.0)
+    # Moving average of the latency
+    assert router.health[1].latency == pytest.approx(0.04)
+    assert router.health[0].status == ReplicaStatus.LAGGING
+    assert router.health[1].status == ReplicaStatus.HEALTHY
+    assert router.get_replica() is manager.replica_engines[1]
+    assert router.get_replica() is manager.replica_engines[1]
+    # No replica is available
+    router.record_failure(1, Exception("down"))
+    assert router.get_replica() is manager.engine
+
+
+def test_check_replica_postgresql():
+    connection = mock.Mock()
+    connection.dialect.name = "postgresql"
+    connection.execute.return_value.scalar.return_value = 3
+    assert _check_replica(connection) == 3.0
+    assert "pg_last_xact_replay_timestamp()" in str(connection.execute.call_args[0][0])
+    # Not a replica or no transaction replayed yet
+    connection.execute.return_value.scalar.return_value = None
+    assert _check_replica(connection) is None
+
+
+def test_latency_strategy():
+    primary = mock.Mock(spec=["pool"])
+    replicas = [mock.Mock(spec=["url"]) for _i in range(3)]
+    router = ReplicaRouter(primary, replicas, strategy="latency")
+    with mock.patch("random.choices", return_value=[2]) as choices:
+        assert router.get_replica() is replicas[2]
+    choices.assert_called_once_with([0, 1, 2], weights=[1.0, 1.0, 1.0])
+    router.record_check(0, 0.1, None)
+    router.record_check(1, 0.4, None)
+    router.record_failure(2, Exception("down"))
+    with mock.patch("random.choices", return_value=[0]) as choices:
+        assert router.get_replica() is replicas[0]
+    choices.assert_called_once_with([0, 1], weights=[pytest.approx(10), pytest.approx(2.5)])
+    # Replicas that have not been checked yet get the average latency
+    router.health[1] = ReplicaHealth(url="replica1")
+    with mock.patch("random.choices", return_value=[0]) as choices:
+        router.get_replica()
+    choices.assert_called_once_with([0, 1], weights=[pytest.approx(10), pytest.approx(10)])
+
+
+def test_replica_checks_thread(manager, mocker):
+    checked_twice = threading.Event()
+    check = mocker.patch.object(
+        manager, "check_replicas", side_effect=lambda: check.call_count > 1 and checked_twice.set()
+    )
+    manager.start_replica_checks(interval=0.001)
+    assert checked_twice.wait(5)
+    manager.start_replica_checks(interval=60)
+    manager.stop_replica_checks()
+    manager.stop_replica_checks()
+    assert check.call_count >= 2
+    assert manager._replica_checks is None
+
+
+def test_no_replicas_status(app):
+    manager = DatabaseManager(app["db_uri"], app["alembic_dir"])
+    assert manager.check_replicas() == []
+
+
+async def test_async_check_replicas(app, async_enabled_env_script, tmpdir):
+    manager = AsyncDatabaseManager(
+        app["db_uri"], app["alembic_dir"], replica_uris=replica_uris(tmpdir, 2)
+    )
+    manager.replica_engines[1].sync_engine.pool = sa.pool.NullPool(
+        mock.Mock(side_effect=sa.exc.OperationalError("", {}, Exception("down")))
+    )
+    status = await manager.check_replicas()
+    assert status[0].status == ReplicaStatus.HEALTHY
+    assert status[1].status == ReplicaStatus.UNAVAILABLE
+    with mock.patch.object(manager, "check_replicas") as check:
+        manager.start_replica_checks(interval=0)
+        manager.start_replica_checks(interval=0)
+        await asyncio.sleep(0.01)
+        await manager.stop_replica_checks()
+        await manager.stop_replica_checks()
+    assert check.await_count >= 1
+    assert manager._replica_checks is None
@@ -0,0 +1,258 @@
+# SPDX-FileCopyrightText: 2023 Contributors to the Fedora Project
+#
+# SPDX-License-Identifier: LGPL-3.0-or-later
+
+import threading
+from unittest import mock
+
+import alembic
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.orm import relationship
+
+from sqlalchemy_helpers.aio import AsyncDatabaseManager
+from sqlalchemy_helpers.manager import DatabaseManager, DatabaseStatus, get_base, SyncResult
+from sqlalchemy_helpers.querylog import current_origin, query_origin
+from sqlalchemy_helpers.sharding import DEFAULT_SHARD, ShardMap
+
+
+Base = get_base()
+
+
+class Tenant(Base):
+    __tablename__ = "tenants"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.Unicode(254), nullable=False)
+
+
+class Event(Base):
+    __tablename__ = "events"
+
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    name = sa.Column(sa.Unicode(254), nullable=False)
+    comments = relationship("Comment", back_populates="event")
+
+
+class Comment(Base):
+    __tablename__ = "comments"
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    event_id = sa.Column(sa.Integer, sa.ForeignKey("events.id"), nullable=False)
+    event = relationship("Event", back_populates="comments")
+
+
+def event_shard(attrs):
+    return "even" if attrs["id"] % 2 == 0 else "odd"
+
+
+def comment_shard(attrs):
+    return event_shard({"id": attrs["event_id"]})
+
+
+SHARD_KEYS = {Event: event_shard, Comment: comment_shard}
+
+
+def shard_uris(tmpdir):
+    return {"even": f"sqlite:///{tmpdir}/even.sqlite", "odd": f"sqlite:///{tmpdir}/odd.sqlite"}
+
+
+@pytest.fixture
+def manager(app, tmpdir):
+    manager = DatabaseManager(
+        app["db_uri"],
+        app["alembic_dir"],
+        base_model=Base,
+        shards=shard_uris(tmpdir),
+        shard_keys=SHARD_KEYS,
+    )
+    manager.create()
+    return manager
+
+
+def names(engine, table):
+    with engine.connect() as connection:
+        return connection.execute(sa.select(table.c.name).order_by(table.c.id)).scalars().all()
+
+
+def test_routing(manager):
+    with manager.Session() as session:
+        session.add(Tenant(name="tenant"))
+        for i in range(1, 5):
+            Event.get_or_create(id=i, name=f"event{i}")
+        session.commit()
+    assert names(manager.engine, Tenant.__table__) == ["tenant"]
+    assert names(manager.shard_engines["even"], Event.__table__) == ["event2", "event4"]
+    assert names(manager.shard_engines["odd"], Event.__table__) == ["event1", "event3"]
+    with manager.Session() as session:
+        assert Event.get_by_pk(2).name == "event2"
+        assert Event.get_one(id=3).name == "event3"
+        # Without the shard key, all the shards are queried
+        assert Event.get_one(name="event4").id == 4
+        assert sorted(e.name for e in session.scalars(sa.select(Event))) == [
+            "event1",
+            "event2",
+            "event3",
+            "event4",
+        ]
+        assert Tenant.get_one(name="tenant").id == 1
+        # Related objects are in the same shard
+        event = Event.get_by_pk(1)
+        session.add(Comment(event=event))
+        session.commit()
+        assert len(event.comments) == 1
+        assert sa.inspect(event.comments[0]).identity_token == sa.inspect(event).identity_token
+    with manager.Session() as session:
+        comment = session.scalars(sa.select(Comment)).one()
+        assert comment.event.name == "event1"
+
+
+def test_routing_criteria(manager):
+    with manager.Session() as session:
+        session.add_all([Event(id=1, name="event1"), Event(id=2, name="event2")])
+        session.commit()
+    shard_map = manager.shard_map
+    with mock.patch.object(shard_map, "shards_for", wraps=shard_map.shards_for) as shards_for:
+        with manager.Session() as session:
+            session.execute(sa.select(Event).where(Event.id == 2, Event.name != "x"))
+            session.execute(sa.select(Event).where(sa.or_(Event.id == 1, Event.id == 2)))
+            session.execute(sa.select(Event).where(sa.func.abs(Event.id) == 1))
+            session.execute(sa.update(Event).where(Event.id == 1).values(name="updated"))
+            session.commit()
+    assert [c.args[1] for c in shards_for.call_args_list] == [{"id": 2}, {}, {}, {"id": 1}]
+    assert names(manager.shard_engines["odd"], Event.__table__) == ["updated"]
+
+
+def test_routing_errors(manager):
+    with manager.Session() as session:
+        session.add(Event(name="no id"))
+        with pytest.raises(ValueError, match="The shard key of .* is not set"):
+            session.flush()
+    with manager.Session() as session:
+        with pytest.raises(ValueError, match="Can't choose the shard of an INSERT statement"):
+            session.execute(sa.insert(Event).values(id=1, name="event1"))
+        # With an explicit shard
+        session.execute(
+            sa.insert(Event).values(id=1, name="event1"), bind_arguments={"shard_id": "odd"}
+        )
+        session.commit()
+    assert names(manager.shard_engines["odd"], Event.__table__) == ["event1"]
+
+
+def test_shard_map():
+    engines = {"a": mock.Mock(spec=["url"]), "b": mock.Mock(spec=["url"])}
+    shard_map = ShardMap(mock.Mock(spec=["url"]), engines, {Event: event_shard})
+    assert shard_map.shards_for(Event, {"name": "event"}) == ["a", "b"]
+    assert shard_map.shards_for(Tenant, {}) == [DEFAULT_SHARD]
+    assert shard_map._choose_shard(sa.inspect(Event), None) == "a"
+    with pytest.raises(ValueError, match="reserved"):
+        ShardMap(mock.Mock(), {DEFAULT_SHARD: mock.Mock()})
+
+
+def test_fan_out(manager):
+    with manager.Session() as session:
+        session.add_all([Event(id=i, name=f"event{i}") for i in range(1, 5)])
+        session.commit()
+    threads = set()
+
+    @sa.event.listens_for(Event, "load")
+    def record_thread(target, context):
+        threads.add((threading.current_thread().name, current_origin()))
+
+    # The origin is propagated to the threads
+    query_log = manager.log_slow_queries()
+    with query_origin("report"):
+        result = manager.fan_out(sa.select(Event).where(Event.id > 1))
+    query_log.remove()
+    sa.event.remove(Event, "load", record_thread)
+    assert sorted(event.name for event in result.scalars()) == ["event2", "event3", "event4"]
+    assert {origin for _thread, origin in threads} == {"report"}
+    assert all(thread.startswith("sqlah-shard") for thread, _origin in threads)
+    rows = manager.fan_out(sa.select(sa.func.count(Event.id)), shard_ids=["odd"]).all()
+    assert rows == [(2,)]
+    with pytest.raises(ValueError):
+        manager.fan_out(sa.select(Event), shard_ids=[])
+
+
+def test_sync(app, tmpdir):
+    manager = DatabaseManager(
+        app["db_uri"], app["alembic_dir"], base_model=Base, shards=shard_uris(tmpdir)
+    )
+    alembic.command.revision(manager.alembic_cfg, rev_id="first")
+    assert manager.sync() == SyncResult.CREATED
+    assert manager.get_status() == DatabaseStatus.UP_TO_DATE
+    assert manager.get_shard_status() == {
+        "even": DatabaseStatus.UP_TO_DATE,
+        "odd": DatabaseStatus.UP_TO_DATE,
+    }
+    alembic.command.revision(manager.alembic_cfg, rev_id="second")
+    assert manager.get_shard_status() == {
+        "even": DatabaseStatus.UPGRADE_AVAILABLE,
+        "odd": DatabaseStatus.UPGRADE_AVAILABLE,
+    }
+    assert manager.sync_shards() == {"even": SyncResult.UPGRADED, "odd": SyncResult.UPGRADED}
+    assert manager.sync() == SyncResult.UPGRADED
+    alembic.command.revision(manager.alembic_cfg, rev_id="third")
+    manager.upgrade()
+    assert manager.sync_shards() == {
+        "even": SyncResult.ALREADY_UP_TO_DATE,
+        "odd": SyncResult.ALREADY_UP_TO_DATE,
+    }
+    manager.drop()
+    assert manager.get_shard_status() == {
+        "even": DatabaseStatus.NO_INFO,
+        "odd": DatabaseStatus.NO_INFO,
+    }
+    manager.dispose()
+
+
+def test_shards_and_replicas(app, tmpdir):
+    with pytest.raises(ValueError):
+        DatabaseManager(
+            app["db_uri"],
+            app["alembic_dir"],
+            replica_uris=[f"sqlite:///{tmpdir}/replica.sqlite"],
+            shards=shard_uris(tmpdir),
+        )
+
+
+async def test_async(app, async_enabled_env_script, tmpdir):
+    manager = AsyncDatabaseManager(
+        app["db_uri"],
+        app["alembic_dir"],
+        base_model=Base,
+        shards=shard_uris(tmpdir),
+        shard_keys=SHARD_KEYS,
+    )
+    alembic.command.revision(manager.alembic_cfg, rev_id="first")
+    assert await manager.sync() == SyncResult.CREATED
+    assert await manager.get_shard_status() == {
+        "even": DatabaseStatus.UP_TO_DATE,
+        "odd": DatabaseStatus.UP_TO_DATE,
+    }
+    async with manager.Session() as session:
+        for i in range(1, 4):
+            await Event.get_or_create(session, id=i, name=f"event{i}")
+        await session.commit()
+        assert (await Event.get_by_pk(2, session=session)).name == "event2"
+    odd_engine = sa.create_engine(shard_uris(tmpdir)["odd"])
+    assert names(odd_engine, Event.__table__) == ["event1", "event3"]
+    result = await manager.fan_out(sa.select(Event.name))
+    assert sorted(result.scalars()) == ["event1", "event2", "event3"]
+    with pytest.raises(ValueError):
+        await manager.fan_out(sa.select(Event.name), shard_ids=[])
+    alembic.command.revision(manager.alembic_cfg, rev_id="second")
+    assert await manager.sync_shards() == {"even": SyncResult.UPGRADED, "odd": SyncResult.UPGRADED}
+    assert await manager.sync() == SyncResult.UPGRADED
+    alembic.command.revision(manager.alembic_cfg, rev_id="third")
+    await manager.upgrade()
+    assert await manager.get_shard_status() == {
+        "even": DatabaseStatus.UP_TO_DATE,
+        "odd": DatabaseStatus.UP_TO_DATE,
+    }
+    await manager.drop()
+    assert await manager.get_shard_status() == {
+        "even": DatabaseStatus.NO_INFO,
+        "odd": DatabaseStatus.NO_INFO,
+    }
+    await manager.dispose()